@@ -1,42 +1,28 @@
-import sqlite3
 import pandas as pd
 import os
+import sys
+
+# 📌 Permette di importare il package `app` lanciando lo script dalla sua cartella
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.database import DB_PATH, connessione, crea_tabella, upsert_progetti
 
 # 📌 Percorsi dei file
 csv_file = "progetti_DB.csv"  # Assicurati che il file sia nella stessa cartella dello script
-db_file = "progetti_DB.sqlite"  # Nome del database SQLite
+db_file = DB_PATH  # Database SQLite condiviso con il backend (variabile d'ambiente PROGETTI_DB_PATH)
 
 def crea_database():
     """ Crea il database e la tabella progetti_successo se non esistono """
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
+    # 📌 Stessa connessione (WAL, busy_timeout) usata poi da upsert_progetti: non va chiusa
+    conn = connessione(db_file)
 
     # Creiamo la tabella nel database
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS progetti_successo (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nome TEXT UNIQUE,
-            citta TEXT,
-            paese TEXT,
-            anno INTEGER,
-            superficie_mq INTEGER,
-            tipologia TEXT,
-            problema TEXT,
-            interventi TEXT,
-            costo_milioni REAL,
-            finanziamento TEXT,
-            benefici_sociali TEXT,
-            benefici_economici TEXT,
-            sostenibilita TEXT
-        )
-    """)
-
-    conn.commit()
-    conn.close()
+    with conn:
+        crea_tabella(conn)
     print("✅ Database e tabella creati con successo!")
 
-def inserisci_dati():
-    """ Inserisce i dati dal file CSV nel database SQLite """
+def inserisci_dati(aggiorna=False):
+    """ Inserisce i dati dal file CSV nel database SQLite (con `aggiorna=True` aggiorna i progetti già presenti) """
     if not os.path.exists(csv_file):
         print(f"❌ ERRORE: Il file CSV '{csv_file}' non esiste!")
         return
@@ -44,30 +30,11 @@ def inserisci_dati():
     # 📌 Carica il CSV (modifica il separatore se necessario)
     df = pd.read_csv(csv_file, sep=";")  # Cambia `sep=","` se il separatore è diverso
 
-    # 📌 Connessione al database
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-
-    # 📌 Inseriamo i dati evitando duplicati (basandoci sul nome del progetto)
-    for _, row in df.iterrows():
-        try:
-            cursor.execute("""
-                INSERT INTO progetti_successo (
-                    nome, citta, paese, anno, superficie_mq, tipologia, problema, interventi,
-                    costo_milioni, finanziamento, benefici_sociali, benefici_economici, sostenibilita
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                row["nome"], row["citta"], row["paese"], row["anno"],
-                row["superficie_mq"], row["tipologia"], row["problema"], row["interventi"],
-                row["costo_milioni"], row["finanziamento"], row["benefici_sociali"],
-                row["benefici_economici"], row["sostenibilita"]
-            ))
-        except sqlite3.IntegrityError:
-            print(f"⚠️ Il progetto '{row['nome']}' esiste già nel database. Ignorato.")
+    # 📌 Inserimento in blocco (una sola transazione), evitando duplicati sul nome del progetto
+    esito = upsert_progetti(db_file, df.to_dict(orient="records"), aggiorna=aggiorna)
 
-    conn.commit()
-    conn.close()
-    print("✅ Dati inseriti nel database!")
+    print(f"✅ Dati inseriti nel database! Inseriti: {esito['inseriti']}, aggiornati: {esito['aggiornati']}, ignorati: {esito['ignorati']}")
+    return esito
 
 # 📌 Esegui il codice
 if __name__ == "__main__":
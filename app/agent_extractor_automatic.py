@@ -87,43 +87,25 @@
 
 import os
 import json
+import logging
 import sqlite3
-import unicodedata
 import re
-import urllib3
-import boto3
-from botocore.config import Config
-from langchain_aws import ChatBedrock
+from collections import deque
 from dotenv import load_dotenv
-from app.pdf_processor import extract_text_from_pdf
+from app.pdf_processor import iter_pdf_pages
+from app.cache_estrazioni import CacheEstrazioni, hash_file, versione_estrazione
+from app.llm_gateway import MODEL_ID, gateway
+from app.ml_similarity import notifica_nuovi_progetti
+from app.database import DB_PATH, normalizza_chiavi, upsert_progetti
+from app.metriche import fase
 
 # 🔹 Carica variabili d'ambiente
 load_dotenv()
 
-# 🔹 Percorso del database SQLite
-DB_PATH = r"app/Progetto_DB/progetti_DB.sqlite"
-
-# 🔹 Disattiva i warning SSL per Bedrock
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-def get_llm():
-    """ Configura e inizializza il modello Claude 3 Haiku su Amazon Bedrock """
-    bedrock_client = boto3.client(
-        service_name='bedrock-runtime',
-        region_name='eu-west-1',
-        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-        verify=False,
-        config=Config(proxies={'https': None})
-    )
-    return ChatBedrock(
-        model_id="anthropic.claude-3-haiku-20240307-v1:0",
-        client=bedrock_client,
-        model_kwargs={"temperature": 0, "max_tokens": 4000}
-    )
+logger = logging.getLogger(__name__)
 
-# 🔹 Inizializza il modello AI (Claude 3 Haiku)
-model = get_llm()
+# 🔹 Modello AI (Claude 3 Haiku) tramite il gateway condiviso: rate limiting e retry inclusi
+model = gateway(temperature=0, max_tokens=4000)
 
 PROMPT_TEMPLATE = """Estrai una lista di progetti di successo, dove per ognuno devi estrarre i seguenti parametri dal testo del documento:
 - Nome 
@@ -148,6 +130,20 @@ Testo del documento:
 Ritorna solo il JSON senza nessun'altra parola.
 """
 
+# 📌 Il PDF viene inviato al modello a blocchi di pagine, con una pagina ripetuta tra blocchi consecutivi
+PAGINE_PER_BLOCCO = 8
+PAGINE_SOVRAPPOSTE = 1
+MAX_CARATTERI_BLOCCO = 40000
+
+# 📌 Blocchi inviati al modello in parallelo mentre si estraggono le pagine successive
+MAX_BLOCCHI_IN_VOLO = 4
+
+# 📌 Cache persistente di testo e JSON estratti, indirizzata dallo SHA-256 del PDF
+cache_estrazioni = CacheEstrazioni()
+VERSIONE_ESTRAZIONE = versione_estrazione(
+    PROMPT_TEMPLATE, MODEL_ID, PAGINE_PER_BLOCCO, PAGINE_SOVRAPPOSTE, MAX_CARATTERI_BLOCCO
+)
+
 def extract_json_from_text(text):
     """ Estrae il JSON puro dalla risposta di Bedrock """
     if not isinstance(text, str):  
@@ -161,44 +157,161 @@ def extract_json_from_text(text):
     except json.JSONDecodeError:
         return None
 
-def analyze_pdf(pdf_path):
-    """ Estrae e struttura i dati di un PDF usando Claude 3 Haiku """
-    print(f"📌 Inizio analisi del PDF: {pdf_path}")
+def _nessun_progresso(fase, percentuale=None):
+    pass
 
-    if not os.path.exists(pdf_path):
-        print(f"❌ ERRORE: Il file PDF non esiste: {pdf_path}")
-        return None
+def blocchi_pdf(pdf_path, pagine_per_blocco=PAGINE_PER_BLOCCO, sovrapposizione=PAGINE_SOVRAPPOSTE,
+                max_caratteri=MAX_CARATTERI_BLOCCO, pagine=None):
+    """
+    Genera (prima_pagina, ultima_pagina, testo) a blocchi di pagine consecutive, man mano che
+    le pagine vengono estratte. Le ultime `sovrapposizione` pagine di un blocco sono ripetute
+    all'inizio del successivo, così un progetto a cavallo tra due blocchi non viene perso.
+    In memoria resta solo il blocco corrente. `pagine` permette di passare pagine già estratte.
+    """
+    finestra = []
+    ultima_inviata = 0
+
+    def chiudi_blocco():
+        testo = "".join(t + "\n" for _, t in finestra if t)
+        return finestra[0][0], finestra[-1][0], testo
+
+    for numero, testo in (pagine if pagine is not None else iter_pdf_pages(pdf_path)):
+        finestra.append((numero, testo))
+        caratteri = sum(len(t) for _, t in finestra)
+        if len(finestra) >= pagine_per_blocco or caratteri >= max_caratteri:
+            yield chiudi_blocco()
+            ultima_inviata = numero
+            finestra = finestra[-sovrapposizione:] if 0 < sovrapposizione < len(finestra) else []
+
+    # 📌 Ultimo blocco, solo se contiene pagine non ancora inviate
+    if finestra and finestra[-1][0] > ultima_inviata:
+        yield chiudi_blocco()
+
+def _chiave_nome(progetto):
+    nome = progetto.get("nome")
+    return " ".join(str(nome).split()).casefold() if nome else None
+
+def unisci_progetti(progetti_per_nome, nuovi):
+    """
+    Aggiunge a `progetti_per_nome` i progetti di `nuovi`, con le chiavi normalizzate
+    ("Nome", "Città" -> "nome", "citta") e deduplicati per nome (senza distinzione di
+    maiuscole/spazi). Per un progetto già visto vengono solo completati i campi rimasti
+    vuoti. Restituisce i progetti mai visti prima.
+    """
+    inediti = []
+    for progetto in nuovi or []:
+        if not isinstance(progetto, dict):
+            continue
+        progetto = normalizza_chiavi(progetto)
+        chiave = _chiave_nome(progetto)
+        if chiave is None:
+            continue
+        esistente = progetti_per_nome.get(chiave)
+        if esistente is None:
+            progetti_per_nome[chiave] = progetto
+            inediti.append(progetto)
+            continue
+        for campo, valore in progetto.items():
+            if esistente.get(campo) in (None, "", []) and valore not in (None, "", []):
+                esistente[campo] = valore
+    return inediti
 
-    print("📌 Tentativo di estrarre il testo dal PDF...")
-    
-    try:
-        extracted_text = extract_text_from_pdf(pdf_path)
-        print("✅ Testo estratto correttamente!")  # ✅ Questa riga dovrebbe essere stampata se la funzione funziona
-    except Exception as e:
-        print(f"❌ ERRORE: Problema nell'estrazione del testo: {str(e)}")
-        return None
+def analyze_pdf_stream(pdf_path, progresso=_nessun_progresso):
+    """
+    Pipeline in streaming: ogni blocco di pagine viene inviato al modello appena è pronto
+    (mentre le pagine successive sono ancora in estrazione) e i progetti nuovi vengono
+    restituiti subito, blocco per blocco, già deduplicati per nome.
+    Testo e JSON sono salvati nella cache delle estrazioni: lo stesso PDF (anche con un altro
+    nome) non viene più rielaborato né rinviato al modello.
+    """
+    sha_pdf = hash_file(pdf_path)
+    progetti_in_cache = cache_estrazioni.leggi_progetti(sha_pdf, VERSIONE_ESTRAZIONE)
+    if progetti_in_cache:
+        logger.info("✅ Progetti letti dalla cache delle estrazioni")
+        yield progetti_in_cache
+        return
+
+    pagine = cache_estrazioni.leggi_pagine(sha_pdf)
+    pagine_estratte = None
+    if pagine is None:
+        pagine_estratte = []
+
+        def pagine_da_pdf():
+            for numero, testo in iter_pdf_pages(pdf_path):
+                pagine_estratte.append((numero, testo))
+                yield numero, testo
+
+        pagine = pagine_da_pdf()
+
+    progetti_per_nome = {}
+    testo_trovato = False
+    completo = True
+    in_volo = deque()
+
+    def raccogli(prima, ultima, future):
+        """ Attende la risposta di un blocco e restituisce i progetti mai visti prima """
+        nonlocal completo
+        risposta = future.result()
+        with fase("estrazione_json"):
+            json_data = extract_json_from_text(risposta)
+        if not isinstance(json_data, list):
+            logger.warning("⚠️ Nessun JSON valido per le pagine %d-%d", prima, ultima)
+            completo = False
+            return []
+        return unisci_progetti(progetti_per_nome, json_data)
+
+    for prima, ultima, testo in blocchi_pdf(pdf_path, pagine=pagine):
+        if not testo.strip():
+            continue
+        testo_trovato = True
+
+        logger.info("📌 Analisi con il modello AI delle pagine %d-%d...", prima, ultima)
+        progresso(f"analisi con il modello AI (pagine {prima}-{ultima})", 40)
+        in_volo.append((prima, ultima, model.invia(PROMPT_TEMPLATE.format(text=testo))))
+
+        # 📌 Finestra limitata di blocchi in attesa: la memoria resta costante anche su PDF enormi
+        while len(in_volo) >= MAX_BLOCCHI_IN_VOLO or (in_volo and in_volo[0][2].done()):
+            inediti = raccogli(*in_volo.popleft())
+            if inediti:
+                yield inediti
+
+    while in_volo:
+        inediti = raccogli(*in_volo.popleft())
+        if inediti:
+            yield inediti
+
+    if pagine_estratte is not None:
+        cache_estrazioni.scrivi_pagine(sha_pdf, pagine_estratte)
 
-    print(f"📌 Testo estratto (primi 500 caratteri):\n{extracted_text[:500]}")  # ✅ Controllo il contenuto del testo
+    if not testo_trovato:
+        logger.error("❌ ERRORE: Il PDF non contiene testo leggibile!")
+    elif completo and progetti_per_nome:
+        # 📌 Solo risultati completi: una risposta non valida verrà richiesta di nuovo al prossimo tentativo
+        cache_estrazioni.scrivi_progetti(sha_pdf, VERSIONE_ESTRAZIONE, list(progetti_per_nome.values()))
 
-    if not extracted_text.strip():
-        print("❌ ERRORE: Il PDF non contiene testo leggibile!")
+def analyze_pdf(pdf_path, progresso=_nessun_progresso):
+    """ Estrae e struttura i dati di un PDF usando Claude 3 Haiku, un blocco di pagine alla volta """
+    logger.info("📌 Inizio analisi del PDF: %s", pdf_path)
+
+    if not os.path.exists(pdf_path):
+        logger.error("❌ ERRORE: Il file PDF non esiste: %s", pdf_path)
         return None
 
-    prompt = PROMPT_TEMPLATE.format(text=extracted_text)
-    response = model.invoke(prompt)
-    
-    response_text = response.content if hasattr(response, "content") else str(response)
-    json_data = extract_json_from_text(response_text)
+    logger.debug("📌 Tentativo di estrarre il testo dal PDF...")
+    progresso("estrazione testo dal PDF", 10)
 
-    return json_data
+    progetti = []
+    try:
+        for inediti in analyze_pdf_stream(pdf_path, progresso):
+            progetti.extend(inediti)
+            logger.info("✅ %d nuovi progetti estratti (%d in totale)", len(inediti), len(progetti))
+    except Exception as e:
+        logger.exception("❌ ERRORE: Problema nell'analisi del PDF: %s", e)
+        return None
 
+    progresso("estrazione JSON dalla risposta", 80)
+    return progetti or None
 
-def normalize_json_keys(data):
-    """ Normalizza le chiavi del JSON rimuovendo accenti e caratteri speciali """
-    return [
-        {unicodedata.normalize('NFKD', k).encode('ASCII', 'ignore').decode(): v for k, v in progetto.items()}
-        for progetto in data
-    ]
 
 # def save_to_db(data, db_path=DB_PATH):
 #     """ Salva i dati estratti in un database SQLite """
@@ -362,8 +475,12 @@ def normalize_json_keys(data):
 #     print("✅ Dati aggiornati nel database!")
 #     return {"message": "✅ Dati aggiornati nel database!"}
 
-def save_to_db(data, db_path=DB_PATH):
-    """ Salva i dati nel database SQLite, evitando duplicati e trasformando liste in stringhe. """
+def save_to_db(data, db_path=DB_PATH, aggiorna=False):
+    """
+    Salva i dati nel database SQLite in un'unica transazione (upsert in blocco sul nome).
+    Con `aggiorna=True` i progetti già presenti vengono aggiornati invece che ignorati.
+    Restituisce i conteggi di progetti inseriti / aggiornati / ignorati.
+    """
     absolute_path = os.path.abspath(db_path)
     db_folder = os.path.dirname(absolute_path)
 
@@ -371,91 +488,42 @@ def save_to_db(data, db_path=DB_PATH):
         os.makedirs(db_folder, exist_ok=True)
 
     try:
-        conn = sqlite3.connect(absolute_path)
-        cursor = conn.cursor()
-        print("✅ Database aperto con successo!")
+        esito = upsert_progetti(absolute_path, data, aggiorna=aggiorna)
     except sqlite3.Error as e:
-        print(f"❌ ERRORE: Non posso aprire il database: {str(e)}")
-        return {"error": f"❌ Problema nell'aprire il database: {str(e)}"}
-
-    # ✅ Creazione tabella
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS progetti_successo (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nome TEXT UNIQUE,
-            citta TEXT,
-            paese TEXT,
-            anno INTEGER,
-            superficie_mq INTEGER,
-            tipologia TEXT,
-            problema TEXT,
-            interventi TEXT,  -- Questo è il parametro 8 che stava dando errore
-            costo_milioni REAL,
-            finanziamento TEXT,
-            benefici_sociali TEXT,
-            benefici_economici TEXT,
-            sostenibilita TEXT
-        )
-    """)
-
-    conn.commit()
-
-    data = normalize_json_keys(data)
-
-    for progetto in data:
-        # ✅ Convertiamo ogni lista in stringa JSON
-        for key, value in progetto.items():
-            if isinstance(value, list):  # Se il valore è una lista
-                progetto[key] = json.dumps(value)  # Converti in stringa JSON
-
-        # ✅ Controllo se il progetto esiste già
-        cursor.execute("SELECT COUNT(*) FROM progetti_successo WHERE nome = ?", (progetto["nome"],))
-        result = cursor.fetchone()
-
-        if result[0] > 0:
-            print(f"⚠️ Il progetto '{progetto['nome']}' esiste già. NON verrà inserito.")
-            continue
+        logger.error("❌ ERRORE: Problema nel salvataggio sul database: %s", e)
+        return {"error": f"❌ Problema nel salvataggio sul database: {str(e)}"}
+
+    logger.info(
+        "✅ Dati aggiornati nel database! Inseriti: %d, aggiornati: %d, ignorati: %d",
+        esito["inseriti"], esito["aggiornati"], esito["ignorati"]
+    )
+
+    # ✅ Allineiamo l'indice di similarità senza ricostruirlo
+    notifica_nuovi_progetti(esito["ids_inseriti"], db_path, aggiornati=esito["ids_aggiornati"])
+
+    return {k: esito[k] for k in ("inseriti", "aggiornati", "ignorati")}
+
 
-        try:
-            print(f"📌 Inserisco il progetto '{progetto['nome']}' nel database...")
-            cursor.execute("""
-                INSERT INTO progetti_successo (
-                    nome, citta, paese, anno, superficie_mq, tipologia, problema, interventi, 
-                    costo_milioni, finanziamento, benefici_sociali, benefici_economici, sostenibilita
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                progetto["nome"], progetto["citta"], progetto["paese"], progetto["anno"],
-                progetto["superficie_mq"], progetto["tipologia"], progetto["problema"], progetto["interventi"],
-                progetto["costo_milioni"], progetto["finanziamento"], progetto["benefici_sociali"],
-                progetto["benefici_economici"], progetto["sostenibilita"]
-            ))
-
-        except sqlite3.IntegrityError as e:
-            print(f"❌ ERRORE SQL: {e}")
-
-    conn.commit()
-    conn.close()
-    print("✅ Dati aggiornati nel database!")
-
-
-def process_pdf_and_save(pdf_path):
+def process_pdf_and_save(pdf_path, progresso=_nessun_progresso):
     """
     Funzione principale che analizza il PDF e salva i dati nel database.
-    Questa funzione viene chiamata direttamente dal backend FastAPI.
+    Questa funzione viene eseguita dalla coda dei lavori del backend FastAPI;
+    `progresso(fase, percentuale)` riceve gli aggiornamenti sullo stato di avanzamento.
     """
-    print(f"📌 Inizio analisi PDF: {pdf_path}")
+    logger.info("📌 Inizio analisi PDF: %s", pdf_path)
 
     if not os.path.exists(pdf_path):
-        print(f"❌ ERRORE: Il file non esiste -> {pdf_path}")
+        logger.error("❌ ERRORE: Il file non esiste -> %s", pdf_path)
         return {"error": "❌ Il file PDF non esiste."}
 
-    extracted_data = analyze_pdf(pdf_path)
+    extracted_data = analyze_pdf(pdf_path, progresso)
 
     if extracted_data:
-        print(f"✅ Dati estratti: {extracted_data}")  # ✅ Debug JSON estratto
-        save_to_db(extracted_data)
-        return {"message": "✅ Analisi completata e dati salvati nel database!", "data": extracted_data}
+        logger.debug("✅ Dati estratti: %s", extracted_data)  # ✅ Debug JSON estratto
+        progresso("salvataggio nel database", 90)
+        salvataggio = save_to_db(extracted_data)
+        return {"message": "✅ Analisi completata e dati salvati nel database!", "data": extracted_data, "salvataggio": salvataggio}
     else:
-        print("❌ ERRORE: Nessun dato estratto dal PDF.")
+        logger.error("❌ ERRORE: Nessun dato estratto dal PDF.")
         return {"error": "❌ Nessun dato estratto dal PDF."}
 
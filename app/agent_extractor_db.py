@@ -1,50 +1,29 @@
 import os
+import sys
 import json
 import pandas as pd
 import sqlite3
-import boto3
-import urllib3
 import re
-from botocore.config import Config
-from langchain_aws import ChatBedrock
 from langchain.prompts import PromptTemplate
-from pdf_processor import extract_text_from_pdf
 from dotenv import load_dotenv
 import unicodedata
 
+# 📌 Permette di lanciare lo script sia con `python app/agent_extractor_db.py` sia con `python -m app.agent_extractor_db`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 📌 Moduli importati come app.*: un solo gateway (stesso TokenBucket ed executor) per tutto il processo
+from app.pdf_processor import extract_text_from_pdf
+from app.llm_gateway import gateway
+
 # Debug: Stampiamo un messaggio per verificare che il file sia stato avviato
 print("🚀 Avvio dell'Agente AI...")
 load_dotenv()
 
 # 📌 Percorso del database SQLite
-DB_PATH = r"Progetto_DB/progetti_DB.sqlite"
-
-def get_llm():
-    """ Configura e inizializza il modello Claude 3 Haiku su Amazon Bedrock """
-    print("📌 Inizializzazione di Bedrock...")
-
-    # Disabilita avvisi SSL
-    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-    # Inizializza il client Amazon Bedrock
-    bedrock_client = boto3.client(
-        service_name='bedrock-runtime',
-        region_name='eu-west-1',
-        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-        verify=False,  # Disabilita verifica SSL (solo per test)
-        config=Config(proxies={'https': None})
-    )
-
-    print("✅ Client Amazon Bedrock inizializzato correttamente!")
-    return ChatBedrock(
-        model_id="anthropic.claude-3-haiku-20240307-v1:0",
-        client=bedrock_client,
-        model_kwargs={"temperature": 0, "max_tokens": 4000}
-    )
-
-# Inizializza il modello AI
-model = get_llm()
+from app.database import DB_PATH
+
+# Inizializza il modello AI tramite il gateway condiviso
+model = gateway(temperature=0, max_tokens=4000)
 
 PROMPT_TEMPLATE = """Estrai una lista di progetti di successo, dove per ognuno devi estrarre i seguenti parametri dal testo del documento:
 - Nome 
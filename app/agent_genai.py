@@ -1,72 +1,48 @@
 import os
 import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-import boto3
-import urllib3
-import matplotlib.pyplot as plt
-from botocore.config import Config
-from langchain_aws import ChatBedrock
-from reportlab.lib.pagesizes import A4, letter
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
-from reportlab.lib.units import inch
 from dotenv import load_dotenv
+from app.llm_gateway import gateway
+from app.grafici import grafici_progetti
+from app.report_pdf import scrivi_report, tabelle_progetti
 
 # 📌 Carichiamo le variabili d'ambiente
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # 📌 Percorsi dei file
 CSV_PATH = "risultati.csv"
 PDF_PATH = "report_riqualificazione.pdf"
-GRAPH_COSTS_PATH = "grafico_costi.png"
 JSON_OUTPUT_PATH = "risultati.json"
 
-# 📌 Configurazione del modello Claude 3 Haiku su Amazon Bedrock
-def get_llm():
-    print("📌 Inizializzazione di Bedrock...")
-    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-    bedrock_client = boto3.client(
-        service_name='bedrock-runtime',
-        region_name='eu-west-1',
-        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-        verify=False,
-        config=Config(proxies={'https': None})
-    )
-
-    print("✅ Client Amazon Bedrock inizializzato correttamente!")
-    return ChatBedrock(
-        model_id="anthropic.claude-3-haiku-20240307-v1:0",
-        client=bedrock_client,
-        model_kwargs={"temperature": 0.3, "max_tokens": 4000}
-    )
-
-# 📌 Inizializziamo il modello AI
-model = get_llm()
-
-# 📌 Funzione per leggere i dati dal CSV e convertirli in JSON
-def leggi_risultati():
-    if not os.path.exists(CSV_PATH):
-        raise FileNotFoundError(f"❌ ERRORE: Il file '{CSV_PATH}' non esiste!")
+# 📌 Modello Claude 3 Haiku tramite il gateway condiviso (client, rate limiting e retry comuni)
+model = gateway(temperature=0.3, max_tokens=4000)
+
+# 📌 Funzione per leggere i dati dal CSV e convertirli in JSON (solo uso da riga di comando:
+# il backend passa i progetti in memoria, vedi app/pipeline_report.py)
+def leggi_risultati(percorso_csv=CSV_PATH, salva_json=False):
+    if not os.path.exists(percorso_csv):
+        raise FileNotFoundError(f"❌ ERRORE: Il file '{percorso_csv}' non esiste!")
     
-    df = pd.read_csv(CSV_PATH)
+    df = pd.read_csv(percorso_csv)
     if df.empty:
         raise ValueError("❌ ERRORE: Il file CSV è vuoto!")
     
     progetti_json = df.to_dict(orient="records")
     
-    # 📌 Salva il JSON su file per debug
-    with open(JSON_OUTPUT_PATH, "w", encoding="utf-8") as json_file:
-        json.dump(progetti_json, json_file, indent=4, ensure_ascii=False)
-    
-    print("📌 JSON generato dal CSV salvato con successo.", progetti_json)
+    # 📌 Salva il JSON su file per debug (solo se richiesto)
+    if salva_json:
+        with open(JSON_OUTPUT_PATH, "w", encoding="utf-8") as json_file:
+            json.dump(progetti_json, json_file, indent=4, ensure_ascii=False)
+        logger.info("📌 JSON generato dal CSV salvato con successo.")
     return df, progetti_json
 
-# 📌 Genera il report AI con Claude
-def genera_documento_ai(progetti_json):
-    prompt = f"""
+# 📌 Prompt del report AI a partire dai progetti simili
+def prompt_report(progetti_json):
+    return f"""
     Sei un esperto di riqualificazione urbana. Ho ottenuto 5 progetti simili tramite un modello ML.
 
     📌 Progetti di successo trovati:  
@@ -90,77 +66,82 @@ def genera_documento_ai(progetti_json):
     - Sintesi delle migliori pratiche  
     - Suggerimenti pratici basati sui 5 progetti simili  
     """
-    
-    print("📌 Invio del prompt a Claude 3 Haiku...")
-    response = model.invoke(prompt)
+
+# 📌 Genera il report AI con Claude
+def genera_documento_ai(progetti_json):
+    logger.info("📌 Invio del prompt a Claude 3 Haiku...")
+    response = model.invoke(prompt_report(progetti_json))
     documento_ai = response.content if hasattr(response, "content") else str(response)
 
     return documento_ai
 
-# 📌 Funzione per generare i grafici di confronto
+# 📌 Funzione per generare i grafici di confronto (PNG in memoria, con cache sui dati)
 def genera_grafici(df):
-    plt.figure(figsize=(8, 5))
-    plt.bar(df["nome"], df["costo_milioni"], color="blue")
-    plt.xlabel("Progetti")
-    plt.ylabel("Costo (milioni €)")
-    plt.title("Confronto Costi dei Progetti")
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    plt.savefig(GRAPH_COSTS_PATH)
-    plt.close()
-    print("📊 Grafico dei costi salvato.")
+    grafici = grafici_progetti(df)
+    logger.info("📊 Grafici generati: %s.", ", ".join(grafici) or "nessuno")
+    return grafici
 
 # 📌 Funzione per generare la tabella nel PDF
-def crea_tabella_pdf(progetti_json):
-    headers = list(progetti_json[0].keys())
-    table_data = [headers] + [[item[header] for header in headers] for item in progetti_json]
-
-    table = Table(table_data)
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-    ]))
-    return table
+def crea_tabella_pdf(progetti_json, colonne=None):
+    """ Tabella di confronto a blocchi di LongTable (intestazione ripetuta, celle a capo) """
+    return list(tabelle_progetti(progetti_json, colonne))
 
 # 📌 Funzione per generare il PDF con testo AI, tabella e grafico
-def salva_report_pdf(contenuto_testo, progetti_json):
-    print("📌 Creazione del nuovo PDF...")
-    doc = SimpleDocTemplate(PDF_PATH, pagesize=A4, rightMargin=50, leftMargin=50, topMargin=50, bottomMargin=50)
-    styles = getSampleStyleSheet()
-
-    stile_titolo = ParagraphStyle('Titolo', parent=styles['Heading1'], fontSize=22, textColor=colors.darkblue, spaceAfter=20)
-    stile_testo = ParagraphStyle('Testo', parent=styles['BodyText'], fontSize=12, leading=14, spaceAfter=10)
-
-    elementi = [Paragraph("REPORT DI RIQUALIFICAZIONE URBANA", stile_titolo), Spacer(1, 12)]
-    sezioni = contenuto_testo.split("\n\n")
-    for sezione in sezioni:
-        elementi.append(Paragraph(sezione.strip(), stile_testo))
-        elementi.append(Spacer(1, 12))
-    
-    elementi.append(crea_tabella_pdf(progetti_json))
-    elementi.append(Spacer(1, 20))
-    
-    # 📌 Aggiunta del grafico nel PDF
-    if os.path.exists(GRAPH_COSTS_PATH):
-        elementi.append(Image(GRAPH_COSTS_PATH, width=400, height=300))
-        elementi.append(Spacer(1, 20))
-    
-    doc.build(elementi)
-    print(f"✅ Report salvato: {PDF_PATH}")
+def salva_report_pdf(contenuto_testo, progetti_json, percorso_pdf=PDF_PATH, grafici=None, tabella=None, colonne=None):
+    """
+    Il PDF viene impaginato in streaming: testo, blocchi della tabella e grafici sono
+    generati man mano, quindi anche con centinaia di progetti la memoria resta limitata.
+    """
+    logger.info("📌 Creazione del nuovo PDF...")
+    # 📌 Grafici direttamente dai buffer in memoria
+    if grafici is None:
+        grafici = genera_grafici(pd.DataFrame(progetti_json))
+    scrivi_report(percorso_pdf, contenuto_testo, progetti_json, grafici=grafici, colonne=colonne, tabella=tabella)
+    logger.info("✅ Report salvato: %s", percorso_pdf if isinstance(percorso_pdf, str) else "in memoria")
+
+def _nessun_progresso(fase, percentuale=None):
+    pass
+
+def _nessun_evento(evento):
+    pass
+
+# 📌 Report completo in streaming: grafici e tabella in parallelo alla generazione del testo
+def genera_report(progetti_json, destinazione=PDF_PATH, progresso=_nessun_progresso, evento=_nessun_evento):
+    """
+    Genera il report PDF pubblicando il testo del modello man mano che arriva
+    (`evento({"tipo": "testo", "testo": ...})`), mentre grafici e tabella vengono
+    preparati in parallelo alla chiamata AI. `destinazione` è un percorso o un buffer
+    (es. io.BytesIO, per non toccare il disco). Restituisce il testo generato.
+    """
+    if not progetti_json:
+        raise ValueError("❌ ERRORE: Nessun progetto per il report!")
+
+    df = pd.DataFrame(progetti_json)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        grafici = pool.submit(genera_grafici, df)
+        tabella = pool.submit(crea_tabella_pdf, progetti_json)
+
+        progresso("generazione del testo con il modello AI", 10)
+        pezzi = []
+        for pezzo in model.stream(prompt_report(progetti_json)):
+            pezzi.append(pezzo)
+            evento({"tipo": "testo", "testo": pezzo})
+
+        progresso("composizione del PDF", 80)
+        salva_report_pdf("".join(pezzi), progetti_json, destinazione, grafici.result(), tabella=tabella.result())
+
+    return {"testo": "".join(pezzi)}
 
 # 📌 Esegui il report
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     try:
-        print("📌 Avvio del processo...")
-        df_progetti, progetti_json = leggi_risultati()
-        genera_grafici(df_progetti)
+        logger.info("📌 Avvio del processo...")
+        df_progetti, progetti_json = leggi_risultati(salva_json=True)
+        grafici = genera_grafici(df_progetti)
         contenuto_ai = genera_documento_ai(progetti_json)
-        salva_report_pdf(contenuto_ai, progetti_json)
-        print("✅ Processo completato con successo!")
+        salva_report_pdf(contenuto_ai, progetti_json, grafici=grafici)
+        logger.info("✅ Processo completato con successo!")
     except Exception as e:
-        print(f"❌ Errore durante l'esecuzione: {e}")
+        logger.exception("❌ Errore durante l'esecuzione: %s", e)
@@ -0,0 +1,165 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from datetime import datetime, timezone
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+# 📌 Formato degli artefatti TF-IDF su disco (al posto dei vecchi pickle):
+#   <cartella>/corrente.json           -> puntatore alla versione attiva
+#   <cartella>/<versione>/manifest.json -> formato, hash, shape, firma del DB e mappa riga -> id
+#   <cartella>/<versione>/vocabolario.json, idf.npy
+#   <cartella>/<versione>/<matrice>.data.npy, <matrice>.indices.npy, <matrice>.indptr.npy
+#   <cartella>/<versione>/<array>.npy  (array densi ausiliari, es. la Gram per campo)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ARTEFATTI_DIR = os.path.join(BASE_DIR, "modello_tfidf")
+VERSIONE_FORMATO = 3
+VERSIONI_CONSERVATE = 3
+
+ARRAY_MATRICE = ("data", "indices", "indptr")
+
+
+def _hash_contenuto(termini, idf, matrici, array, ids):
+    """ Hash SHA-256 del contenuto: identifica la versione degli artefatti """
+    h = hashlib.sha256()
+    h.update(json.dumps(termini, ensure_ascii=False).encode("utf-8"))
+    blocchi = [idf, np.asarray(ids, dtype=np.int64)]
+    for nome in sorted(matrici):
+        h.update(nome.encode("utf-8"))
+        blocchi += [getattr(matrici[nome], componente) for componente in ARRAY_MATRICE]
+    for nome in sorted(array):
+        h.update(nome.encode("utf-8"))
+        blocchi.append(array[nome])
+    for blocco in blocchi:
+        h.update(np.ascontiguousarray(blocco).tobytes())
+    return h.hexdigest()
+
+
+def salva_artefatti(vectorizer, matrici, ids, firma_db, cartella=ARTEFATTI_DIR, array=None, extra=None):
+    """
+    Scrive vocabolario, IDF e le matrici CSR (dizionario nome -> matrice) come array `.npy`
+    grezzi, più eventuali array densi ausiliari e il manifest (arricchito con `extra`).
+    La versione viene scritta in una cartella temporanea e resa attiva con un rename atomico,
+    così più worker possono salvare e caricare in parallelo senza leggere file a metà.
+    """
+    matrici = {nome: sp.csr_matrix(matrice) for nome, matrice in matrici.items()}
+    for matrice in matrici.values():
+        matrice.sort_indices()
+    array = {nome: np.ascontiguousarray(valori) for nome, valori in (array or {}).items()}
+
+    termini = [None] * len(vectorizer.vocabulary_)
+    for termine, colonna in vectorizer.vocabulary_.items():
+        termini[colonna] = termine
+
+    ids = [int(i) for i in ids]
+    hash_contenuto = _hash_contenuto(termini, vectorizer.idf_, matrici, array, ids)
+    versione = hash_contenuto[:16]
+    destinazione = os.path.join(cartella, versione)
+    os.makedirs(cartella, exist_ok=True)
+
+    if not os.path.exists(destinazione):
+        tmp = tempfile.mkdtemp(prefix=f".{versione}-", dir=cartella)
+        try:
+            with open(os.path.join(tmp, "vocabolario.json"), "w", encoding="utf-8") as f:
+                json.dump(termini, f, ensure_ascii=False)
+            np.save(os.path.join(tmp, "idf.npy"), np.asarray(vectorizer.idf_, dtype=np.float64))
+            for nome, matrice in matrici.items():
+                for componente in ARRAY_MATRICE:
+                    np.save(os.path.join(tmp, f"{nome}.{componente}.npy"), getattr(matrice, componente))
+            for nome, valori in array.items():
+                np.save(os.path.join(tmp, f"{nome}.npy"), valori)
+
+            manifest = {
+                "versione_formato": VERSIONE_FORMATO,
+                "hash": hash_contenuto,
+                "creato": datetime.now(timezone.utc).isoformat(),
+                "norm": vectorizer.norm,
+                "matrici": {nome: list(matrice.shape) for nome, matrice in matrici.items()},
+                "array": sorted(array),
+                "firma_db": list(firma_db),
+                "ids": ids,
+                **(extra or {}),
+            }
+            with open(os.path.join(tmp, "manifest.json"), "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+
+            os.rename(tmp, destinazione)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            # 📌 Un altro worker ha già pubblicato la stessa versione
+            if not os.path.exists(destinazione):
+                raise
+
+    _scrivi_puntatore(cartella, versione)
+    _pulisci_versioni(cartella, versione)
+    return versione
+
+
+def _scrivi_puntatore(cartella, versione):
+    fd, tmp = tempfile.mkstemp(prefix=".corrente-", dir=cartella)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump({"versione": versione}, f)
+    os.replace(tmp, os.path.join(cartella, "corrente.json"))
+
+
+def _pulisci_versioni(cartella, versione_attiva):
+    """ Mantiene solo le versioni più recenti (i worker che le hanno in mmap continuano a leggerle) """
+    versioni = [
+        os.path.join(cartella, d) for d in os.listdir(cartella)
+        if not d.startswith(".") and os.path.isdir(os.path.join(cartella, d))
+    ]
+    versioni.sort(key=os.path.getmtime, reverse=True)
+    for percorso in versioni[VERSIONI_CONSERVATE:]:
+        if os.path.basename(percorso) != versione_attiva:
+            shutil.rmtree(percorso, ignore_errors=True)
+
+
+def leggi_manifest(cartella=ARTEFATTI_DIR):
+    """ Restituisce il manifest della versione attiva, o None se non ci sono artefatti validi """
+    try:
+        with open(os.path.join(cartella, "corrente.json"), encoding="utf-8") as f:
+            versione = json.load(f)["versione"]
+        with open(os.path.join(cartella, versione, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError, KeyError):
+        return None
+
+    if manifest.get("versione_formato") != VERSIONE_FORMATO:
+        return None
+    manifest["cartella"] = os.path.join(cartella, versione)
+    return manifest
+
+
+def carica_artefatti(manifest):
+    """
+    Ricostruisce (vectorizer, matrici, array) dalla versione indicata dal manifest.
+    Gli array sono aperti in memory-map in sola lettura: nessuna copia, e le pagine
+    sono condivise tra tutti i worker che caricano la stessa versione.
+    """
+    cartella = manifest["cartella"]
+    with open(os.path.join(cartella, "vocabolario.json"), encoding="utf-8") as f:
+        termini = json.load(f)
+
+    vectorizer = TfidfVectorizer(
+        vocabulary={termine: i for i, termine in enumerate(termini)}, norm=manifest["norm"]
+    )
+    vectorizer.idf_ = np.load(os.path.join(cartella, "idf.npy"), mmap_mode="r")
+
+    matrici = {}
+    for nome, shape in manifest["matrici"].items():
+        data, indices, indptr = (
+            np.load(os.path.join(cartella, f"{nome}.{componente}.npy"), mmap_mode="r")
+            for componente in ARRAY_MATRICE
+        )
+        matrice = sp.csr_matrix((data, indices, indptr), shape=tuple(shape), copy=False)
+        # 📌 Gli indici sono stati ordinati al salvataggio: evitiamo riordini in place su array read-only
+        matrice.has_sorted_indices = True
+        matrici[nome] = matrice
+
+    array = {
+        nome: np.load(os.path.join(cartella, f"{nome}.npy"), mmap_mode="r") for nome in manifest["array"]
+    }
+    return vectorizer, matrici, array
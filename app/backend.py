@@ -85,45 +85,198 @@
     
 #     return result
 
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, Response, JSONResponse
 import os
+import json
+import logging
 import shutil
-from app.agent_extractor_automatic import process_pdf_and_save  # ✅ Import corretto
+import uuid
+from app.agent_extractor_automatic import process_pdf_and_save, cache_estrazioni  # ✅ Import corretto
 import sqlite3  # ✅ Import necessario per gestire il database SQLite
 from pydantic import BaseModel
-from app.ml_similarity import carica_progetti, calcola_similarita
-
-app = FastAPI()
+from typing import Any, Dict, List, Optional
+from app.coda_lavori import CodaLavori, CodaPiena, IN_CODA, COMPLETATO
+from app.database import DB_PATH, connessione, crea_tabella, cerca_progetti, elenca_progetti
+from app.ml_similarity import (
+    carica_progetti, calcola_similarita, calcola_similarita_batch, get_indice, cache_risultati, IndiceDensoNonPronto
+)
+from app.pipeline_report import match_e_report, lavoro_report, report_pronti
+from app.metriche import MetricheHTTP, Indicatore, esposizione, fase
+from app.pdf_processor import chiudi_pool_pdf
+
+def livello_log(nome):
+    """ Livello di logging per nome (DEBUG, INFO, WARNING, ...) o numero; OFF spegne i log, None se non valido """
+    nome = nome.strip().upper()
+    if nome == "OFF":
+        return logging.CRITICAL + 1
+    if nome.isdigit():
+        return int(nome)
+    livello = logging.getLevelName(nome)
+    return livello if isinstance(livello, int) else None
+
+# 📌 Log con livelli al posto delle print: LOG_LEVEL=WARNING riduce i messaggi, LOG_LEVEL=OFF li spegne
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+livello = livello_log(LOG_LEVEL)
+logging.basicConfig(
+    level=logging.INFO if livello is None else livello,
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+logger = logging.getLogger(__name__)
+if livello is None:
+    logger.warning("⚠️ LOG_LEVEL=%r non valido: uso INFO", LOG_LEVEL)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """ All'avvio prepara tabella e indice full-text e costruisce una sola volta l'indice di similarità in memoria """
+    conn = connessione()
+    with conn:
+        crea_tabella(conn)
+    get_indice().costruisci()
+    # 📌 SVD e IVF del motore denso in background: le richieste dense rispondono 503 finché non è pronto
+    get_indice().prepara_denso()
+    yield
+    chiudi_pool_pdf()
+
+app = FastAPI(lifespan=lifespan)
+
+# 📌 Conteggi, durate e richieste in corso per route, esposti su /metrics
+app.add_middleware(MetricheHTTP)
+
+# 📌 Pool limitato di worker per le analisi dei PDF; stato ed eventi dei lavori sono in SQLite
+# (LAVORI_DB_PATH), quindi /jobs/{id} risponde da qualunque worker uvicorn
+coda_lavori = CodaLavori()
+
+lavori_per_stato = Indicatore(
+    "lavori", "Lavori della coda per stato", ("stato",),
+    funzione=lambda: {(stato,): n for stato, n in coda_lavori.conteggi().items()}
+)
 
 UPLOAD_FOLDER = "./uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-@app.post("/upload_pdf/")
+def salva_upload(file, file_path):
+    """ Copia su disco il file ricevuto (bloccante: eseguita nel threadpool) """
+    with fase("scrittura_upload"), open(file_path, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)
+
+@app.post("/upload_pdf/", status_code=202)
 async def upload_pdf(file: UploadFile = File(...)):
-    """Riceve un PDF, lo salva e avvia l'agente AI per analizzarlo direttamente"""
+    """
+    Riceve un PDF, lo salva e accoda l'analisi AI: restituisce subito l'id del lavoro,
+    da consultare su /jobs/{id} per stato, avanzamento e risultato.
+    """
+    # 📌 Prefisso univoco: upload concorrenti con lo stesso nome non si sovrascrivono
+    nome_file = os.path.basename(file.filename or "documento.pdf")
+    file_path = os.path.join(UPLOAD_FOLDER, f"{uuid.uuid4().hex[:8]}_{nome_file}")
 
-    file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-    
-    # ✅ Debug: Stampa il percorso del file
-    print(f"📌 Percorso file salvato: {file_path}")
+    # ✅ Debug: percorso del file
+    logger.debug("📌 Percorso file salvato: %s", file_path)
 
     try:
-        # 📌 Salva il file nella cartella specificata
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        print("✅ File salvato con successo!")
+        # 📌 Salva il file senza bloccare l'event loop
+        await run_in_threadpool(salva_upload, file, file_path)
+        logger.info("✅ File salvato con successo: %s", file_path)
+
+        # 📌 Estrazione, chiamata LLM e scrittura DB girano nel pool di worker
+        id_lavoro = coda_lavori.invia(process_pdf_and_save, file_path, descrizione=nome_file)
+    except CodaPiena as e:
+        # 📌 Il PDF non verrà mai analizzato: non lo lasciamo su disco
+        os.remove(file_path)
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error("❌ Errore durante il salvataggio: %s", e)
+        return {"error": f"❌ Errore durante il salvataggio del PDF: {str(e)}"}
 
-        # 📌 Chiamata alla funzione di analisi
-        result = process_pdf_and_save(file_path)
-        print(f"📌 Risultato analisi: {result}")
+    return {"job_id": id_lavoro, "stato": IN_CODA, "file": nome_file}
 
-        return result
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """ Metriche in formato Prometheus: durate per fase, richieste HTTP, chiamate al modello, lavori """
+    return Response(esposizione(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
-    except Exception as e:
-        print(f"❌ Errore durante l'analisi: {e}")
-        return {"error": f"❌ Errore durante l'analisi del PDF: {str(e)}"}
+@app.get("/upload_pdf/cache")
+def upload_pdf_cache_stats():
+    """ Statistiche della cache delle estrazioni PDF (hit, miss, eviction, dimensione su disco) """
+    return {"cache": cache_estrazioni.statistiche()}
+
+@app.get("/jobs/")
+def list_jobs():
+    """ Elenco dei lavori noti con stato e avanzamento """
+    return {"jobs": coda_lavori.elenco()}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """ Stato, avanzamento e (a lavoro terminato) risultato di un lavoro """
+    lavoro = coda_lavori.stato(job_id)
+    if lavoro is None:
+        raise HTTPException(status_code=404, detail="Lavoro non trovato.")
+    return lavoro
 
-DB_PATH = "app/Progetto_DB/progetti_DB.sqlite"  # Assicurati che il percorso sia corretto
+
+def accoda_report(descrizione, **parametri):
+    """ Accoda un report (PDF composto in memoria, vedi app/pipeline_report.py) e restituisce l'id del lavoro """
+    try:
+        return coda_lavori.invia(
+            lavoro_report, uuid.uuid4().hex, descrizione=descrizione, con_eventi=True, **parametri
+        )
+    except CodaPiena as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+def risposta_pdf(pdf, id_report):
+    """ PDF in memoria restituito come download, con un nome diverso per ogni report """
+    return Response(
+        pdf, media_type="application/pdf",
+        headers={"Content-Disposition": f'attachment; filename="report_{id_report[:8]}.pdf"'}
+    )
+
+@app.post("/reports/", status_code=202)
+def create_report(progetti: List[Dict[str, Any]]):
+    """
+    Accoda la generazione di un report PDF sui progetti indicati (es. l'output di /match_project/).
+    Il testo AI arriva in streaming su /reports/{id}/events, il PDF su /reports/{id}/pdf.
+    """
+    if not progetti:
+        raise HTTPException(status_code=422, detail="Nessun progetto per il report.")
+    return {"job_id": accoda_report("report", progetti=progetti), "stato": IN_CODA}
+
+@app.get("/reports/{job_id}/events")
+async def report_events(job_id: str):
+    """ Eventi del report in Server-Sent Events: avanzamento, testo AI a pezzi, completamento """
+    if coda_lavori.stato(job_id) is None:
+        raise HTTPException(status_code=404, detail="Lavoro non trovato.")
+
+    async def sse():
+        letti = 0
+        while True:
+            # 📌 L'attesa di nuovi eventi è bloccante: la facciamo nel threadpool
+            esito = await run_in_threadpool(coda_lavori.attendi_eventi, job_id, letti, 1.0)
+            if esito is None:
+                return
+            eventi, terminato = esito
+            for evento in eventi:
+                yield f"event: {evento['tipo']}\ndata: {json.dumps(evento, ensure_ascii=False)}\n\n"
+            letti += len(eventi)
+            if terminato:
+                return
+
+    return StreamingResponse(sse(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/reports/{job_id}/pdf")
+def report_pdf(job_id: str):
+    """ Scarica il PDF di un report completato """
+    lavoro = coda_lavori.stato(job_id)
+    if lavoro is None:
+        raise HTTPException(status_code=404, detail="Lavoro non trovato.")
+    if lavoro["stato"] != COMPLETATO:
+        raise HTTPException(status_code=409, detail=f"Report non pronto (stato: {lavoro['stato']}).")
+    id_report = lavoro["risultato"]["report_id"]
+    pdf = report_pronti.leggi(id_report)
+    if pdf is None:
+        raise HTTPException(status_code=410, detail="Report scaduto: generarlo di nuovo.")
+    return risposta_pdf(pdf, id_report)
 
 
 @app.get("/latest_projects/")
@@ -135,25 +288,63 @@ def get_latest_projects():
         return {"error": "❌ Il database non esiste."}
 
     try:
-        conn = sqlite3.connect(absolute_path)
-        cursor = conn.cursor()
-
-        # ✅ Prende le ultime 5 righe ordinate per ID (le più recenti)
-        cursor.execute("SELECT * FROM progetti_successo ORDER BY id DESC LIMIT 5")
-        rows = cursor.fetchall()
-
-        # ✅ Recuperiamo i nomi delle colonne
-        columns = [desc[0] for desc in cursor.description]
-
-        conn.close()
-
-        # ✅ Convertiamo in formato JSON
-        latest_projects = [dict(zip(columns, row)) for row in rows]
+        latest_projects, _ = elenca_progetti(limite=5)
         return {"latest_projects": latest_projects}
 
     except sqlite3.Error as e:
         return {"error": f"❌ Errore nel database: {str(e)}"}
-    
+
+
+def _json_in_streaming(progetti, cursore_successivo):
+    """ Serializza la pagina un progetto alla volta invece di costruire l'intera risposta in memoria """
+    yield '{"progetti":['
+    for i, progetto in enumerate(progetti):
+        yield ("," if i else "") + json.dumps(progetto, ensure_ascii=False)
+    yield f'],"next_cursor":{json.dumps(cursore_successivo)}}}'
+
+@app.get("/projects")
+def list_projects(columns: Optional[str] = Query(None, description="Colonne separate da virgola (default: tutte)"),
+                  cursor: Optional[int] = Query(None, description="id dell'ultima riga della pagina precedente"),
+                  limit: int = Query(50, ge=1, le=1000),
+                  order: str = Query("desc", pattern="^(asc|desc)$"),
+                  paese: Optional[str] = None,
+                  anno_min: Optional[int] = None, anno_max: Optional[int] = None,
+                  costo_min: Optional[float] = None, costo_max: Optional[float] = None,
+                  format: str = Query("json", pattern="^(json|ndjson)$")):
+    """
+    Elenco paginato dei progetti (paginazione keyset su id) con colonne e filtri a scelta.
+    Il cursore della pagina successiva è in `next_cursor` (JSON) e nell'header X-Next-Cursor.
+    """
+    colonne = [c.strip() for c in columns.split(",") if c.strip()] if columns else None
+    try:
+        progetti, cursore_successivo = elenca_progetti(
+            colonne, cursor, limit, order == "asc", paese, anno_min, anno_max, costo_min, costo_max
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except sqlite3.Error as e:
+        raise HTTPException(status_code=500, detail=f"❌ Errore nel database: {str(e)}")
+
+    headers = {"X-Next-Cursor": "" if cursore_successivo is None else str(cursore_successivo)}
+    if format == "ndjson":
+        righe = (json.dumps(progetto, ensure_ascii=False) + "\n" for progetto in progetti)
+        return StreamingResponse(righe, media_type="application/x-ndjson", headers=headers)
+    return StreamingResponse(_json_in_streaming(progetti, cursore_successivo),
+                             media_type="application/json", headers=headers)
+
+
+@app.get("/search")
+def search_projects(q: str = Query(..., min_length=1), paese: Optional[str] = None,
+                    anno_min: Optional[int] = None, anno_max: Optional[int] = None,
+                    costo_min: Optional[float] = None, costo_max: Optional[float] = None,
+                    limit: int = Query(20, ge=1, le=100)):
+    """ Ricerca per parole chiave (FTS5, ranking BM25) con estratto e filtri su paese, anno e costo """
+    try:
+        risultati = cerca_progetti(q, paese, anno_min, anno_max, costo_min, costo_max, limite=limit)
+    except sqlite3.Error as e:
+        raise HTTPException(status_code=500, detail=f"❌ Errore nel database: {str(e)}")
+    return {"risultati": risultati}
+
 
 # 📌 Modello dei dati in ingresso
 class ProjectInput(BaseModel):
@@ -168,13 +359,68 @@ class ProjectInput(BaseModel):
     paese: str
     superficie_mq: float
     costo_milioni: float
+    # 📌 Pesi opzionali per campo testuale (es. {"problema": 4.0}); i mancanti usano TEXT_WEIGHTS
+    pesi: Optional[Dict[str, float]] = None
 
 @app.post("/match_project/")
-def match_project(project: ProjectInput):
-    """ Riceve i dati del progetto e restituisce i più simili dal database """
-    risultati = calcola_similarita(project)
+def match_project(project: ProjectInput, k: int = Query(5, ge=1, le=100),
+                  engine: str = Query("tfidf", pattern="^(tfidf|dense|hybrid)$")):
+    """ Riceve i dati del progetto e restituisce i `k` più simili dal database, con il motore scelto """
+    try:
+        risultati = calcola_similarita(project, k=k, motore=engine)
+    except IndiceDensoNonPronto as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     
     if not risultati:
         raise HTTPException(status_code=404, detail="Nessun progetto trovato.")
 
     return {"progetti_simili": risultati}
+
+@app.post("/match_project/report")
+def match_project_report(project: ProjectInput, k: int = Query(5, ge=1, le=100),
+                         engine: str = Query("tfidf", pattern="^(tfidf|dense|hybrid)$"),
+                         background: bool = Query(False, description="Se vero accoda il lavoro invece di attendere il PDF")):
+    """
+    Pipeline completa in memoria: trova i progetti simili e genera il report su di essi.
+    Restituisce direttamente il PDF come download, oppure (background=true) l'id del lavoro
+    da seguire su /reports/{id}/events e scaricare da /reports/{id}/pdf.
+    """
+    if background:
+        id_lavoro = accoda_report("match + report", project_input=project, k=k, motore=engine)
+        return JSONResponse({"job_id": id_lavoro, "stato": IN_CODA}, status_code=202)
+
+    try:
+        esito = match_e_report(project, k=k, motore=engine)
+    except IndiceDensoNonPronto as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return risposta_pdf(esito["pdf"], uuid.uuid4().hex)
+
+@app.get("/match_project/cache")
+def match_project_cache_stats():
+    """ Statistiche della cache dei risultati di similarità (hit, miss, eviction, ...) """
+    return {"cache": cache_risultati.statistiche(), "versione_indice": get_indice().versione}
+
+# 📌 Numero massimo di aree candidate accettate in una singola chiamata batch
+MAX_BATCH = 200
+
+@app.post("/match_projects/batch")
+def match_projects_batch(projects: List[ProjectInput], k: int = Query(5, ge=1, le=100),
+                         engine: str = Query("tfidf", pattern="^(tfidf|dense|hybrid)$")):
+    """ Riceve più aree candidate e restituisce, per ognuna, i `k` progetti più simili """
+    if not projects:
+        raise HTTPException(status_code=422, detail="Nessun progetto in ingresso.")
+    if len(projects) > MAX_BATCH:
+        raise HTTPException(status_code=422, detail=f"Al massimo {MAX_BATCH} progetti per chiamata.")
+
+    try:
+        risultati = calcola_similarita_batch(projects, k=k, motore=engine)
+    except IndiceDensoNonPronto as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    return {"risultati": [{"nome": p.nome, "progetti_simili": r} for p, r in zip(projects, risultati)]}
@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from app.database import connessione
+
+# 📌 Database della cache delle estrazioni PDF (testo delle pagine + JSON restituito dal modello),
+# sovrascrivibile con CACHE_ESTRAZIONI_PATH
+CACHE_PATH = os.path.abspath(
+    os.getenv("CACHE_ESTRAZIONI_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache_estrazioni.sqlite"))
+)
+
+# 📌 Dimensione massima della cache su disco: oltre si eliminano le voci usate meno di recente
+MAX_BYTE = 200 * 1024 * 1024
+
+# 📌 Blocchi letti per calcolare l'hash senza caricare il PDF intero in memoria
+BLOCCO_LETTURA = 1024 * 1024
+
+
+def hash_file(percorso):
+    """ SHA-256 del contenuto di un file, letto a blocchi """
+    sha = hashlib.sha256()
+    with open(percorso, "rb") as f:
+        for blocco in iter(lambda: f.read(BLOCCO_LETTURA), b""):
+            sha.update(blocco)
+    return sha.hexdigest()
+
+
+def versione_estrazione(*parti):
+    """ Impronta breve di prompt, modello e parametri di estrazione: se cambia, i JSON in cache non valgono più """
+    return hashlib.sha256("\x00".join(str(p) for p in parti).encode("utf-8")).hexdigest()[:16]
+
+
+class CacheEstrazioni:
+    """
+    Cache persistente indirizzata per contenuto: la chiave è lo SHA-256 dei byte del PDF
+    (più la versione di prompt/modello per i JSON), quindi un PDF ricaricato con un altro nome
+    o un lavoro ripetuto costano solo il calcolo dell'hash.
+    Le voci sono in SQLite (una connessione WAL per thread, letture in parallelo);
+    oltre `max_byte` si eliminano quelle lette meno di recente.
+    """
+
+    def __init__(self, percorso=CACHE_PATH, max_byte=MAX_BYTE):
+        self.percorso = percorso
+        self.max_byte = max_byte
+        # 📌 Protegge solo i contatori: le letture e le scritture su SQLite non sono serializzate
+        self._lock = threading.Lock()
+        self.hit = 0
+        self.miss = 0
+        self.eviction = 0
+        self._inizializzata = False
+
+    def _connetti(self):
+        conn = connessione(self.percorso)
+        if not self._inizializzata:
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS estrazioni (
+                        chiave TEXT PRIMARY KEY,
+                        valore TEXT NOT NULL,
+                        dimensione INTEGER NOT NULL,
+                        ultimo_accesso REAL NOT NULL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_estrazioni_accesso ON estrazioni(ultimo_accesso)")
+            self._inizializzata = True
+        return conn
+
+    def _leggi(self, chiave):
+        conn = self._connetti()
+        riga = conn.execute("SELECT valore FROM estrazioni WHERE chiave = ?", (chiave,)).fetchone()
+        if riga is None:
+            with self._lock:
+                self.miss += 1
+            return None
+        with conn:
+            conn.execute("UPDATE estrazioni SET ultimo_accesso = ? WHERE chiave = ?", (time.time(), chiave))
+        with self._lock:
+            self.hit += 1
+        return json.loads(riga[0])
+
+    def _scrivi(self, chiave, valore):
+        testo = json.dumps(valore, ensure_ascii=False)
+        dimensione = len(testo.encode("utf-8"))
+        if dimensione > self.max_byte:
+            return
+
+        conn = self._connetti()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO estrazioni (chiave, valore, dimensione, ultimo_accesso) VALUES (?, ?, ?, ?)",
+                (chiave, testo, dimensione, time.time())
+            )
+            totale = conn.execute("SELECT COALESCE(SUM(dimensione), 0) FROM estrazioni").fetchone()[0]
+            if totale > self.max_byte:
+                self._elimina_vecchie(conn, totale)
+
+    def _elimina_vecchie(self, conn, totale):
+        """ Elimina le voci meno usate di recente finché la cache torna sotto `max_byte` """
+        for chiave, dimensione in conn.execute(
+            "SELECT chiave, dimensione FROM estrazioni ORDER BY ultimo_accesso"
+        ).fetchall():
+            if totale <= self.max_byte:
+                break
+            conn.execute("DELETE FROM estrazioni WHERE chiave = ?", (chiave,))
+            totale -= dimensione
+            with self._lock:
+                self.eviction += 1
+
+    def leggi_pagine(self, sha_pdf):
+        """ Testo estratto pagina per pagina [(numero, testo), ...] o None """
+        pagine = self._leggi(f"pagine:{sha_pdf}")
+        return [tuple(p) for p in pagine] if pagine is not None else None
+
+    def scrivi_pagine(self, sha_pdf, pagine):
+        self._scrivi(f"pagine:{sha_pdf}", list(pagine))
+
+    def leggi_progetti(self, sha_pdf, versione):
+        """ JSON dei progetti estratti dal modello con la versione di prompt/modello indicata, o None """
+        return self._leggi(f"progetti:{sha_pdf}:{versione}")
+
+    def scrivi_progetti(self, sha_pdf, versione, progetti):
+        self._scrivi(f"progetti:{sha_pdf}:{versione}", progetti)
+
+    def svuota(self):
+        conn = self._connetti()
+        with conn:
+            conn.execute("DELETE FROM estrazioni")
+
+    def statistiche(self):
+        voci, byte = self._connetti().execute(
+            "SELECT COUNT(*), COALESCE(SUM(dimensione), 0) FROM estrazioni"
+        ).fetchone()
+        with self._lock:
+            richieste = self.hit + self.miss
+            return {
+                "voci": voci,
+                "byte": byte,
+                "max_byte": self.max_byte,
+                "hit": self.hit,
+                "miss": self.miss,
+                "eviction": self.eviction,
+                "hit_rate": round(self.hit / richieste, 4) if richieste else 0.0,
+            }
@@ -0,0 +1,87 @@
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# 📌 Dimensione massima e durata (secondi) di default della cache dei risultati di similarità
+MAX_VOCI = 1024
+TTL_SECONDI = 300
+
+
+def chiave_canonica(*parti):
+    """ Hash SHA-256 di una rappresentazione JSON canonica (chiavi ordinate) delle parti date """
+    testo = json.dumps(parti, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(testo.encode("utf-8")).hexdigest()
+
+
+class CacheLRU:
+    """
+    Cache LRU con scadenza (TTL) e contatori di hit/miss/eviction.
+    Ogni voce ricorda la versione dei dati da cui è stata calcolata: se alla lettura la versione
+    corrente è diversa la voce viene scartata, così un aggiornamento dell'indice invalida la cache.
+    """
+
+    def __init__(self, max_voci=MAX_VOCI, ttl=TTL_SECONDI, orologio=time.monotonic):
+        self.max_voci = max_voci
+        self.ttl = ttl
+        self._orologio = orologio
+        self._voci = OrderedDict()
+        self._lock = threading.Lock()
+        self.hit = 0
+        self.miss = 0
+        self.eviction = 0
+        self.scadute = 0
+        self.invalidate = 0
+
+    def leggi(self, chiave, versione=None):
+        """ Restituisce il valore in cache o None (miss, scaduto o calcolato su una versione diversa) """
+        with self._lock:
+            voce = self._voci.get(chiave)
+            if voce is None:
+                self.miss += 1
+                return None
+
+            valore, scadenza, versione_voce = voce
+            if scadenza <= self._orologio():
+                del self._voci[chiave]
+                self.scadute += 1
+                self.miss += 1
+                return None
+            if versione_voce != versione:
+                del self._voci[chiave]
+                self.invalidate += 1
+                self.miss += 1
+                return None
+
+            self._voci.move_to_end(chiave)
+            self.hit += 1
+            return valore
+
+    def scrivi(self, chiave, valore, versione=None):
+        with self._lock:
+            self._voci[chiave] = (valore, self._orologio() + self.ttl, versione)
+            self._voci.move_to_end(chiave)
+            while len(self._voci) > self.max_voci:
+                self._voci.popitem(last=False)
+                self.eviction += 1
+
+    def svuota(self):
+        with self._lock:
+            self.invalidate += len(self._voci)
+            self._voci.clear()
+
+    def statistiche(self):
+        with self._lock:
+            richieste = self.hit + self.miss
+            return {
+                "voci": len(self._voci),
+                "max_voci": self.max_voci,
+                "ttl_secondi": self.ttl,
+                "hit": self.hit,
+                "miss": self.miss,
+                "eviction": self.eviction,
+                "scadute": self.scadute,
+                "invalidate": self.invalidate,
+                "hit_rate": round(self.hit / richieste, 4) if richieste else 0.0,
+            }
@@ -0,0 +1,277 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from app.database import connessione
+
+logger = logging.getLogger(__name__)
+
+# 📌 Stato ed eventi dei lavori condivisi tra i processi (più worker uvicorn): un lavoro avviato
+# da un worker è consultabile da tutti gli altri (sovrascrivibile con LAVORI_DB_PATH)
+LAVORI_PATH = os.path.abspath(
+    os.getenv("LAVORI_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "coda_lavori.sqlite"))
+)
+
+# 📌 Secondi tra due letture degli eventi di un lavoro eseguito da un altro processo
+INTERVALLO_POLLING = 0.2
+
+# 📌 Numero di worker che eseguono i lavori (estrazione PDF, chiamate LLM, scritture DB)
+NUM_WORKER = 4
+
+# 📌 Lavori accettati ma non ancora terminati oltre cui le nuove richieste vengono rifiutate
+MAX_IN_CODA = 100
+
+# 📌 Lavori terminati conservati per la consultazione dello stato
+MAX_STORICO = 1000
+
+IN_CODA = "in_coda"
+IN_CORSO = "in_corso"
+COMPLETATO = "completato"
+ERRORE = "errore"
+
+
+class CodaPiena(Exception):
+    """ Sollevata quando ci sono già troppi lavori in attesa """
+
+
+def _adesso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _json(valore):
+    return json.dumps(valore, ensure_ascii=False, default=str)
+
+
+class CodaLavori:
+    """
+    Esegue funzioni bloccanti (parsing PDF, Bedrock, SQLite) in un pool limitato di thread,
+    fuori dall'event loop di FastAPI. Ogni lavoro ha un id, uno stato e un avanzamento
+    consultabili mentre è in esecuzione, e il risultato finale quando termina.
+    Con `percorso` stato ed eventi vengono anche scritti in SQLite, così ogni processo che
+    condivide il file vede i lavori degli altri; con `percorso=None` restano solo in memoria.
+    """
+
+    def __init__(self, num_worker=NUM_WORKER, max_in_coda=MAX_IN_CODA, max_storico=MAX_STORICO,
+                 percorso=LAVORI_PATH):
+        self.max_in_coda = max_in_coda
+        self.max_storico = max_storico
+        self.percorso = percorso
+        self._executor = ThreadPoolExecutor(max_workers=num_worker, thread_name_prefix="lavoro")
+        self._lavori = OrderedDict()
+        self._lock = threading.Lock()
+        # 📌 Risveglia chi attende nuovi eventi (es. gli stream SSE) quando un lavoro ne pubblica
+        self._nuovi_eventi = threading.Condition(self._lock)
+        if percorso is not None:
+            conn = connessione(percorso)
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS lavori (
+                        id TEXT PRIMARY KEY,
+                        creato TEXT NOT NULL,
+                        stato TEXT NOT NULL,
+                        dati TEXT NOT NULL,
+                        risultato TEXT
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_lavori_creato ON lavori(creato)")
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS eventi_lavori (
+                        id_lavoro TEXT NOT NULL,
+                        indice INTEGER NOT NULL,
+                        dati TEXT NOT NULL,
+                        PRIMARY KEY (id_lavoro, indice)
+                    ) WITHOUT ROWID
+                """)
+
+    def _salva(self, lavoro, stato=True, evento=False):
+        """
+        Scrive lo stato del lavoro (`stato`) e/o il suo ultimo evento (`evento`), chiamata con il lock
+        preso: l'ordine resta quello in memoria. I pezzi di testo in streaming scrivono solo l'evento.
+        """
+        if self.percorso is None:
+            return
+        conn = connessione(self.percorso)
+        with conn:
+            if stato:
+                dati = {k: v for k, v in lavoro.items() if k not in ("risultato", "eventi")}
+                conn.execute(
+                    "INSERT OR REPLACE INTO lavori (id, creato, stato, dati, risultato) VALUES (?, ?, ?, ?, ?)",
+                    (lavoro["id"], lavoro["creato"], lavoro["stato"], _json(dati),
+                     None if lavoro["risultato"] is None else _json(lavoro["risultato"]))
+                )
+            if evento:
+                conn.execute(
+                    "INSERT OR IGNORE INTO eventi_lavori (id_lavoro, indice, dati) VALUES (?, ?, ?)",
+                    (lavoro["id"], len(lavoro["eventi"]) - 1, _json(lavoro["eventi"][-1]))
+                )
+
+    def _leggi(self, id_lavoro):
+        """ Stato (senza eventi) di un lavoro salvato in SQLite, anche da un altro processo """
+        if self.percorso is None:
+            return None
+        riga = connessione(self.percorso).execute(
+            "SELECT dati, risultato FROM lavori WHERE id = ?", (id_lavoro,)
+        ).fetchone()
+        if riga is None:
+            return None
+        return {**json.loads(riga[0]), "risultato": json.loads(riga[1]) if riga[1] is not None else None}
+
+    def _attivi(self):
+        return sum(1 for lavoro in self._lavori.values() if lavoro["stato"] in (IN_CODA, IN_CORSO))
+
+    def _pulisci_storico(self):
+        terminati = [i for i, lavoro in self._lavori.items() if lavoro["stato"] in (COMPLETATO, ERRORE)]
+        for id_lavoro in terminati[:max(0, len(self._lavori) - self.max_storico)]:
+            del self._lavori[id_lavoro]
+        if self.percorso is None:
+            return
+        conn = connessione(self.percorso)
+        with conn:
+            vecchi = [riga[0] for riga in conn.execute(
+                "SELECT id FROM lavori WHERE stato IN (?, ?) ORDER BY creato DESC LIMIT -1 OFFSET ?",
+                (COMPLETATO, ERRORE, self.max_storico)
+            )]
+            conn.executemany("DELETE FROM lavori WHERE id = ?", [(i,) for i in vecchi])
+            conn.executemany("DELETE FROM eventi_lavori WHERE id_lavoro = ?", [(i,) for i in vecchi])
+
+    def invia(self, funzione, *args, descrizione=None, con_eventi=False, **kwargs):
+        """
+        Accoda `funzione(*args, progresso=..., **kwargs)` e restituisce subito l'id del lavoro.
+        `progresso(fase, percentuale)` può essere chiamata dalla funzione per aggiornare lo stato.
+        Con `con_eventi=True` la funzione riceve anche `evento(dict)` per pubblicare eventi
+        (es. il testo generato a pezzi), leggibili in ordine con `attendi_eventi`.
+        """
+        id_lavoro = uuid.uuid4().hex
+        with self._lock:
+            if self._attivi() >= self.max_in_coda:
+                raise CodaPiena(f"Troppi lavori in coda (massimo {self.max_in_coda}).")
+            self._lavori[id_lavoro] = {
+                "id": id_lavoro,
+                "descrizione": descrizione,
+                "stato": IN_CODA,
+                "fase": "in attesa di un worker",
+                "percentuale": 0,
+                "creato": _adesso(),
+                "iniziato": None,
+                "terminato": None,
+                "risultato": None,
+                "errore": None,
+                "eventi": [],
+            }
+            self._salva(self._lavori[id_lavoro])
+            self._pulisci_storico()
+
+        def progresso(fase, percentuale=None):
+            campi = {"fase": fase, **({} if percentuale is None else {"percentuale": percentuale})}
+            self._aggiorna(id_lavoro, evento={"tipo": "progresso", **campi}, **campi)
+
+        def evento(dati):
+            self._aggiorna(id_lavoro, evento=dati)
+
+        if con_eventi:
+            kwargs["evento"] = evento
+
+        def esegui():
+            self._aggiorna(id_lavoro, stato=IN_CORSO, iniziato=_adesso(), fase="avviato")
+            try:
+                risultato = funzione(*args, progresso=progresso, **kwargs)
+            except Exception as e:
+                logger.exception("❌ Lavoro %s (%s) fallito: %s", id_lavoro, descrizione, e)
+                self._aggiorna(
+                    id_lavoro, stato=ERRORE, errore=str(e), terminato=_adesso(),
+                    evento={"tipo": ERRORE, "errore": str(e)}
+                )
+            else:
+                self._aggiorna(
+                    id_lavoro, stato=COMPLETATO, risultato=risultato, percentuale=100,
+                    fase="completato", terminato=_adesso(), evento={"tipo": COMPLETATO}
+                )
+
+        self._executor.submit(esegui)
+        return id_lavoro
+
+    def _aggiorna(self, id_lavoro, evento=None, **campi):
+        with self._lock:
+            if id_lavoro in self._lavori:
+                self._lavori[id_lavoro].update(campi)
+                if evento is not None:
+                    self._lavori[id_lavoro]["eventi"].append(evento)
+                # 📌 La riga del lavoro si riscrive solo se cambiano stato o avanzamento
+                self._salva(self._lavori[id_lavoro], stato=bool(campi), evento=evento is not None)
+                if evento is not None:
+                    self._nuovi_eventi.notify_all()
+
+    def stato(self, id_lavoro):
+        """ Copia dello stato del lavoro (senza eventi), o None se l'id non esiste (o è uscito dallo storico) """
+        with self._lock:
+            lavoro = self._lavori.get(id_lavoro)
+            if lavoro is not None:
+                return {k: v for k, v in lavoro.items() if k != "eventi"}
+        # 📌 Lavoro accettato da un altro processo
+        return self._leggi(id_lavoro)
+
+    def conteggi(self):
+        """ Numero di lavori noti per stato (in coda, in corso, completati, in errore), di tutti i processi """
+        conteggi = dict.fromkeys((IN_CODA, IN_CORSO, COMPLETATO, ERRORE), 0)
+        if self.percorso is not None:
+            conteggi.update(connessione(self.percorso).execute(
+                "SELECT stato, COUNT(*) FROM lavori GROUP BY stato"
+            ).fetchall())
+            return conteggi
+        with self._lock:
+            for lavoro in self._lavori.values():
+                conteggi[lavoro["stato"]] += 1
+        return conteggi
+
+    def attendi_eventi(self, id_lavoro, da=0, timeout=1.0):
+        """
+        Eventi del lavoro a partire dall'indice `da`, attendendo fino a `timeout` secondi se non
+        ce ne sono di nuovi. Restituisce (eventi, terminato) oppure None se il lavoro non esiste.
+        """
+        with self._nuovi_eventi:
+            lavoro = self._lavori.get(id_lavoro)
+            if lavoro is not None:
+                if len(lavoro["eventi"]) <= da and lavoro["stato"] in (IN_CODA, IN_CORSO):
+                    self._nuovi_eventi.wait(timeout)
+                return lavoro["eventi"][da:], lavoro["stato"] in (COMPLETATO, ERRORE)
+        return self._attendi_eventi_salvati(id_lavoro, da, timeout)
+
+    def _attendi_eventi_salvati(self, id_lavoro, da, timeout):
+        """ Come attendi_eventi per un lavoro di un altro processo: interroga SQLite a intervalli """
+        if self.percorso is None:
+            return None
+        conn = connessione(self.percorso)
+        scadenza = time.monotonic() + timeout
+        while True:
+            riga = conn.execute("SELECT stato FROM lavori WHERE id = ?", (id_lavoro,)).fetchone()
+            if riga is None:
+                return None
+            terminato = riga[0] in (COMPLETATO, ERRORE)
+            # 📌 Stato letto prima degli eventi: se il lavoro risulta terminato, ci sono già tutti
+            eventi = [json.loads(dati) for (dati,) in conn.execute(
+                "SELECT dati FROM eventi_lavori WHERE id_lavoro = ? AND indice >= ? ORDER BY indice",
+                (id_lavoro, da)
+            )]
+            if eventi or terminato or time.monotonic() >= scadenza:
+                return eventi, terminato
+            time.sleep(INTERVALLO_POLLING)
+
+    def elenco(self):
+        """ Riepilogo (senza risultati né eventi) di tutti i lavori noti, dal più recente """
+        if self.percorso is not None:
+            return [json.loads(dati) for (dati,) in connessione(self.percorso).execute(
+                "SELECT dati FROM lavori ORDER BY creato DESC"
+            )]
+        with self._lock:
+            return [
+                {k: v for k, v in lavoro.items() if k not in ("risultato", "eventi")}
+                for lavoro in reversed(self._lavori.values())
+            ]
+
+    def chiudi(self, attendi=True):
+        self._executor.shutdown(wait=attendi)
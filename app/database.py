@@ -0,0 +1,391 @@
+import os
+import re
+import json
+import math
+import sqlite3
+import threading
+import unicodedata
+from app.metriche import fase
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 📌 Unico percorso del database dei progetti (sovrascrivibile con la variabile d'ambiente PROGETTI_DB_PATH)
+DB_PATH = os.path.abspath(os.getenv("PROGETTI_DB_PATH", os.path.join(BASE_DIR, "Progetto_DB", "progetti_DB.sqlite")))
+
+# 📌 Pragmas di ogni connessione: WAL (i lettori non aspettano lo scrittore), fsync solo ai checkpoint,
+# 64 MB di cache di pagine e 256 MB di memory-map del file
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64000,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+    "busy_timeout": 30000,
+}
+
+# 📌 Colonne di progetti_successo scritte dall'ingestione (id escluso)
+COLONNE_PROGETTO = [
+    "nome", "citta", "paese", "anno", "superficie_mq", "tipologia", "problema", "interventi",
+    "costo_milioni", "finanziamento", "benefici_sociali", "benefici_economici", "sostenibilita",
+]
+
+SCHEMA_PROGETTI = """
+    CREATE TABLE IF NOT EXISTS progetti_successo (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nome TEXT UNIQUE,
+        citta TEXT,
+        paese TEXT,
+        anno INTEGER,
+        superficie_mq INTEGER,
+        tipologia TEXT,
+        problema TEXT,
+        interventi TEXT,
+        costo_milioni REAL,
+        finanziamento TEXT,
+        benefici_sociali TEXT,
+        benefici_economici TEXT,
+        sostenibilita TEXT
+    )
+"""
+
+# 📌 Colonne testuali indicizzate nella tabella FTS5 e loro peso nel ranking BM25 (come TEXT_WEIGHTS)
+COLONNE_FTS = {
+    "problema": 3.0,
+    "interventi": 2.5,
+    "tipologia": 2.0,
+    "benefici_sociali": 1.5,
+    "benefici_economici": 1.5,
+    "sostenibilita": 1.0,
+}
+
+# 📌 Tabella FTS5 "external content": non duplica i testi, li legge da progetti_successo tramite rowid = id
+SCHEMA_FTS = f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS progetti_fts USING fts5(
+        {", ".join(COLONNE_FTS)},
+        content='progetti_successo', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+"""
+
+_VECCHI_FTS = ", ".join(f"old.{c}" for c in COLONNE_FTS)
+_NUOVI_FTS = ", ".join(f"new.{c}" for c in COLONNE_FTS)
+
+# 📌 Trigger che tengono l'indice FTS allineato a ogni INSERT / UPDATE / DELETE sulla tabella
+TRIGGER_FTS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS progetti_fts_ai AFTER INSERT ON progetti_successo BEGIN
+        INSERT INTO progetti_fts(rowid, {", ".join(COLONNE_FTS)}) VALUES (new.id, {_NUOVI_FTS});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS progetti_fts_ad AFTER DELETE ON progetti_successo BEGIN
+        INSERT INTO progetti_fts(progetti_fts, rowid, {", ".join(COLONNE_FTS)}) VALUES ('delete', old.id, {_VECCHI_FTS});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS progetti_fts_au AFTER UPDATE ON progetti_successo BEGIN
+        INSERT INTO progetti_fts(progetti_fts, rowid, {", ".join(COLONNE_FTS)}) VALUES ('delete', old.id, {_VECCHI_FTS});
+        INSERT INTO progetti_fts(rowid, {", ".join(COLONNE_FTS)}) VALUES (new.id, {_NUOVI_FTS});
+    END
+    """,
+]
+
+# 📌 Registro delle modifiche in place: ogni UPDATE su progetti_successo assegna alla riga un
+# progressivo crescente, così chi tiene un indice in memoria (anche in un altro processo) sa
+# quali id rivettorizzare. Gli inserimenti e le cancellazioni si vedono già da COUNT / MAX(id)
+SCHEMA_MODIFICHE = [
+    """
+    CREATE TABLE IF NOT EXISTS progetti_modificati (
+        id INTEGER PRIMARY KEY,
+        progressivo INTEGER NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_progetti_modificati_progressivo ON progetti_modificati(progressivo)",
+    """
+    CREATE TRIGGER IF NOT EXISTS progetti_modificati_au AFTER UPDATE ON progetti_successo BEGIN
+        INSERT OR REPLACE INTO progetti_modificati (id, progressivo)
+        VALUES (new.id, COALESCE((SELECT MAX(progressivo) FROM progetti_modificati), 0) + 1);
+    END
+    """,
+]
+
+# 📌 Massimo numero di parametri per una singola clausola IN (limite di SQLite nelle versioni vecchie)
+MAX_PARAMETRI = 500
+
+
+_locale = threading.local()
+
+
+def _apri(db_path):
+    conn = sqlite3.connect(db_path, timeout=PRAGMAS["busy_timeout"] / 1000)
+    for nome, valore in PRAGMAS.items():
+        conn.execute(f"PRAGMA {nome}={valore}")
+    return conn
+
+
+def connessione(db_path=None):
+    """
+    Connessione SQLite del thread corrente per il database indicato (default DB_PATH):
+    viene aperta e configurata una sola volta per thread e per processo, poi riutilizzata.
+    Non va chiusa dal chiamante.
+    """
+    db_path = os.path.abspath(db_path or DB_PATH)
+    # 📌 Dopo un fork (worker multipli) le connessioni ereditate non vanno riusate
+    if getattr(_locale, "pid", None) != os.getpid():
+        _locale.pid = os.getpid()
+        _locale.connessioni = {}
+
+    conn = _locale.connessioni.get(db_path)
+    if conn is None:
+        conn = _locale.connessioni[db_path] = _apri(db_path)
+    return conn
+
+
+def chiudi_connessioni():
+    """ Chiude le connessioni aperte dal thread corrente """
+    for conn in getattr(_locale, "connessioni", {}).values():
+        conn.close()
+    _locale.connessioni = {}
+
+
+def crea_tabella(conn):
+    """
+    Crea la tabella progetti_successo, il suo indice full-text e il registro delle modifiche
+    (con i rispettivi trigger) se non esistono
+    """
+    conn.execute(SCHEMA_PROGETTI)
+    for istruzione in SCHEMA_MODIFICHE:
+        conn.execute(istruzione)
+    nuovo_fts = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'progetti_fts'"
+    ).fetchone() is None
+    conn.execute(SCHEMA_FTS)
+    for trigger in TRIGGER_FTS:
+        conn.execute(trigger)
+    if nuovo_fts:
+        # 📌 Prima creazione su un database già popolato: indicizza le righe esistenti
+        conn.execute("INSERT INTO progetti_fts(progetti_fts) VALUES ('rebuild')")
+
+
+def ultima_modifica(conn):
+    """ Progressivo dell'ultima modifica in place (0 se nessuna, None se manca il registro) """
+    try:
+        return conn.execute("SELECT COALESCE(MAX(progressivo), 0) FROM progetti_modificati").fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+
+
+def ids_modificati(conn, dopo):
+    """ Id dei progetti modificati in place dopo il progressivo `dopo` """
+    return [riga[0] for riga in conn.execute(
+        "SELECT id FROM progetti_modificati WHERE progressivo > ? ORDER BY id", (dopo or 0,)
+    )]
+
+
+def _valore_sql(valore):
+    """ Converte un valore (anche numpy/pandas) in un tipo accettato da sqlite3 """
+    if isinstance(valore, (list, dict)):
+        return json.dumps(valore, ensure_ascii=False)
+    if hasattr(valore, "item"):
+        valore = valore.item()
+    if isinstance(valore, float) and math.isnan(valore):
+        return None
+    return valore
+
+
+def normalizza_chiavi(progetto):
+    """ Stesso dizionario con le chiavi senza accenti né maiuscole (es. "Sostenibilità" -> "sostenibilita") """
+    return {
+        unicodedata.normalize('NFKD', str(k)).encode('ASCII', 'ignore').decode().strip().lower(): v
+        for k, v in progetto.items()
+    }
+
+
+def normalizza_progetto(progetto):
+    """
+    Chiavi normalizzate (vedi normalizza_chiavi), liste in JSON, campi mancanti a None.
+    Restituisce la tupla dei valori nell'ordine di COLONNE_PROGETTO.
+    """
+    chiavi = normalizza_chiavi(progetto)
+    return tuple(_valore_sql(chiavi.get(colonna)) for colonna in COLONNE_PROGETTO)
+
+
+def _ids_per_nome(conn, nomi):
+    ids = {}
+    for inizio in range(0, len(nomi), MAX_PARAMETRI):
+        blocco = nomi[inizio:inizio + MAX_PARAMETRI]
+        segnaposti = ",".join("?" * len(blocco))
+        ids.update(conn.execute(
+            f"SELECT nome, id FROM progetti_successo WHERE nome IN ({segnaposti})", blocco
+        ).fetchall())
+    return ids
+
+
+def _righe_per_id(conn, ids):
+    """ Valori correnti (tupla di COLONNE_PROGETTO) delle righe con gli id indicati """
+    righe = {}
+    for inizio in range(0, len(ids), MAX_PARAMETRI):
+        blocco = ids[inizio:inizio + MAX_PARAMETRI]
+        segnaposti = ",".join("?" * len(blocco))
+        for riga in conn.execute(
+            f"SELECT id, {', '.join(COLONNE_PROGETTO)} FROM progetti_successo WHERE id IN ({segnaposti})", blocco
+        ):
+            righe[riga[0]] = riga[1:]
+    return righe
+
+
+def upsert_progetti(db_path, progetti, aggiorna=False):
+    """
+    Inserisce in blocco una lista di progetti (dizionari) con un solo `executemany`
+    `INSERT ... ON CONFLICT(nome)` in un'unica transazione, sulla connessione WAL del thread.
+    Con `aggiorna=True` i progetti già presenti (stesso nome) vengono aggiornati se qualche
+    campo è cambiato, altrimenti vengono ignorati.
+    Restituisce i conteggi inseriti / aggiornati / ignorati e gli id coinvolti.
+    """
+    righe = [normalizza_progetto(progetto) for progetto in progetti]
+    scartate = sum(1 for riga in righe if not riga[0])
+    righe = [riga for riga in righe if riga[0]]
+    nomi = list(dict.fromkeys(riga[0] for riga in righe))
+
+    colonne = ", ".join(COLONNE_PROGETTO)
+    segnaposti = ", ".join("?" * len(COLONNE_PROGETTO))
+    if aggiorna:
+        altre = COLONNE_PROGETTO[1:]
+        # 📌 Aggiorna solo se qualcosa è cambiato: le righe identiche contano come ignorate
+        conflitto = (
+            f"DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in altre)} "
+            f"WHERE ({', '.join(altre)}) IS NOT ({', '.join(f'excluded.{c}' for c in altre)})"
+        )
+    else:
+        conflitto = "DO NOTHING"
+
+    conn = connessione(db_path)
+    with fase("scrittura_db"), conn:
+        # 📌 Lock di scrittura preso subito: controllo dei nomi esistenti e inserimento sono atomici.
+        # Prima di crea_tabella, il cui 'rebuild' FTS aprirebbe già una transazione implicita
+        conn.execute("BEGIN IMMEDIATE")
+        crea_tabella(conn)
+        esistenti = _ids_per_nome(conn, nomi)
+        # 📌 Valori prima dell'upsert: servono a sapere quali righe esistenti sono cambiate davvero
+        prima = _righe_per_id(conn, list(esistenti.values())) if aggiorna else {}
+        # 📌 rowcount, a differenza di total_changes, non conta le scritture dei trigger FTS
+        modifiche = conn.executemany(
+            f"INSERT INTO progetti_successo ({colonne}) VALUES ({segnaposti}) ON CONFLICT(nome) {conflitto}",
+            righe
+        ).rowcount
+        ids = _ids_per_nome(conn, nomi)
+        dopo = _righe_per_id(conn, list(prima)) if prima else {}
+
+    ids_inseriti = [ids[nome] for nome in nomi if nome not in esistenti]
+    ids_aggiornati = [id_progetto for id_progetto, valori in prima.items() if dopo.get(id_progetto) != valori]
+    # 📌 Anche i doppioni nello stesso blocco che modificano una riga appena inserita contano come aggiornati
+    aggiornati = modifiche - len(ids_inseriti)
+    return {
+        "inseriti": len(ids_inseriti),
+        "aggiornati": aggiornati,
+        "ignorati": len(righe) + scartate - len(ids_inseriti) - aggiornati,
+        "ids_inseriti": ids_inseriti,
+        "ids_aggiornati": ids_aggiornati,
+    }
+
+
+def query_fts(testo):
+    """
+    Trasforma il testo libero dell'utente in una query FTS5 sicura: ogni parola diventa
+    un termine tra virgolette (nessun operatore interpretato) e devono comparire tutte.
+    """
+    termini = re.findall(r"\w+", testo or "")
+    return " ".join(f'"{termine}"' for termine in termini)
+
+
+def cerca_progetti(testo, paese=None, anno_min=None, anno_max=None, costo_min=None, costo_max=None,
+                   limite=20, db_path=None):
+    """
+    Ricerca full-text sui campi testuali con ranking BM25 (pesato per colonna) ed estratto
+    del testo con i termini evidenziati; filtri opzionali su paese, anno e costo.
+    """
+    query = query_fts(testo)
+    if not query:
+        return []
+
+    filtri, parametri = [], [query]
+    if paese:
+        filtri.append("p.paese = ? COLLATE NOCASE")
+        parametri.append(paese)
+    # 📌 Le colonne numeriche possono contenere testo ("N/D"): in SQLite il testo è sempre maggiore
+    # di un numero, quindi senza il controllo sul tipo supererebbe ogni filtro "minimo"
+    for colonna, condizione, valore in (("p.anno", ">=", anno_min), ("p.anno", "<=", anno_max),
+                                        ("p.costo_milioni", ">=", costo_min), ("p.costo_milioni", "<=", costo_max)):
+        if valore is not None:
+            filtri.append(f"typeof({colonna}) IN ('integer', 'real') AND {colonna} {condizione} ?")
+            parametri.append(valore)
+    parametri.append(limite)
+
+    pesi_bm25 = ", ".join(str(peso) for peso in COLONNE_FTS.values())
+    sql = f"""
+        SELECT p.id, p.nome, p.citta, p.paese, p.anno, p.costo_milioni,
+               bm25(progetti_fts, {pesi_bm25}) AS punteggio,
+               snippet(progetti_fts, -1, '[', ']', '…', 12) AS estratto
+        FROM progetti_fts
+        JOIN progetti_successo p ON p.id = progetti_fts.rowid
+        WHERE progetti_fts MATCH ? {"".join(" AND " + f for f in filtri)}
+        ORDER BY punteggio
+        LIMIT ?
+    """
+    cursor = connessione(db_path).execute(sql, parametri)
+    colonne = [desc[0] for desc in cursor.description]
+    # 📌 BM25 di SQLite è negativo (più basso = migliore): lo esponiamo come punteggio positivo
+    return [
+        {**dict(zip(colonne, riga)), "punteggio": round(-riga[colonne.index("punteggio")], 4)}
+        for riga in cursor.fetchall()
+    ]
+
+
+# 📌 Colonne leggibili dall'elenco paginato (whitelist: i nomi finiscono nel testo SQL)
+COLONNE_ELENCO = ["id"] + COLONNE_PROGETTO
+
+
+def elenca_progetti(colonne=None, cursore=None, limite=50, crescente=False, paese=None,
+                    anno_min=None, anno_max=None, costo_min=None, costo_max=None, db_path=None):
+    """
+    Pagina di progetti con paginazione keyset su `id`: `cursore` è l'id dell'ultima riga
+    della pagina precedente (niente OFFSET, costo costante anche in fondo alla tabella).
+    Legge solo le `colonne` richieste, così i testi lunghi non vengono trasferiti se non servono.
+    Restituisce (righe, cursore_successivo), con cursore_successivo None sull'ultima pagina.
+    """
+    colonne = list(dict.fromkeys(colonne or COLONNE_ELENCO))
+    sconosciute = [c for c in colonne if c not in COLONNE_ELENCO]
+    if sconosciute:
+        raise ValueError(f"Colonne non valide: {', '.join(sconosciute)} (ammesse: {', '.join(COLONNE_ELENCO)})")
+    selezionate = colonne if "id" in colonne else ["id"] + colonne
+
+    filtri, parametri = [], []
+    if cursore is not None:
+        filtri.append("id > ?" if crescente else "id < ?")
+        parametri.append(cursore)
+    if paese:
+        filtri.append("paese = ? COLLATE NOCASE")
+        parametri.append(paese)
+    # 📌 Come in cerca_progetti: i valori testuali ("N/D") non superano i filtri numerici
+    for colonna, condizione, valore in (("anno", ">=", anno_min), ("anno", "<=", anno_max),
+                                        ("costo_milioni", ">=", costo_min), ("costo_milioni", "<=", costo_max)):
+        if valore is not None:
+            filtri.append(f"typeof({colonna}) IN ('integer', 'real') AND {colonna} {condizione} ?")
+            parametri.append(valore)
+    # 📌 Una riga in più per sapere se esiste una pagina successiva
+    parametri.append(limite + 1)
+
+    sql = (
+        f"SELECT {', '.join(selezionate)} FROM progetti_successo"
+        f"{' WHERE ' + ' AND '.join(filtri) if filtri else ''}"
+        f" ORDER BY id {'ASC' if crescente else 'DESC'} LIMIT ?"
+    )
+    righe = connessione(db_path).execute(sql, parametri).fetchall()
+
+    altre_pagine = len(righe) > limite
+    righe = righe[:limite]
+    cursore_successivo = righe[-1][0] if altre_pagine else None
+
+    # 📌 L'id serve sempre per il cursore, ma viene restituito solo se richiesto
+    inizio = 0 if "id" in colonne else 1
+    return [dict(zip(selezionate[inizio:], riga[inizio:])) for riga in righe], cursore_successivo
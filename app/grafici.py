@@ -0,0 +1,90 @@
+import io
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from app.cache_risultati import CacheLRU, chiave_canonica
+
+# 📌 Dimensioni (pollici) e risoluzione dei PNG
+DIMENSIONI = (8, 5)
+DPI = 100
+
+# 📌 Barre per grafico: con molti progetti si mostrano i valori più alti (oltre non sarebbero leggibili)
+MAX_BARRE = 25
+
+# 📌 PNG già renderizzati, riutilizzati per gli stessi dati (stessi progetti => stessi byte)
+cache_grafici = CacheLRU(max_voci=256, ttl=3600)
+
+# 📌 Grafici del report: nome -> (titolo, etichetta asse y, colore)
+GRAFICI = {
+    "costi": ("Confronto Costi dei Progetti", "Costo (milioni €)", "blue"),
+    "superficie": ("Confronto Superficie dei Progetti", "Superficie (mq)", "green"),
+    "costo_mq": ("Costo per Metro Quadro", "Costo (€/mq)", "darkorange"),
+}
+
+
+def renderizza_barre(nomi, valori, titolo, etichetta_y, colore):
+    """
+    PNG (bytes) di un grafico a barre, renderizzato in memoria con l'API a oggetti e il
+    backend Agg: nessuno stato globale di pyplot, quindi sicuro in thread e processi paralleli.
+    """
+    fig = Figure(figsize=DIMENSIONI, dpi=DPI)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.bar(nomi, valori, color=colore)
+    ax.set_xlabel("Progetti")
+    ax.set_ylabel(etichetta_y)
+    ax.set_title(titolo)
+    ax.tick_params(axis="x", labelrotation=45)
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+def serie_grafici(df):
+    """
+    Valori (calcolati per colonne, senza cicli sulle righe) di ogni grafico: nome -> (nomi, valori).
+    Oltre MAX_BARRE progetti restano i MAX_BARRE valori più alti, nell'ordine originale.
+    """
+    nomi = df["nome"].astype(str) if "nome" in df else pd.Series(range(1, len(df) + 1)).astype(str)
+    costo = pd.to_numeric(df["costo_milioni"], errors="coerce") if "costo_milioni" in df else None
+    superficie = pd.to_numeric(df["superficie_mq"], errors="coerce") if "superficie_mq" in df else None
+
+    serie = {}
+    if costo is not None:
+        serie["costi"] = costo
+    if superficie is not None:
+        serie["superficie"] = superficie
+    if costo is not None and superficie is not None:
+        serie["costo_mq"] = costo * 1_000_000 / superficie.where(superficie > 0)
+
+    risultato = {}
+    for nome, valori in serie.items():
+        valori = valori.to_numpy(dtype=float)
+        validi = np.flatnonzero(np.isfinite(valori))
+        if len(validi) > MAX_BARRE:
+            validi = np.sort(validi[np.argpartition(-valori[validi], MAX_BARRE - 1)[:MAX_BARRE]])
+        if len(validi):
+            risultato[nome] = (nomi.iloc[validi].tolist(), np.round(valori[validi], 4).tolist())
+    return risultato
+
+
+def grafici_progetti(progetti):
+    """
+    PNG in memoria dei grafici di confronto (costi, superficie, costo al mq) per una lista di
+    progetti o un DataFrame. I grafici senza dati validi vengono omessi; quelli già
+    renderizzati per gli stessi valori vengono presi dalla cache.
+    """
+    df = progetti if isinstance(progetti, pd.DataFrame) else pd.DataFrame(progetti)
+    grafici = {}
+    for nome, (nomi, valori) in serie_grafici(df).items():
+        titolo, etichetta_y, colore = GRAFICI[nome]
+        chiave = chiave_canonica(nome, nomi, valori, DIMENSIONI, DPI)
+        png = cache_grafici.leggi(chiave)
+        if png is None:
+            png = renderizza_barre(nomi, valori, titolo, etichetta_y, colore)
+            cache_grafici.scrivi(chiave, png)
+        grafici[nome] = png
+    return grafici
@@ -0,0 +1,151 @@
+import copy
+import numpy as np
+import scipy.sparse as sp
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
+
+# 📌 Dimensione degli embedding densi (LSA: TruncatedSVD sulla matrice TF-IDF)
+DIMENSIONI_EMBEDDING = 128
+
+# 📌 Sotto questo numero di progetti la ricerca densa è esatta; sopra si usa l'indice IVF
+SOGLIA_ANN = 2000
+
+# 📌 Liste invertite visitate per ogni query (compromesso recall / velocità)
+NPROBE = 8
+
+
+class IndiceDenso:
+    """
+    Motore di similarità semantica locale (solo CPU, nessun servizio esterno).
+    Gli embedding sono ottenuti con LSA (TruncatedSVD) sulla combinazione pesata dei campi TF-IDF,
+    così "area dismessa" e "ferrovia abbandonata" si avvicinano tramite i termini che co-occorrono.
+    Per cataloghi grandi gli embedding sono organizzati in un indice IVF (k-means + liste invertite):
+    una query visita solo `nprobe` liste, con costo sub-lineare nel numero di progetti.
+    """
+
+    def __init__(self, matrice, proiezione, dimensioni=DIMENSIONI_EMBEDDING, soglia_ann=SOGLIA_ANN,
+                 nprobe=NPROBE, seed=0):
+        """
+        `matrice` è la matrice TF-IDF affiancata per campo (n x F*V) e `proiezione` la matrice
+        sparsa (F*V x V) che somma i blocchi di campo con i pesi di default.
+        """
+        self.proiezione = proiezione
+        self.soglia_ann = soglia_ann
+        self.nprobe = nprobe
+        self.seed = seed
+        self.righe = matrice.shape[0]
+
+        documenti = normalize(matrice @ proiezione)
+        componenti = min(dimensioni, min(documenti.shape) - 1)
+        if componenti >= 1:
+            self.svd = TruncatedSVD(n_components=componenti, random_state=seed)
+            embedding = self.svd.fit_transform(documenti)
+        else:
+            # 📌 Corpus troppo piccolo per una decomposizione: usiamo direttamente il TF-IDF
+            self.svd = None
+            embedding = documenti.toarray()
+        self.embedding = normalize(embedding).astype(np.float32)
+
+        self.centroidi = None
+        self._costruisci_ivf()
+
+    def _costruisci_ivf(self):
+        """ Raggruppa gli embedding con k-means e costruisce le liste invertite """
+        n = len(self.embedding)
+        if n < self.soglia_ann:
+            self.centroidi = None
+            return
+
+        liste = int(np.sqrt(n))
+        kmeans = MiniBatchKMeans(n_clusters=liste, random_state=self.seed, n_init=3, batch_size=4096)
+        etichette = kmeans.fit_predict(self.embedding)
+        self.centroidi = normalize(kmeans.cluster_centers_).astype(np.float32)
+        self._indicizza_liste(etichette)
+
+    def _etichette(self, embedding, blocco=4096):
+        """ Lista IVF più vicina per ogni embedding, a blocchi per non allocare n x liste in una volta """
+        if not len(embedding):
+            return np.empty(0, dtype=np.int32)
+        return np.concatenate([
+            np.argmax(embedding[i:i + blocco] @ self.centroidi.T, axis=1) for i in range(0, len(embedding), blocco)
+        ])
+
+    def _indicizza_liste(self, etichette):
+        self.etichette = etichette.astype(np.int32)
+        self._ordine = np.argsort(self.etichette, kind="stable")
+        self._inizi = np.searchsorted(self.etichette[self._ordine], np.arange(len(self.centroidi) + 1))
+
+    def _proietta(self, matrice_tfidf):
+        """ Embedding normalizzati di righe TF-IDF (combinate o affiancate per campo) """
+        matrice_tfidf = normalize(matrice_tfidf)
+        embedding = self.svd.transform(matrice_tfidf) if self.svd is not None else matrice_tfidf.toarray()
+        return normalize(embedding).astype(np.float32)
+
+    def incorpora(self, query):
+        """ Embedding delle query (matrice m x V già combinata con i pesi dei campi) """
+        return self._proietta(query)
+
+    def aggiungi(self, matrice_nuova):
+        """
+        Restituisce un nuovo indice con le righe (n' x F*V) accodate, senza rifare il fit:
+        SVD e centroidi restano quelli correnti. L'indice originale non viene modificato,
+        così le query in corso continuano a leggerlo in modo consistente.
+        """
+        aggiornato = copy.copy(self)
+        nuovi = self._proietta(matrice_nuova @ self.proiezione)
+        aggiornato.embedding = np.vstack([self.embedding, nuovi])
+        aggiornato.righe = len(aggiornato.embedding)
+        if self.centroidi is None:
+            aggiornato._costruisci_ivf()
+        else:
+            aggiornato._indicizza_liste(np.concatenate([self.etichette, self._etichette(nuovi)]))
+        return aggiornato
+
+    def sostituisci(self, posizioni, matrice_righe):
+        """
+        Restituisce un nuovo indice con le righe in `posizioni` sostituite dalle righe (u x F*V) date,
+        proiettate con SVD e centroidi correnti. L'indice originale non viene modificato.
+        """
+        aggiornato = copy.copy(self)
+        nuovi = self._proietta(matrice_righe @ self.proiezione)
+        aggiornato.embedding = self.embedding.copy()
+        aggiornato.embedding[posizioni] = nuovi
+        if self.centroidi is not None:
+            etichette = self.etichette.copy()
+            etichette[posizioni] = self._etichette(nuovi)
+            aggiornato._indicizza_liste(etichette)
+        return aggiornato
+
+    def riproietta(self, matrice):
+        """
+        Restituisce un nuovo indice sulle righe (n x F*V) date, proiettate con SVD e centroidi correnti
+        senza rifare il fit: allinea un indice appena costruito alle righe accodate o modificate nel frattempo.
+        """
+        aggiornato = copy.copy(self)
+        aggiornato.embedding = self._proietta(matrice @ self.proiezione)
+        aggiornato.righe = len(aggiornato.embedding)
+        if self.centroidi is None:
+            aggiornato._costruisci_ivf()
+        else:
+            aggiornato._indicizza_liste(self._etichette(aggiornato.embedding))
+        return aggiornato
+
+    def candidati(self, embedding_query):
+        """ Righe da confrontare per una query: tutte (ricerca esatta) o quelle delle `nprobe` liste più vicine """
+        if self.centroidi is None:
+            return np.arange(self.righe)
+
+        vicinanza = self.centroidi @ embedding_query
+        nprobe = min(self.nprobe, len(self.centroidi))
+        liste = np.argpartition(-vicinanza, nprobe - 1)[:nprobe]
+        return np.sort(np.concatenate([self._ordine[self._inizi[l]:self._inizi[l + 1]] for l in liste]))
+
+    def punteggi(self, righe, embedding_query):
+        """ Similarità del coseno tra la query e le righe indicate """
+        return self.embedding[righe] @ embedding_query
+
+
+def proiezione_campi(pesi, vocabolario):
+    """ Matrice (F*V x V) che somma i blocchi di campo della matrice affiancata con i pesi dati """
+    return sp.vstack([peso * sp.identity(vocabolario, format="csr") for peso in pesi], format="csr")
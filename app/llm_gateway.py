@@ -0,0 +1,289 @@
+import os
+import re
+import time
+import random
+import asyncio
+import logging
+import threading
+from types import SimpleNamespace
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError, ConnectionClosedError
+from dotenv import load_dotenv
+from app.metriche import fase, chiamate_llm
+
+# 🔹 Carica variabili d'ambiente
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 📌 Modello e regione Bedrock condivisi da tutti gli agenti
+MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
+REGIONE = "eu-west-1"
+
+# 📌 Connessioni HTTP riutilizzate dal client boto3 condiviso
+MAX_CONNESSIONI = 16
+
+# 📌 Chiamate contemporanee al modello (estrazioni a blocchi, report, ...)
+MAX_PARALLELO = 8
+
+# 📌 Token bucket: richieste al secondo sostenute e raffica massima ammessa (quota Bedrock)
+RICHIESTE_AL_SECONDO = 2.0
+RAFFICA = 4
+
+# 📌 Retry con backoff esponenziale (con jitter) sugli errori temporanei
+TENTATIVI = 5
+ATTESA_BASE = 1.0
+ATTESA_MASSIMA = 30.0
+
+# 📌 Con LLM_FINTO=1 gli agenti usano un modello locale: niente rete, utile offline e nei benchmark
+USA_MODELLO_FINTO = os.getenv("LLM_FINTO", "").lower() in ("1", "true", "si")
+
+# 📌 Codici Bedrock per cui ha senso riprovare
+ERRORI_TEMPORANEI = {
+    "ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException",
+    "ModelTimeoutException", "InternalServerException", "ModelNotReadyException",
+}
+
+
+class TokenBucket:
+    """
+    Limitatore di frequenza: ogni chiamata consuma un gettone, i gettoni si ricaricano
+    a `frequenza` al secondo fino a `capacita`. Condiviso da tutti i thread, così le chiamate
+    parallele restano entro la quota invece di farsi rifiutare da Bedrock.
+    """
+
+    def __init__(self, frequenza=RICHIESTE_AL_SECONDO, capacita=RAFFICA, orologio=time.monotonic, dormi=time.sleep):
+        self.frequenza = frequenza
+        self.capacita = capacita
+        self._orologio = orologio
+        self._dormi = dormi
+        self._gettoni = float(capacita)
+        self._ultimo = orologio()
+        self._lock = threading.Lock()
+
+    def _ricarica(self):
+        adesso = self._orologio()
+        self._gettoni = min(self.capacita, self._gettoni + (adesso - self._ultimo) * self.frequenza)
+        self._ultimo = adesso
+
+    def acquisisci(self, gettoni=1):
+        """ Attende finché sono disponibili `gettoni` gettoni e li consuma """
+        while True:
+            with self._lock:
+                self._ricarica()
+                if self._gettoni >= gettoni:
+                    self._gettoni -= gettoni
+                    return
+                attesa = (gettoni - self._gettoni) / self.frequenza
+            self._dormi(attesa)
+
+
+class ModelloFinto:
+    """
+    Modello locale con la stessa interfaccia di ChatBedrock (`invoke(prompt).content`).
+    `risposta` può essere una stringa fissa o una funzione del prompt; `errori_iniziali`
+    simula altrettanti throttling prima di rispondere, `latenza` il tempo di una chiamata.
+    """
+
+    def __init__(self, risposta="[]", latenza=0.0, errori_iniziali=0):
+        self.risposta = risposta
+        self.latenza = latenza
+        self.errori_iniziali = errori_iniziali
+        self.chiamate = 0
+        self._lock = threading.Lock()
+
+    def invoke(self, prompt):
+        with self._lock:
+            self.chiamate += 1
+            if self.errori_iniziali > 0:
+                self.errori_iniziali -= 1
+                raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "simulato"}}, "InvokeModel")
+        if self.latenza:
+            time.sleep(self.latenza)
+        contenuto = self.risposta(prompt) if callable(self.risposta) else self.risposta
+        return SimpleNamespace(content=contenuto)
+
+    def stream(self, prompt):
+        """ Come `invoke`, ma restituisce la risposta a pezzi (una parola alla volta) """
+        contenuto = self.invoke(prompt).content
+        for parola in re.findall(r"\S+\s*", contenuto):
+            yield SimpleNamespace(content=parola)
+
+
+_client = None
+_lock_client = threading.Lock()
+
+
+def client_bedrock():
+    """ Client boto3 `bedrock-runtime` unico per il processo (thread-safe, con pool di connessioni) """
+    global _client
+    with _lock_client:
+        if _client is None:
+            # 📌 Import pesanti solo al primo uso: importare gli agenti non tocca boto3
+            import boto3
+            import urllib3
+            from botocore.config import Config
+
+            logger.info("📌 Inizializzazione di Bedrock...")
+            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+            _client = boto3.client(
+                service_name='bedrock-runtime',
+                region_name=REGIONE,
+                aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+                aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+                verify=False,
+                config=Config(
+                    proxies={'https': None},
+                    max_pool_connections=MAX_CONNESSIONI,
+                    # 📌 I retry li gestisce il gateway: evitiamo di moltiplicarli con quelli di boto3
+                    retries={"max_attempts": 1, "mode": "standard"},
+                )
+            )
+            logger.info("✅ Client Amazon Bedrock inizializzato correttamente!")
+        return _client
+
+
+def get_llm(temperature=0, max_tokens=4000):
+    """ ChatBedrock (Claude 3 Haiku) sul client condiviso, o il modello finto se LLM_FINTO=1 """
+    if USA_MODELLO_FINTO:
+        return ModelloFinto()
+    from langchain_aws import ChatBedrock
+    return ChatBedrock(
+        model_id=MODEL_ID,
+        client=client_bedrock(),
+        model_kwargs={"temperature": temperature, "max_tokens": max_tokens}
+    )
+
+
+def errore_temporaneo(errore):
+    """ True se l'errore è un throttling / disservizio per cui conviene riprovare """
+    if isinstance(errore, (EndpointConnectionError, ReadTimeoutError, ConnectionClosedError)):
+        return True
+    if isinstance(errore, ClientError):
+        return errore.response.get("Error", {}).get("Code") in ERRORI_TEMPORANEI
+    # 📌 langchain può rilanciare l'errore di boto3 avvolto in un'altra eccezione
+    causa = errore.__cause__ or errore.__context__
+    if causa is not None and causa is not errore:
+        return errore_temporaneo(causa)
+    return any(codice in str(errore) for codice in ERRORI_TEMPORANEI)
+
+
+class GatewayLLM:
+    """
+    Punto unico di accesso al modello: rate limiting con token bucket condiviso,
+    retry con backoff esponenziale sugli errori temporanei e invocazioni parallele
+    (sincrone, a batch o async) su un pool di thread limitato.
+    `invoke` restituisce direttamente il testo della risposta.
+    Il modello può essere passato già pronto oppure come `fabbrica`: in quel caso viene
+    creato solo alla prima chiamata (e una sola volta anche con thread concorrenti).
+    """
+
+    def __init__(self, modello=None, fabbrica=None, limitatore=None, executor=None, tentativi=TENTATIVI,
+                 attesa_base=ATTESA_BASE, attesa_massima=ATTESA_MASSIMA, dormi=time.sleep):
+        if modello is None and fabbrica is None:
+            raise ValueError("Serve un modello o una fabbrica per crearlo.")
+        self._modello = modello
+        self._fabbrica = fabbrica
+        self._lock_modello = threading.Lock()
+        self.limitatore = limitatore or _limitatore
+        self.tentativi = tentativi
+        self.attesa_base = attesa_base
+        self.attesa_massima = attesa_massima
+        self._executor = executor or _executor
+        self._dormi = dormi
+
+    @property
+    def modello(self):
+        if self._modello is None:
+            with self._lock_modello:
+                if self._modello is None:
+                    self._modello = self._fabbrica()
+        return self._modello
+
+    @modello.setter
+    def modello(self, modello):
+        self._modello = modello
+
+    @property
+    def inizializzato(self):
+        return self._modello is not None
+
+    def _attendi_prima_di_riprovare(self, tentativo, errore):
+        if tentativo == self.tentativi or not errore_temporaneo(errore):
+            chiamate_llm.incrementa(esito="errore")
+            raise errore
+        chiamate_llm.incrementa(esito="nuovo_tentativo")
+        # 📌 Full jitter: i thread in attesa non ripartono tutti nello stesso istante
+        attesa = random.uniform(0, min(self.attesa_massima, self.attesa_base * 2 ** (tentativo - 1)))
+        logger.warning("⚠️ Errore temporaneo dal modello (%s): nuovo tentativo tra %.1fs", errore, attesa)
+        self._dormi(attesa)
+
+    def invoke(self, prompt):
+        # 📌 La fase `chiamata_llm` comprende attese del rate limiter e retry: è la latenza vista dagli agenti
+        with fase("chiamata_llm"):
+            for tentativo in range(1, self.tentativi + 1):
+                self.limitatore.acquisisci()
+                try:
+                    risposta = self.modello.invoke(prompt)
+                except Exception as e:
+                    self._attendi_prima_di_riprovare(tentativo, e)
+                else:
+                    chiamate_llm.incrementa(esito="ok")
+                    return risposta.content if hasattr(risposta, "content") else str(risposta)
+
+    def stream(self, prompt):
+        """
+        Genera il testo della risposta a pezzi, man mano che il modello lo produce.
+        Si riprova solo se l'errore arriva prima del primo pezzo (dopo il testo è già uscito).
+        """
+        if not hasattr(self.modello, "stream"):
+            yield self.invoke(prompt)
+            return
+
+        with fase("chiamata_llm"):
+            for tentativo in range(1, self.tentativi + 1):
+                self.limitatore.acquisisci()
+                iniziato = False
+                try:
+                    for pezzo in self.modello.stream(prompt):
+                        testo = pezzo.content if hasattr(pezzo, "content") else str(pezzo)
+                        if testo:
+                            iniziato = True
+                            yield testo
+                    chiamate_llm.incrementa(esito="ok")
+                    return
+                except Exception as e:
+                    if iniziato:
+                        chiamate_llm.incrementa(esito="errore")
+                        raise
+                    self._attendi_prima_di_riprovare(tentativo, e)
+
+    def invia(self, prompt):
+        """ Avvia la chiamata nel pool e restituisce subito un Future con il testo della risposta """
+        return self._executor.submit(self.invoke, prompt)
+
+    def invoke_batch(self, prompts):
+        """ Invoca il modello su tutti i prompt in parallelo; i risultati sono nell'ordine dei prompt """
+        futures = [self.invia(prompt) for prompt in prompts]
+        return [future.result() for future in futures]
+
+    async def ainvoke(self, prompt):
+        return await asyncio.wrap_future(self.invia(prompt))
+
+    async def abatch(self, prompts):
+        return await asyncio.gather(*(self.ainvoke(prompt) for prompt in prompts))
+
+
+# 📌 Quota e pool di thread sono condivisi da tutti i gateway del processo
+_limitatore = TokenBucket()
+_executor = ThreadPoolExecutor(max_workers=MAX_PARALLELO, thread_name_prefix="llm")
+
+
+@lru_cache(maxsize=None)
+def gateway(temperature=0, max_tokens=4000):
+    """
+    Gateway (uno per combinazione di parametri, condiviso tra i moduli) sul modello Bedrock.
+    Non crea nulla subito: client e modello nascono alla prima invocazione.
+    """
+    return GatewayLLM(fabbrica=lambda: get_llm(temperature, max_tokens))
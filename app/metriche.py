@@ -0,0 +1,208 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# 📌 Prefisso dei nomi delle metriche esposte su /metrics
+PREFISSO = "progetto_digita"
+
+# 📌 Limiti superiori (secondi) dei bucket degli istogrammi di durata
+BUCKET_SECONDI = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_registro = []
+
+
+def _testo_etichetta(valore):
+    return str(valore).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metrica:
+    """ Base delle metriche: nome, descrizione, etichette e valori per combinazione di etichette """
+    tipo = None
+
+    def __init__(self, nome, descrizione, etichette=()):
+        self.nome = f"{PREFISSO}_{nome}"
+        self.descrizione = descrizione
+        self.etichette = tuple(etichette)
+        self._valori = {}
+        self._lock = threading.Lock()
+        _registro.append(self)
+
+    def _chiave(self, valori_etichette):
+        return tuple(str(valori_etichette.get(etichetta, "")) for etichetta in self.etichette)
+
+    def _selettore(self, chiave, *extra):
+        coppie = list(zip(self.etichette, chiave)) + list(extra)
+        if not coppie:
+            return ""
+        return "{" + ",".join(f'{nome}="{_testo_etichetta(valore)}"' for nome, valore in coppie) + "}"
+
+    def _campioni(self):
+        with self._lock:
+            return sorted(self._valori.items())
+
+    def esposizione(self):
+        """ Righe nel formato testuale di Prometheus (HELP, TYPE e campioni) """
+        return [f"# HELP {self.nome} {self.descrizione}", f"# TYPE {self.nome} {self.tipo}", *self._righe()]
+
+    def _righe(self):
+        return [f"{self.nome}{self._selettore(chiave)} {valore}" for chiave, valore in self._campioni()]
+
+
+class Contatore(_Metrica):
+    """ Valore che cresce soltanto (richieste servite, chiamate al modello, ...) """
+    tipo = "counter"
+
+    def incrementa(self, quantita=1, **etichette):
+        chiave = self._chiave(etichette)
+        with self._lock:
+            self._valori[chiave] = self._valori.get(chiave, 0) + quantita
+
+
+class Indicatore(_Metrica):
+    """
+    Valore che sale e scende (richieste in corso, lavori in coda). Con `funzione` il valore
+    viene letto al momento dell'esposizione: numero, o dizionario tupla di etichette -> valore.
+    """
+    tipo = "gauge"
+
+    def __init__(self, nome, descrizione, etichette=(), funzione=None):
+        super().__init__(nome, descrizione, etichette)
+        self.funzione = funzione
+
+    def incrementa(self, quantita=1, **etichette):
+        chiave = self._chiave(etichette)
+        with self._lock:
+            self._valori[chiave] = self._valori.get(chiave, 0) + quantita
+
+    def decrementa(self, quantita=1, **etichette):
+        self.incrementa(-quantita, **etichette)
+
+    def _campioni(self):
+        if self.funzione is None:
+            return super()._campioni()
+        valori = self.funzione()
+        return sorted(valori.items()) if isinstance(valori, dict) else [((), valori)]
+
+
+class Istogramma(_Metrica):
+    """ Distribuzione delle durate per bucket cumulativi, con somma e conteggio (da cui medie e percentili) """
+    tipo = "histogram"
+
+    def __init__(self, nome, descrizione, etichette=(), bucket=BUCKET_SECONDI):
+        super().__init__(nome, descrizione, etichette)
+        self.bucket = tuple(sorted(bucket))
+
+    def osserva(self, valore, **etichette):
+        chiave = self._chiave(etichette)
+        posizione = bisect.bisect_left(self.bucket, valore)
+        with self._lock:
+            conteggi = self._valori.get(chiave)
+            if conteggi is None:
+                # 📌 Un contatore per bucket più quello oltre l'ultimo (+Inf), poi somma
+                conteggi = self._valori[chiave] = [0] * (len(self.bucket) + 1) + [0.0]
+            conteggi[posizione] += 1
+            conteggi[-1] += valore
+
+    def _righe(self):
+        righe = []
+        for chiave, conteggi in self._campioni():
+            cumulato = 0
+            for limite, conteggio in zip(self.bucket + ("+Inf",), conteggi[:-1]):
+                cumulato += conteggio
+                righe.append(f"{self.nome}_bucket{self._selettore(chiave, ('le', limite))} {cumulato}")
+            righe.append(f"{self.nome}_sum{self._selettore(chiave)} {conteggi[-1]}")
+            righe.append(f"{self.nome}_count{self._selettore(chiave)} {cumulato}")
+        return righe
+
+    def _campioni(self):
+        with self._lock:
+            return sorted((chiave, list(conteggi)) for chiave, conteggi in self._valori.items())
+
+
+def esposizione():
+    """ Tutte le metriche registrate, nel formato testuale di Prometheus """
+    return "\n".join(riga for metrica in _registro for riga in metrica.esposizione()) + "\n"
+
+
+# 📌 Fasi della pipeline: scrittura_upload, parsing_pdf, chiamata_llm, estrazione_json,
+# scrittura_db, vettorizzazione, punteggio, filtro
+durata_fasi = Istogramma("fase_durata_secondi", "Durata delle fasi della pipeline", ("fase",))
+chiamate_llm = Contatore("chiamate_llm_total", "Chiamate al modello per esito", ("esito",))
+richieste_http = Contatore("richieste_http_total", "Richieste HTTP servite", ("metodo", "percorso", "codice"))
+durata_richieste_http = Istogramma("richiesta_http_durata_secondi", "Durata delle richieste HTTP", ("metodo", "percorso"))
+richieste_in_corso = Indicatore("richieste_http_in_corso", "Richieste HTTP in corso", ("percorso",))
+
+
+@contextmanager
+def fase(nome):
+    """ Misura la durata del blocco e la registra nell'istogramma delle fasi """
+    inizio = time.perf_counter()
+    try:
+        yield
+    finally:
+        durata_fasi.osserva(time.perf_counter() - inizio, fase=nome)
+
+
+def misura_iteratore(nome, iteratore):
+    """
+    Come `iteratore`, ma registra nella fase `nome` solo il tempo speso a produrre gli elementi
+    (non quello di chi li consuma): utile per le pipeline in streaming.
+    """
+    iteratore = iter(iteratore)
+    totale = 0.0
+    try:
+        while True:
+            inizio = time.perf_counter()
+            try:
+                elemento = next(iteratore)
+            except StopIteration:
+                return
+            finally:
+                totale += time.perf_counter() - inizio
+            yield elemento
+    finally:
+        if hasattr(iteratore, "close"):
+            iteratore.close()
+        durata_fasi.osserva(totale, fase=nome)
+
+
+def percorso_route(scope):
+    """ Percorso della route (es. /jobs/{job_id}) invece di quello effettivo: etichette a cardinalità limitata """
+    from starlette.routing import Match
+
+    for route in getattr(scope.get("app"), "routes", []):
+        corrispondenza, _ = route.matches(scope)
+        if corrispondenza == Match.FULL:
+            return getattr(route, "path", scope["path"])
+    return "non_trovato"
+
+
+class MetricheHTTP:
+    """ Middleware ASGI: conteggio, durata (fino all'ultimo byte, anche in streaming) e richieste in corso """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        metodo, percorso = scope["method"], percorso_route(scope)
+        codice = 500
+
+        async def invia(messaggio):
+            nonlocal codice
+            if messaggio["type"] == "http.response.start":
+                codice = messaggio["status"]
+            await send(messaggio)
+
+        richieste_in_corso.incrementa(percorso=percorso)
+        inizio = time.perf_counter()
+        try:
+            await self.app(scope, receive, invia)
+        finally:
+            richieste_in_corso.decrementa(percorso=percorso)
+            durata_richieste_http.osserva(time.perf_counter() - inizio, metodo=metodo, percorso=percorso)
+            richieste_http.incrementa(metodo=metodo, percorso=percorso, codice=codice)
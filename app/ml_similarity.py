@@ -68,75 +68,814 @@
 
 #     return df_filtrato[['id', 'nome', 'citta', 'paese', 'superficie_mq', 'costo_milioni', 'similarita']].head(5).to_dict(orient="records")
 import os
+import logging
 import sqlite3
+import threading
+import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from app.artefatti_tfidf import ARTEFATTI_DIR, salva_artefatti, leggi_manifest, carica_artefatti
+from app.indice_denso import IndiceDenso, proiezione_campi
+from app.cache_risultati import CacheLRU, chiave_canonica
+from app.database import DB_PATH, connessione, ids_modificati, ultima_modifica
+from app.metriche import fase
 
-# 📌 Percorso del database
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, "Progetto_DB", "progetti_DB.sqlite")
+logger = logging.getLogger(__name__)
 
-def carica_progetti():
+# 📌 Pesi di default per i campi testuali (escludendo quelli numerici), sovrascrivibili per richiesta
+TEXT_WEIGHTS = {
+    "problema": 3.0,
+    "interventi": 2.5,
+    "tipologia": 2.0,
+    "benefici_sociali": 1.5,
+    "benefici_economici": 1.5,
+    "nome": 1.0,
+    "sostenibilita": 1.0,
+    "citta": 0.5,
+    "paese": 0.5
+}
+
+# 📌 Campi testuali usati per costruire il testo di ogni progetto
+CAMPI_TESTUALI = list(TEXT_WEIGHTS)
+
+# 📌 Coppie (f, g) con f <= g: la Gram per campo di ogni riga è salvata in forma triangolare compatta
+_COPPIE_CAMPI = [(f, g) for f in range(len(CAMPI_TESTUALI)) for g in range(f, len(CAMPI_TESTUALI))]
+
+# 📌 Colonne restituite al client insieme alla similarità
+COLONNE_RISULTATO = ['id', 'nome', 'citta', 'paese', 'superficie_mq', 'costo_milioni']
+
+# 📌 Numero di progetti simili restituiti di default
+TOP_K = 5
+
+# 📌 Motori di similarità disponibili e peso del TF-IDF nel motore ibrido
+MOTORI = ("tfidf", "dense", "hybrid")
+PESO_IBRIDO_TFIDF = 0.5
+
+# 📌 Il pre-filtro numerico vale solo se lascia almeno k candidati (tanti quanti i risultati richiesti),
+# altrimenti si torna al top-k non filtrato: la stessa regola per tutti i motori
+
+# 📌 Punteggi (input x righe) calcolati per blocchi di questa dimensione: la memoria di un batch
+# resta costante anche su cataloghi grandi
+ELEMENTI_BLOCCO = 1 << 22
+
+# 📌 Quota di righe accodate (rispetto all'ultimo fit) oltre cui vocabolario e IDF vengono ricalcolati
+SOGLIA_DRIFT_IDF = 0.2
+
+def carica_progetti(db_path=DB_PATH):
     """ Carica i dati dal database SQLite e li restituisce come DataFrame """
-    conn = sqlite3.connect(DB_PATH)
-    df = pd.read_sql_query("SELECT * FROM progetti_successo", conn)
-    conn.close()
-    return df
-
-def calcola_similarita(project_input):
-    """ Calcola la similarità tra il progetto dato e tutti i progetti nel database, senza usare pickle. """
-    
-    # 📌 Carichiamo i progetti aggiornati dal database
-    df = carica_progetti()
-    
-    if df.empty:
-        return []
+    return pd.read_sql_query("SELECT * FROM progetti_successo ORDER BY id", connessione(db_path))
+
+def testo_progetto(project_input):
+    """ Combina i campi testuali dell'input utente in un'unica stringa """
+    return " ".join(testi_campi(project_input))
+
+def testi_campi(project_input):
+    """ Restituisce i campi testuali dell'input utente, nell'ordine di `CAMPI_TESTUALI` """
+    return [getattr(project_input, campo, None) or "" for campo in CAMPI_TESTUALI]
+
+def vettore_pesi(pesi=None):
+    """ Converte un dizionario campo -> peso (parziale) nel vettore dei pesi, partendo da `TEXT_WEIGHTS` """
+    pesi = dict(TEXT_WEIGHTS, **(pesi or {}))
+    sconosciuti = set(pesi) - set(TEXT_WEIGHTS)
+    if sconosciuti:
+        raise ValueError(f"Campi di peso non validi: {', '.join(sorted(sconosciuti))}")
+
+    vettore = np.array([float(pesi[campo]) for campo in CAMPI_TESTUALI])
+    if (vettore < 0).any() or not vettore.any():
+        raise ValueError("I pesi devono essere non negativi e non tutti nulli.")
+    return vettore
+
+
+def range_numerici(project_input, tolleranza=0.5):
+    """ Finestre ±50% su superficie e costo usate per filtrare i progetti candidati """
+    superficie_range = (project_input.superficie_mq * (1 - tolleranza), project_input.superficie_mq * (1 + tolleranza))
+    costo_range = (project_input.costo_milioni * (1 - tolleranza), project_input.costo_milioni * (1 + tolleranza))
+    return superficie_range, costo_range
+
+
+class IndiceDensoNonPronto(Exception):
+    """ Sollevata quando il motore denso non è ancora stato costruito (in preparazione in background) """
+
+
+class IndiceNumerico:
+    """
+    Indice ordinato su `superficie_mq` e `costo_milioni`: restituisce le righe nei range
+    con due ricerche binarie, senza scorrere tutto il catalogo.
+    """
+
+    def __init__(self, progetti):
+        self.superficie = progetti["superficie_mq"].to_numpy(dtype=float)
+        self.costo = progetti["costo_milioni"].to_numpy(dtype=float)
+        # 📌 I NaN finiscono in coda all'ordinamento e non rientrano mai in un range
+        self._ordine_superficie = np.argsort(self.superficie, kind="stable")
+        self._ordine_costo = np.argsort(self.costo, kind="stable")
+        self._superficie_ordinata = self.superficie[self._ordine_superficie]
+        self._costo_ordinato = self.costo[self._ordine_costo]
+
+    @staticmethod
+    def _nel_range(ordine, valori_ordinati, minimo, massimo):
+        inizio = np.searchsorted(valori_ordinati, minimo, side="left")
+        fine = np.searchsorted(valori_ordinati, massimo, side="right")
+        return ordine[inizio:fine]
+
+    def candidati(self, superficie_range, costo_range):
+        """ Posizioni (ordinate) delle righe che rispettano entrambi i range """
+        per_superficie = self._nel_range(self._ordine_superficie, self._superficie_ordinata, *superficie_range)
+        per_costo = self._nel_range(self._ordine_costo, self._costo_ordinato, *costo_range)
+
+        # 📌 Partiamo dalla dimensione più selettiva e controlliamo l'altra solo sulle sue righe
+        if len(per_superficie) <= len(per_costo):
+            righe, valori, (minimo, massimo) = per_superficie, self.costo, costo_range
+        else:
+            righe, valori, (minimo, massimo) = per_costo, self.superficie, superficie_range
+        righe = righe[(valori[righe] >= minimo) & (valori[righe] <= massimo)]
+        return np.sort(righe)
+
+
+class IndiceSimilarita:
+    """
+    Indice TF-IDF persistente in memoria, vettorizzato per campo.
+    Per ogni campo testuale tiene una matrice TF-IDF non normalizzata (vocabolario e IDF condivisi)
+    più la Gram per campo di ogni riga: a query time i campi vengono combinati con pesi float
+    arbitrari, equivalenti a concatenare i testi ripetuti per il peso, senza ri-tokenizzare il corpus.
+    Viene costruito una sola volta (all'avvio del backend) e aggiornato quando la tabella
+    `progetti_successo` cambia: ogni richiesta costa una `transform` e qualche prodotto sparso.
+    I nuovi progetti vengono accodati alla matrice con il vocabolario/IDF correnti; il refit
+    completo avviene in background solo quando le righe accodate superano `soglia_drift`.
+    Dopo ogni fit lo stato viene pubblicato come artefatti versionati (vedi `artefatti_tfidf`)
+    che gli altri worker aprono in memory-map invece di rifare il fit.
+    """
+
+    def __init__(self, db_path=DB_PATH, soglia_drift=SOGLIA_DRIFT_IDF,
+                 cartella_artefatti=ARTEFATTI_DIR, salva_su_disco=True):
+        self.db_path = os.path.abspath(db_path)
+        self.soglia_drift = soglia_drift
+        self.cartella_artefatti = cartella_artefatti
+        self.salva_su_disco = salva_su_disco
+        self.versione_artefatti = None
+        # 📌 Stato immutabile (vectorizer, matrice per campo, gram, metadati, indice numerico):
+        # sostituito in blocco, mai modificato
+        self._imposta_stato(None, None, None, pd.DataFrame(columns=COLONNE_RISULTATO))
+        self.firma = None
+        self.righe_al_fit = 0
+        self.righe_accodate = 0
+        self._lock = threading.RLock()
+        # 📌 Ultimo PRAGMA data_version visto dalla connessione di ogni thread
+        self._verifiche = threading.local()
+        self._refit_in_corso = False
+        # 📌 Motore denso e stato da cui deriva: costruito in background (prepara_denso), poi
+        # aggiornato in modo incrementale insieme allo stato
+        self._denso = (None, None)
+        self._lock_denso = threading.Lock()
+        self._thread_denso = None
+
+    def _imposta_stato(self, vectorizer, matrice, gram, progetti, aggiorna_denso=None):
+        """
+        Pubblica un nuovo stato. `aggiorna_denso(denso)` deriva il motore denso del nuovo stato da
+        quello corrente (righe accodate o sostituite): viene pubblicato prima dello stato, così chi
+        legge il nuovo stato trova già il motore denso allineato.
+        """
+        stato = (vectorizer, matrice, gram, progetti, IndiceNumerico(progetti))
+        stato_denso, denso = getattr(self, "_denso", (None, None))
+        if aggiorna_denso is not None and denso is not None and stato_denso is self._stato:
+            self._denso = (stato, aggiorna_denso(denso))
+        self._stato = stato
+        # 📌 Cambia a ogni aggiornamento dello stato: invalida i risultati in cache
+        self.versione = getattr(self, "versione", 0) + 1
+
+    @property
+    def vectorizer(self):
+        return self._stato[0]
+
+    @property
+    def matrice(self):
+        return self._stato[1]
+
+    @property
+    def progetti(self):
+        return self._stato[3]
+
+    def _connetti(self):
+        """ Connessione del thread corrente (dal pool di database.py): non va chiusa """
+        return connessione(self.db_path)
+
+    def _firma_db(self):
+        """ Firma economica della tabella: (numero righe, id massimo, progressivo dell'ultima modifica in place) """
+        conn = self._connetti()
+        try:
+            conteggio, id_massimo = conn.execute("SELECT COUNT(*), MAX(id) FROM progetti_successo").fetchone()
+        except sqlite3.OperationalError:
+            return (0, None, None)
+        return (conteggio, id_massimo, ultima_modifica(conn))
+
+    def db_cambiato(self):
+        """
+        True se dall'ultima verifica di questo thread un'altra connessione (altro thread o altro
+        processo, es. un altro worker uvicorn) ha scritto sul database. PRAGMA data_version
+        costa O(1), a differenza della firma che conta le righe.
+        """
+        try:
+            versione_db = self._connetti().execute("PRAGMA data_version").fetchone()[0]
+        except sqlite3.Error:
+            return True
+        cambiato = getattr(self._verifiche, "data_version", None) != versione_db
+        self._verifiche.data_version = versione_db
+        return cambiato
+
+    @staticmethod
+    def _testi(df):
+        return df[CAMPI_TESTUALI].fillna("").astype(str).agg(" ".join, axis=1)
+
+    @staticmethod
+    def _vettorizza_campi(vectorizer, df):
+        """
+        Restituisce (matrice, Gram compatta) per le righe del DataFrame: le matrici TF-IDF dei
+        singoli campi sono affiancate per colonne (blocco f = colonne f*V .. (f+1)*V), così una
+        query pesata si calcola con un unico prodotto sparso.
+        """
+        matrici = [vectorizer.transform(df[campo].fillna("").astype(str)).tocsr() for campo in CAMPI_TESTUALI]
+        gram = np.column_stack([
+            np.asarray(matrici[f].multiply(matrici[g]).sum(axis=1)).ravel() for f, g in _COPPIE_CAMPI
+        ]).astype(np.float32)
+        return sp.hstack(matrici, format="csr"), gram
+
+    @staticmethod
+    def _metadati(df):
+        progetti = df[COLONNE_RISULTATO].copy()
+        progetti["superficie_mq"] = pd.to_numeric(progetti["superficie_mq"], errors="coerce")
+        progetti["costo_milioni"] = pd.to_numeric(progetti["costo_milioni"], errors="coerce")
+        return progetti.reset_index(drop=True)
+
+    def _carica_metadati(self):
+        """ Legge solo le colonne leggere (niente testi lunghi) per associare le righe agli id """
+        df = pd.read_sql_query(
+            f"SELECT {', '.join(COLONNE_RISULTATO)} FROM progetti_successo ORDER BY id", self._connetti()
+        )
+        return self._metadati(df)
+
+    def _carica_da_artefatti(self, firma):
+        """ Carica in memory-map gli artefatti su disco se corrispondono allo stato del database """
+        manifest = leggi_manifest(self.cartella_artefatti)
+        if manifest is None or tuple(manifest["firma_db"]) != tuple(firma):
+            return False
+        if manifest.get("campi_testuali") != CAMPI_TESTUALI or "gram" not in manifest["array"]:
+            return False
+
+        progetti = self._carica_metadati()
+        if progetti["id"].tolist() != manifest["ids"]:
+            return False
+
+        vectorizer, matrici, array = carica_artefatti(manifest)
+        self._imposta_stato(vectorizer, matrici["campi"], array["gram"], progetti)
+        self.versione_artefatti = os.path.basename(manifest["cartella"])
+        return True
+
+    def salva_artefatti(self):
+        """ Pubblica lo stato corrente come nuova versione degli artefatti su disco """
+        vectorizer, matrice, gram, progetti, _ = self._stato
+        if vectorizer is None:
+            return None
+        try:
+            return salva_artefatti(
+                vectorizer, {"campi": matrice}, progetti["id"], self.firma, self.cartella_artefatti,
+                array={"gram": gram}, extra={"campi_testuali": CAMPI_TESTUALI}
+            )
+        except OSError as e:
+            logger.warning("⚠️ Impossibile salvare gli artefatti TF-IDF: %s", e)
+            return None
+
+    def costruisci(self, usa_artefatti=True):
+        """ (Ri)costruisce vettorizzatore, matrice per campo e metadati, riusando gli artefatti su disco se validi """
+        with self._lock:
+            firma = self._firma_db()
+            self.righe_accodate = 0
+
+            if usa_artefatti and firma[0] and self._carica_da_artefatti(firma):
+                self.firma = firma
+                self.righe_al_fit = len(self.progetti)
+                return
+
+            df = carica_progetti(self.db_path) if firma[0] else pd.DataFrame()
+
+            if df.empty:
+                self._imposta_stato(None, None, None, pd.DataFrame(columns=COLONNE_RISULTATO))
+            else:
+                # 📌 Vocabolario e IDF sul testo completo; la normalizzazione avviene a query time con i pesi
+                vectorizer = TfidfVectorizer(max_features=5000, norm=None)
+                vectorizer.fit(self._testi(df))
+                matrice, gram = self._vettorizza_campi(vectorizer, df)
+                self._imposta_stato(vectorizer, matrice, gram, self._metadati(df))
+
+            self.firma = firma
+            self.righe_al_fit = len(df)
+
+            if self.salva_su_disco and not df.empty:
+                self.versione_artefatti = self.salva_artefatti()
+
+    def aggiungi_progetti(self, ids=None):
+        """
+        Vettorizza e accoda alla matrice i progetti indicati (o tutti quelli con id
+        maggiore dell'ultimo indicizzato), senza rifare il fit del vocabolario.
+        """
+        with self._lock:
+            vectorizer, matrice, gram, progetti, _ = self._stato
+            if vectorizer is None:
+                self.costruisci()
+                return
+
+            conn = self._connetti()
+            if ids is None:
+                ultimo_id = int(progetti["id"].max()) if len(progetti) else 0
+                nuovi = pd.read_sql_query(
+                    "SELECT * FROM progetti_successo WHERE id > ? ORDER BY id", conn, params=(ultimo_id,)
+                )
+            else:
+                gia_indicizzati = set(progetti["id"])
+                ids = [int(i) for i in ids if i not in gia_indicizzati]
+                segnaposti = ",".join("?" * len(ids))
+                nuovi = pd.read_sql_query(
+                    f"SELECT * FROM progetti_successo WHERE id IN ({segnaposti}) ORDER BY id", conn, params=ids
+                ) if ids else pd.DataFrame()
+            conteggio, id_massimo = conn.execute("SELECT COUNT(*), MAX(id) FROM progetti_successo").fetchone()
 
-    # 📌 Combiniamo i campi testuali per creare il dataset TF-IDF
-    df["testo_completo"] = df[[
-        "problema", "interventi", "tipologia", 
-        "benefici_sociali", "benefici_economici", 
-        "nome", "sostenibilita", "citta", "paese"
-    ]].fillna("").agg(" ".join, axis=1)
+            if not nuovi.empty:
+                matrice_nuova, gram_nuova = self._vettorizza_campi(vectorizer, nuovi)
+                matrice = sp.vstack([matrice, matrice_nuova], format="csr")
+                gram = np.vstack([gram, gram_nuova])
+                progetti = pd.concat([progetti, self._metadati(nuovi)], ignore_index=True)
+                self._imposta_stato(
+                    vectorizer, matrice, gram, progetti, aggiorna_denso=lambda denso: denso.aggiungi(matrice_nuova)
+                )
+                self.righe_accodate += len(nuovi)
 
-    # 📌 Creiamo il TF-IDF dinamicamente
-    vectorizer = TfidfVectorizer(max_features=5000)
-    tfidf_matrix = vectorizer.fit_transform(df["testo_completo"])
+            # 📌 Se la tabella non corrisponde ancora all'indice (es. righe cancellate) serve un refit.
+            # L'ultima modifica in place resta quella già applicata: le modifiche concorrenti non si perdono
+            modifica = self.firma[2] if self.firma is not None else None
+            self.firma = (conteggio, id_massimo, modifica) if conteggio == len(progetti) else None
 
-    # 📌 Prepara l'input dell'utente per la similarità
-    testo_input = " ".join([
-        project_input.problema, project_input.interventi, project_input.tipologia,
-        project_input.benefici_sociali, project_input.benefici_economici,
-        project_input.nome, project_input.sostenibilita, project_input.citta, project_input.paese
-    ])
+            if self.righe_accodate > self.soglia_drift * max(self.righe_al_fit, 1):
+                self._refit_in_background()
+
+    def aggiorna_progetti(self, ids):
+        """
+        Rivettorizza i progetti già indicizzati che sono stati modificati nel database,
+        sostituendone le righe nella matrice senza rifare il fit del vocabolario.
+        """
+        with self._lock:
+            vectorizer, matrice, gram, progetti, _ = self._stato
+            if vectorizer is None:
+                self.costruisci()
+                return
+
+            posizione_per_id = pd.Series(np.arange(len(progetti)), index=progetti["id"].to_numpy())
+            ids = [int(i) for i in ids if i in posizione_per_id.index]
+            if not ids:
+                return
+
+            segnaposti = ",".join("?" * len(ids))
+            aggiornati = pd.read_sql_query(
+                f"SELECT * FROM progetti_successo WHERE id IN ({segnaposti}) ORDER BY id", self._connetti(), params=ids
+            )
+            if aggiornati.empty:
+                return
+
+            posizioni = posizione_per_id.loc[aggiornati["id"]].to_numpy()
+            matrice_nuova, gram_nuova = self._vettorizza_campi(vectorizer, aggiornati)
+
+            # 📌 Azzera le righe vecchie e somma quelle nuove nella stessa posizione: costo O(nnz)
+            n, u = matrice.shape[0], len(posizioni)
+            mantieni = np.ones(n, dtype=matrice.dtype)
+            mantieni[posizioni] = 0
+            posiziona = sp.csr_matrix((np.ones(u, dtype=matrice.dtype), (posizioni, np.arange(u))), shape=(n, u))
+            matrice = (sp.diags(mantieni, format="csr") @ matrice + posiziona @ matrice_nuova).tocsr()
+            matrice.eliminate_zeros()
+            matrice.sort_indices()
+
+            gram = gram.copy()
+            gram[posizioni] = gram_nuova
+            progetti = progetti.copy()
+            metadati = self._metadati(aggiornati)
+            for colonna in COLONNE_RISULTATO:
+                progetti.loc[posizioni, colonna] = metadati[colonna].to_numpy()
+            self._imposta_stato(
+                vectorizer, matrice, gram, progetti,
+                aggiorna_denso=lambda denso: denso.sostituisci(posizioni, matrice_nuova)
+            )
+
+    def _refit_in_background(self):
+        """ Ricalcola vocabolario e IDF in un thread separato: le query continuano sullo stato corrente """
+        if self._refit_in_corso:
+            return
+        self._refit_in_corso = True
+
+        def _esegui():
+            try:
+                self.costruisci(usa_artefatti=False)
+            finally:
+                self._refit_in_corso = False
+            # 📌 Nuovo vocabolario: il motore denso va ricostruito, sempre fuori dalle richieste
+            if self._denso[1] is not None:
+                self.prepara_denso()
+
+        threading.Thread(target=_esegui, daemon=True).start()
+
+    def aggiorna_se_necessario(self):
+        """ Allinea l'indice al database: accoda le righe nuove, ricostruisce solo se necessario """
+        if self.firma is None:
+            self.costruisci()
+            return
+
+        with self._lock:
+            firma = self._firma_db()
+            if self.firma is None or firma == self.firma:
+                return
+
+            conteggio, id_massimo, modifica = firma
+            conteggio_indice, id_massimo_indice, modifica_indice = self.firma
+            solo_inserimenti = (
+                id_massimo_indice is not None and id_massimo is not None
+                and id_massimo > id_massimo_indice and conteggio > conteggio_indice
+            )
+            if not solo_inserimenti and (conteggio, id_massimo) != (conteggio_indice, id_massimo_indice):
+                # 📌 Righe cancellate o tabella ricreata: refit completo
+                self.costruisci()
+                return
+
+            # 📌 Righe modificate in place (anche da altri processi): solo quelle vengono rivettorizzate
+            if modifica is not None and modifica != modifica_indice:
+                self.aggiorna_progetti(ids_modificati(self._connetti(), modifica_indice))
+            if solo_inserimenti:
+                self.aggiungi_progetti()
+            if self.firma is not None:
+                self.firma = (*self.firma[:2], modifica)
+
+    def stato_corrente(self):
+        """ Allinea l'indice al database e restituisce uno snapshot consistente dello stato """
+        # 📌 La firma (COUNT e MAX sull'intera tabella) si ricalcola solo se data_version segnala
+        # una scrittura di un'altra connessione; quelle di questo processo passano da notifica_nuovi_progetti
+        if self.firma is None or self.db_cambiato():
+            self.aggiorna_se_necessario()
+        return self._stato
+
+    @staticmethod
+    def _query(vectorizer, testi_batch, w):
+        """ Una sola transform per tutti i campi di tutti gli input, poi combinazione pesata (m x V) """
+        m, f_campi = w.shape
+        with fase("vettorizzazione"):
+            testi = vectorizer.transform([testo for testi in testi_batch for testo in testi])
+            combinazione = sp.csr_matrix((w.ravel(), (np.repeat(np.arange(m), f_campi), np.arange(m * f_campi))))
+            return combinazione @ testi
+
+    def punteggi_batch(self, testi_batch, pesi_batch=None, range_batch=None, min_candidati=TOP_K,
+                       stato=None, k=None, combina=None):
+        """
+        Similarità di m input in un colpo solo.
+        `testi_batch` è una lista di liste di testi (ordine `CAMPI_TESTUALI`), `pesi_batch` una lista
+        di dizionari campo -> peso (o None) e `range_batch` una lista di (superficie_range, costo_range).
+        Restituisce (metadati, [(posizioni delle righe nello stato, similarità) per input]): per ogni input
+        le righe nei suoi range, o l'intero catalogo se ha meno di `min_candidati` candidati (di norma k).
+        Con `k` restano solo i k migliori di ogni input. `combina(i, righe, similarità)` trasforma i
+        punteggi dell'input i prima della selezione (es. motore ibrido).
+        """
+        m = len(testi_batch)
+        pesi_batch = pesi_batch or [None] * m
+        w = np.vstack([vettore_pesi(pesi) for pesi in pesi_batch])
+        # 📌 Lettura atomica dello stato: un aggiornamento concorrente non mescola matrice e metadati
+        vectorizer, matrice, gram, progetti, numerico = stato or self.stato_corrente()
+        if vectorizer is None:
+            return progetti, None
+
+        # 📌 Pre-filtro numerico: se tutti gli input hanno abbastanza candidati si valuta solo la loro unione
+        righe, limiti = np.arange(matrice.shape[0]), None
+        if range_batch is not None:
+            with fase("filtro"):
+                candidati = [numerico.candidati(*range_input) for range_input in range_batch]
+                # 📌 Chi ha troppi pochi candidati torna al top-k non filtrato
+                filtrati = np.array([len(c) >= min_candidati for c in candidati])
+                limiti = np.array([[*s, *c] for s, c in range_batch])
+                if filtrati.all():
+                    unione = np.zeros(matrice.shape[0], dtype=bool)
+                    for c in candidati:
+                        unione[c] = True
+                    righe = np.flatnonzero(unione)
+
+        # 📌 Query: combinazione pesata dei campi
+        query = self._query(vectorizer, testi_batch, w)
+        ids = progetti["id"].to_numpy()
+        per_input = [([], []) for _ in range(m)]
+
+        with fase("punteggio"):
+            norma_query = np.sqrt(np.asarray(query.multiply(query).sum(axis=1)).ravel())
+            # 📌 Documenti: query affiancata per blocchi di campo (peso_f * query) -> un solo prodotto sparso
+            query_campi = sp.hstack([sp.diags(w[:, f]) @ query for f in range(len(CAMPI_TESTUALI))], format="csr")
+            coefficienti = np.array([w[:, f] * w[:, g] * (1 if f == g else 2) for f, g in _COPPIE_CAMPI])
+
+            # 📌 Il catalogo è valutato a blocchi di righe e di ogni blocco si tengono solo i k migliori
+            # per input: niente matrici dense input x catalogo
+            dimensione = max(ELEMENTI_BLOCCO // m, 1)
+            for inizio in range(0, len(righe), dimensione):
+                blocco = righe[inizio:inizio + dimensione]
+                prodotto = (query_campi @ matrice[blocco].T).toarray()
+                norma_doc = np.sqrt(np.maximum(gram[blocco] @ coefficienti, 0)).T
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    similarita = np.where(
+                        (norma_doc > 0) & (norma_query[:, None] > 0), prodotto / (norma_doc * norma_query[:, None]), 0.0
+                    )
+
+                maschere = None
+                if limiti is not None:
+                    superficie, costo = numerico.superficie[blocco], numerico.costo[blocco]
+                    maschere = (
+                        (superficie >= limiti[:, [0]]) & (superficie <= limiti[:, [1]])
+                        & (costo >= limiti[:, [2]]) & (costo <= limiti[:, [3]])
+                    ) | ~filtrati[:, None]
+
+                for i in range(m):
+                    righe_input, punteggi_input = blocco, similarita[i]
+                    if maschere is not None:
+                        righe_input, punteggi_input = blocco[maschere[i]], punteggi_input[maschere[i]]
+                    if combina is not None:
+                        punteggi_input = combina(i, righe_input, punteggi_input)
+                    if k is not None:
+                        migliori = seleziona_top_k(punteggi_input, ids[righe_input], k)
+                        righe_input, punteggi_input = righe_input[migliori], punteggi_input[migliori]
+                    per_input[i][0].append(righe_input)
+                    per_input[i][1].append(punteggi_input)
+
+        risultati = []
+        for blocchi_righe, blocchi_punteggi in per_input:
+            righe_input = np.concatenate(blocchi_righe) if blocchi_righe else np.empty(0, dtype=np.intp)
+            punteggi_input = np.concatenate(blocchi_punteggi) if blocchi_punteggi else np.empty(0)
+            if k is not None and len(blocchi_righe) > 1:
+                # 📌 I k migliori dell'unione dei migliori di ogni blocco sono i k migliori in assoluto
+                migliori = seleziona_top_k(punteggi_input, ids[righe_input], k)
+                righe_input, punteggi_input = righe_input[migliori], punteggi_input[migliori]
+            risultati.append((righe_input, punteggi_input))
+        return progetti, risultati
+
+    def punteggi(self, testi, pesi=None, superficie_range=None, costo_range=None, min_candidati=TOP_K):
+        """
+        Restituisce (metadati, vettore delle similarità) per i testi dei campi dati
+        (lista nell'ordine di `CAMPI_TESTUALI`), pesati con `pesi` (dizionario campo -> peso).
+        Se sono dati i range numerici, il punteggio viene calcolato solo sulle righe candidate;
+        con meno di `min_candidati` candidati si torna al calcolo sull'intero catalogo.
+        """
+        range_batch = None
+        if superficie_range is not None and costo_range is not None:
+            range_batch = [(superficie_range, costo_range)]
+        progetti, per_input = self.punteggi_batch([testi], [pesi], range_batch, min_candidati)
+        if per_input is None:
+            return progetti, None
+        righe, similarita = per_input[0]
+        return progetti.iloc[righe], similarita
+
+    def prepara_denso(self, attendi=False):
+        """
+        Costruisce (SVD + IVF) il motore denso dello stato corrente in un thread separato: le query
+        continuano sul motore precedente finché il nuovo non è pronto. Con `attendi=True` blocca fino alla fine.
+        """
+        with self._lock_denso:
+            thread = self._thread_denso
+            if thread is None or not thread.is_alive():
+                thread = self._thread_denso = threading.Thread(target=self._costruisci_denso, daemon=True)
+                thread.start()
+        if attendi:
+            thread.join()
+
+    def _costruisci_denso(self):
+        try:
+            while True:
+                stato = self._stato
+                vectorizer, matrice = stato[:2]
+                if vectorizer is None or self._denso[0] is stato:
+                    return
+                proiezione = proiezione_campi(vettore_pesi(), len(vectorizer.vocabulary_))
+                denso = IndiceDenso(matrice, proiezione)
+
+                with self._lock:
+                    corrente = self._stato
+                    if corrente[0] is not vectorizer:
+                        # 📌 Nuovo fit durante la costruzione: si riparte dallo stato più recente
+                        continue
+                    if corrente is not stato:
+                        # 📌 Righe accodate o modificate nel frattempo: proiettate con SVD e centroidi appena calcolati
+                        denso = denso.riproietta(corrente[1])
+                    self._denso = (corrente, denso)
+                    # 📌 I risultati in cache calcolati con il motore precedente non valgono più
+                    self.versione += 1
+                logger.info("✅ Motore denso pronto: %d progetti", denso.righe)
+                return
+        except Exception:
+            logger.exception("❌ Costruzione del motore denso fallita")
+
+    def indice_denso(self, stato):
+        """
+        Restituisce (stato, motore denso): il motore costruito sullo stato dato se è pronto, altrimenti
+        l'ultimo costruito insieme allo stato da cui deriva, mentre il nuovo viene preparato in background.
+        Solleva IndiceDensoNonPronto se non ne è ancora pronto nessuno.
+        """
+        stato_denso, denso = self._denso
+        if stato_denso is stato:
+            return stato, denso
+        # 📌 Con lo stesso vocabolario il motore viene già aggiornato insieme allo stato: serve una
+        # nuova costruzione solo dopo un fit
+        if denso is None or stato_denso[0] is not self._stato[0]:
+            self.prepara_denso()
+        if denso is None:
+            raise IndiceDensoNonPronto("Motore denso in preparazione, riprovare tra qualche secondo.")
+        return stato_denso, denso
+
+    def punteggi_densi_batch(self, testi_batch, pesi_batch=None, range_batch=None, k=TOP_K, stato=None,
+                             denso=None):
+        """
+        Ricerca semantica densa: per ogni input restituisce (posizioni delle righe, similarità).
+        Le righe sono quelle proposte dall'indice IVF, intersecate con il pre-filtro numerico;
+        se l'intersezione ha meno di `k` righe si confrontano esattamente tutti i candidati numerici.
+        Con meno di `k` candidati numerici il filtro viene ignorato, come nel motore TF-IDF.
+        `stato` e `denso` vanno passati insieme, come restituiti da `indice_denso`.
+        """
+        m = len(testi_batch)
+        pesi_batch = pesi_batch or [None] * m
+        w = np.vstack([vettore_pesi(pesi) for pesi in pesi_batch])
+        stato = stato or self.stato_corrente()
+        if stato[0] is None:
+            return None
+
+        if denso is None:
+            stato, denso = self.indice_denso(stato)
+        vectorizer, numerico = stato[0], stato[4]
+        embedding_query = denso.incorpora(self._query(vectorizer, testi_batch, w))
+
+        risultati = []
+        with fase("punteggio"):
+            for i in range(m):
+                righe = denso.candidati(embedding_query[i])
+                if range_batch is not None:
+                    candidati_numerici = numerico.candidati(*range_batch[i])
+                    if len(candidati_numerici) >= k:
+                        righe = np.intersect1d(righe, candidati_numerici, assume_unique=True)
+                        if len(righe) < k:
+                            righe = candidati_numerici
+                risultati.append((righe, denso.punteggi(righe, embedding_query[i])))
+        return risultati
+
+
+def seleziona_top_k(similarita, ids, k=TOP_K):
+    """
+    Posizioni dei k punteggi migliori, in ordine decrescente di similarità e crescente di id
+    a parità di punteggio. Usa una selezione parziale (argpartition) invece di ordinare tutto.
+    """
+    n = len(similarita)
+    if n == 0 or k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    if k < n:
+        soglia = similarita[np.argpartition(-similarita, k - 1)[k - 1]]
+        # 📌 Teniamo anche i pari merito sulla soglia: lo spareggio per id li decide in modo deterministico
+        candidati = np.flatnonzero(similarita >= soglia)
+    else:
+        candidati = np.arange(n)
+
+    ordine = np.lexsort((ids[candidati], -similarita[candidati]))
+    return candidati[ordine[:k]]
+
+
+_indice = None
+_indice_lock = threading.Lock()
+
+def get_indice():
+    """ Restituisce l'indice di similarità condiviso dal processo, creandolo al primo uso """
+    global _indice
+    if _indice is None:
+        with _indice_lock:
+            if _indice is None:
+                _indice = IndiceSimilarita()
+    return _indice
+
+def notifica_nuovi_progetti(ids, db_path=DB_PATH, aggiornati=()):
+    """
+    Chiamata dopo una scrittura: accoda i nuovi progetti all'indice e rivettorizza quelli
+    aggiornati, se la scrittura riguarda lo stesso database dell'indice
+    """
+    indice = get_indice()
+    if os.path.abspath(db_path) != indice.db_path or indice.firma is None:
+        return
+    if ids:
+        indice.aggiungi_progetti(ids)
+    if aggiornati:
+        indice.aggiorna_progetti(aggiornati)
+
+def _punteggi_per_input(indice, testi_batch, pesi_batch, range_batch, k, motore):
+    """ Restituisce (metadati, [(posizioni, similarità) per input]) con il motore richiesto """
+    if motore not in MOTORI:
+        raise ValueError(f"Motore non valido: {motore} (ammessi: {', '.join(MOTORI)})")
+
+    stato, denso = indice.stato_corrente(), None
+    if motore != "tfidf" and stato[0] is not None:
+        # 📌 Finché il motore denso dello stato corrente è in costruzione si usa il precedente,
+        # con lo stato su cui è stato costruito (anche per la parte TF-IDF dell'ibrido)
+        stato, denso = indice.indice_denso(stato)
+    progetti = stato[3]
+
+    if motore == "dense":
+        return progetti, indice.punteggi_densi_batch(testi_batch, pesi_batch, range_batch, k, stato=stato, denso=denso)
+
+    combina = None
+    if motore == "hybrid":
+        # 📌 Ibrido: sulle stesse righe del TF-IDF combiniamo il coseno lessicale con quello denso,
+        # prima della selezione dei k migliori
+        w = np.vstack([vettore_pesi(pesi) for pesi in pesi_batch])
+        embedding_query = denso.incorpora(indice._query(stato[0], testi_batch, w))
+
+        def combina(i, righe, punteggi_input):
+            return (PESO_IBRIDO_TFIDF * punteggi_input
+                    + (1 - PESO_IBRIDO_TFIDF) * denso.punteggi(righe, embedding_query[i]))
+
+    _, per_input = indice.punteggi_batch(
+        testi_batch, pesi_batch, range_batch, min_candidati=k, stato=stato, k=k, combina=combina
+    )
+    return progetti, per_input
+
+# 📌 Cache dei risultati: le richieste ripetute (stesso input normalizzato) non toccano l'indice
+cache_risultati = CacheLRU()
+
+def chiave_input(project_input, pesi, k, motore):
+    """ Chiave canonica di una richiesta: testi normalizzati, valori numerici, pesi effettivi, k e motore """
+    testi = [" ".join(testo.lower().split()) for testo in testi_campi(project_input)]
+    return chiave_canonica(
+        testi, float(project_input.superficie_mq), float(project_input.costo_milioni),
+        vettore_pesi(pesi).tolist(), int(k), motore
+    )
+
+def calcola_similarita_batch(project_inputs, pesi=None, k=TOP_K, motore="tfidf", usa_cache=True):
+    """
+    Versione batch di `calcola_similarita`: vettorizza tutti gli input insieme e calcola le
+    similarità con un solo prodotto sparso. Restituisce una lista di risultati per input.
+    `motore` sceglie tra TF-IDF lessicale ("tfidf"), embedding densi con indice ANN ("dense")
+    o la loro media pesata ("hybrid").
+    Gli input già calcolati sulla versione corrente dell'indice sono serviti dalla cache LRU.
+    """
+    if not project_inputs:
+        return []
 
-    input_vector = vectorizer.transform([testo_input])
+    pesi_batch = [pesi if pesi is not None else getattr(p, "pesi", None) for p in project_inputs]
 
-    # 📌 Calcoliamo la similarità del coseno
-    similarita = cosine_similarity(input_vector, tfidf_matrix).flatten()
+    if not usa_cache:
+        return _calcola_similarita_batch(project_inputs, pesi_batch, k, motore)
 
-    # 📌 Aggiungiamo la similarità ai progetti
-    df['similarita'] = similarita
+    # 📌 Leggiamo la versione prima del calcolo: se l'indice si aggiorna nel frattempo le nuove
+    # voci risultano già vecchie e verranno ricalcolate, mai servite come fresche.
+    # Le scritture di save_to_db aggiornano subito la versione; per quelle di altri processi
+    # (altri worker) data_version segnala la scrittura e l'indice si riallinea prima della lettura.
+    indice = get_indice()
+    if indice.db_cambiato():
+        indice.aggiorna_se_necessario()
+    versione = indice.versione
+    chiavi = [chiave_input(p, pesi_input, k, motore) for p, pesi_input in zip(project_inputs, pesi_batch)]
+    risultati = [cache_risultati.leggi(chiave, versione) for chiave in chiavi]
 
-    # 📌 Ordiniamo i progetti per similarità
-    df_ordinato = df.sort_values(by='similarita', ascending=False)
+    mancanti = [i for i, risultato in enumerate(risultati) if risultato is None]
+    if mancanti:
+        calcolati = _calcola_similarita_batch(
+            [project_inputs[i] for i in mancanti], [pesi_batch[i] for i in mancanti], k, motore
+        )
+        for i, risultato in zip(mancanti, calcolati):
+            cache_risultati.scrivi(chiavi[i], risultato, versione)
+            risultati[i] = risultato
 
-    # 📌 Convertiamo le colonne `superficie_mq` e `costo_milioni` in float
-    df_ordinato["superficie_mq"] = pd.to_numeric(df_ordinato["superficie_mq"], errors="coerce")
-    df_ordinato["costo_milioni"] = pd.to_numeric(df_ordinato["costo_milioni"], errors="coerce")
+    # 📌 Copie dei dizionari: chi riceve i risultati non può alterare la cache
+    return [[dict(progetto) for progetto in risultato] for risultato in risultati]
 
-    # 📌 Filtriamo i progetti in base alla superficie e al costo
-    superficie_range = (project_input.superficie_mq * 0.5, project_input.superficie_mq * 1.5)
-    costo_range = (project_input.costo_milioni * 0.5, project_input.costo_milioni * 1.5)
+def _calcola_similarita_batch(project_inputs, pesi_batch, k, motore):
+    """ Calcolo effettivo (senza cache) dei top-k per ogni input """
+    # 📌 Usiamo l'indice persistente (ricostruito solo se il database è cambiato):
+    # il filtro su superficie e costo restringe i candidati prima del calcolo della similarità,
+    # e se nei range rientrano meno di k progetti si usa comunque il top-k non filtrato
+    df, per_input = _punteggi_per_input(
+        get_indice(), [testi_campi(p) for p in project_inputs], pesi_batch,
+        [range_numerici(p) for p in project_inputs], k, motore
+    )
 
-    df_filtrato = df_ordinato[
-        (df_ordinato["superficie_mq"].between(*superficie_range)) &
-        (df_ordinato["costo_milioni"].between(*costo_range))
-    ]
+    if per_input is None:
+        return [[] for _ in project_inputs]
 
-    # 📌 Se il DataFrame filtrato è vuoto, mostriamo comunque i primi 5 progetti più simili
-    if df_filtrato.empty:
-        df_filtrato = df_ordinato.head(5)
+    ids = df["id"].to_numpy()
+    risultati = []
+    for righe, punteggi_input in per_input:
+        # 📌 Selezione parziale dei k migliori tra le righe ammesse, senza ordinare il catalogo
+        migliori = seleziona_top_k(punteggi_input, ids[righe], k)
+        risultati.append(
+            df.iloc[righe[migliori]][COLONNE_RISULTATO]
+            .assign(similarita=punteggi_input[migliori].astype(float))
+            .to_dict(orient="records")
+        )
+    return risultati
 
-    return df_filtrato[['id', 'nome', 'citta', 'paese', 'superficie_mq', 'costo_milioni', 'similarita']].head(5).to_dict(orient="records")
+def calcola_similarita(project_input, pesi=None, k=TOP_K, motore="tfidf", usa_cache=True):
+    """
+    Calcola la similarità tra il progetto dato e tutti i progetti nel database usando l'indice in memoria
+    e restituisce i `k` più simili.
+    I campi testuali sono pesati con `pesi` (o `project_input.pesi`), di default `TEXT_WEIGHTS`.
+    """
+    return calcola_similarita_batch([project_input], pesi, k, motore, usa_cache)[0]
@@ -1,12 +1,264 @@
+import os
+import time
+import signal
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import CancelledError, ProcessPoolExecutor, TimeoutError as TimeoutFuturo, wait
+from concurrent.futures.process import BrokenProcessPool
 import pdfplumber
+from app.metriche import misura_iteratore
 
-def extract_text_from_pdf(pdf_path):
-    """ Estrae il testo da un PDF """
-    text = ""
+logger = logging.getLogger(__name__)
+
+# 📌 Senza timeout, sotto questo numero di pagine l'estrazione avviene nel processo corrente
+MIN_PAGINE_PARALLELO = 16
+
+# 📌 Secondi massimi di estrazione di una singola pagina prima di saltarla
+TIMEOUT_PAGINA = 60
+
+# 📌 Processi del pool condiviso da tutte le estrazioni: il totale non cresce con i lavori in parallelo
+PROCESSI_PDF = os.cpu_count() or 1
+
+# 📌 Attesa oltre il timeout prima di abbandonare una pagina il cui worker non risponde
+# (l'allarme nel worker non interrompe il codice nativo, né esiste su Windows)
+MARGINE_TIMEOUT = 5
+
+# 📌 Secondi massimi di attesa di un worker libero per una pagina (pool condiviso tra più documenti)
+ATTESA_WORKER = 300
+
+_pool = None
+_lock_pool = threading.Lock()
+
+# 📌 Ultimo PDF aperto da ogni processo del pool: (percorso, data di modifica, pdf)
+_pdf_worker = None
+
+
+class PaginaTroppoLenta(Exception):
+    """ Sollevata nel worker quando l'estrazione di una pagina supera il timeout """
+
+
+class WorkerBloccato(Exception):
+    """ Il worker non ha restituito la pagina entro timeout e margine: va terminato """
+
+
+def _contesto_processi():
+    """ forkserver (o spawn dove non esiste): niente fork di un processo con altri thread attivi """
+    metodi = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in metodi else "spawn")
+
+
+def pool_pdf():
+    """ Pool di processi condiviso, creato al primo uso """
+    global _pool
+    with _lock_pool:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(PROCESSI_PDF, mp_context=_contesto_processi())
+        return _pool
+
+
+def chiudi_pool_pdf(pool=None, termina=False):
+    """
+    Chiude il pool (tutto, o solo se è ancora quello indicato, es. dopo un worker morto).
+    Con `termina=True` ne termina anche i processi: un worker bloccato nel codice nativo non
+    libererebbe mai il suo posto. Restituisce False se il pool era già stato chiuso.
+    """
+    global _pool
+    with _lock_pool:
+        if _pool is None or (pool is not None and _pool is not pool):
+            return False
+        vecchio, _pool = _pool, None
+    processi = list((getattr(vecchio, "_processes", None) or {}).values())
+    vecchio.shutdown(wait=False, cancel_futures=True)
+    if termina:
+        for processo in processi:
+            processo.terminate()
+    return True
+
+
+def _pdf_aperto(pdf_path):
+    global _pdf_worker
+    modifica = os.path.getmtime(pdf_path)
+    if _pdf_worker is None or _pdf_worker[:2] != (pdf_path, modifica):
+        _chiudi_pdf_worker()
+        _pdf_worker = (pdf_path, modifica, pdfplumber.open(pdf_path))
+    return _pdf_worker[2]
+
+
+def _chiudi_pdf_worker():
+    global _pdf_worker
+    if _pdf_worker is not None:
+        _pdf_worker[2].close()
+        _pdf_worker = None
+
+
+# 📌 Vero se l'allarme è scattato durante la pagina corrente del worker
+_scaduto = False
+
+
+def _allarme(signum, frame):
+    global _scaduto
+    _scaduto = True
+    raise PaginaTroppoLenta()
+
+
+def _estrai_pagina_worker(pdf_path, indice, timeout):
+    """ Testo della pagina, o None se l'estrazione supera `timeout` secondi (misurati dall'inizio della pagina) """
+    global _scaduto
+    _scaduto = False
+    allarme = timeout is not None and hasattr(signal, "setitimer")
+    if allarme:
+        signal.signal(signal.SIGALRM, _allarme)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    pagina = None
+    try:
+        pagina = _pdf_aperto(pdf_path).pages[indice]
+        return pagina.extract_text() or ""
+    except Exception:
+        # 📌 pdfplumber può incapsulare PaginaTroppoLenta in una sua eccezione: conta l'allarme
+        if not _scaduto:
+            raise
+        # 📌 Lo stato del parser dopo l'interruzione non è affidabile: il documento verrà riaperto
+        pagina = None
+        _chiudi_pdf_worker()
+        return None
+    finally:
+        if allarme:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        if pagina is not None:
+            # 📌 Libera gli oggetti di layout della pagina: la memoria del worker resta limitata
+            pagina.close()
+
+
+def _intervallo_pagine(totale, prima_pagina, ultima_pagina):
+    """ Indici (0-based) delle pagine da estrarre, da `prima_pagina` a `ultima_pagina` (1-based, incluse) """
+    inizio = max(prima_pagina or 1, 1) - 1
+    fine = min(ultima_pagina or totale, totale)
+    return range(inizio, fine)
+
+
+def iter_pdf_pages(pdf_path, prima_pagina=1, ultima_pagina=None, processi=None, timeout_pagina=TIMEOUT_PAGINA):
+    """
+    Genera (numero_pagina, testo) in ordine di pagina.
+    Le pagine sono estratte nel pool di processi condiviso, al massimo `processi` alla volta per
+    documento: il generatore produce ogni pagina appena è pronta (rispettando l'ordine), e una
+    pagina che supera `timeout_pagina` secondi viene saltata (testo vuoto) invece di bloccare
+    tutto il documento. Con `timeout_pagina=None` i documenti corti restano nel processo corrente.
+    Il tempo di estrazione (escluso quello di chi consuma le pagine) va nella fase `parsing_pdf`.
+    """
+    return misura_iteratore(
+        "parsing_pdf", _pagine_pdf(pdf_path, prima_pagina, ultima_pagina, processi, timeout_pagina)
+    )
+
+
+def _testo_pagina(futuro, timeout_pagina):
+    """
+    Risultato del worker; il timeout parte quando la pagina lascia la coda del pool, non da quando la si attende.
+    Restituisce None se nessun worker la prende entro ATTESA_WORKER secondi; solleva WorkerBloccato se
+    il worker non risponde entro timeout e margine.
+    """
+    if timeout_pagina is None:
+        return futuro.result()
+    # 📌 running() diventa vero quando la pagina passa a un worker (al più una in attesa per worker)
+    scadenza = time.monotonic() + ATTESA_WORKER
+    while not futuro.running() and not futuro.done():
+        # 📌 cancel() riesce solo finché la pagina è in coda: altrimenti la si attende come le altre
+        if time.monotonic() >= scadenza and futuro.cancel():
+            return None
+        wait([futuro], timeout=0.05)
+    try:
+        return futuro.result(timeout=timeout_pagina + MARGINE_TIMEOUT)
+    except TimeoutFuturo:
+        raise WorkerBloccato() from None
+
+
+def _invia_pagina(pdf_path, indice, timeout_pagina):
+    """ (pool, futuro) della pagina inviata al pool condiviso, ricreato se nel frattempo è stato chiuso """
+    pool = pool_pdf()
+    try:
+        return pool, pool.submit(_estrai_pagina_worker, pdf_path, indice, timeout_pagina)
+    except RuntimeError:
+        # 📌 Pool chiuso o rotto tra pool_pdf() e submit (BrokenProcessPool è un RuntimeError)
+        chiudi_pool_pdf(pool)
+        pool = pool_pdf()
+        return pool, pool.submit(_estrai_pagina_worker, pdf_path, indice, timeout_pagina)
+
+
+def _da_rinviare(pool, futuro):
+    """ Vero se la pagina era su un pool ormai chiuso e non ne ha restituito il testo """
+    if pool is _pool:
+        return False
+    return not futuro.done() or futuro.cancelled() or futuro.exception() is not None
+
+
+def _pagine_pdf(pdf_path, prima_pagina, ultima_pagina, processi, timeout_pagina):
     with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            extracted = page.extract_text()
-            if extracted:
-                text += extracted + "\n"
-    return text
-#Legge un PDF e estrae il testo
\ No newline at end of file
+        pagine = _intervallo_pagine(len(pdf.pages), prima_pagina, ultima_pagina)
+        if timeout_pagina is None and (len(pagine) < MIN_PAGINE_PARALLELO or processi == 1):
+            for indice in pagine:
+                pagina = pdf.pages[indice]
+                yield indice + 1, pagina.extract_text() or ""
+                pagina.close()
+            return
+
+    pdf_path = os.path.abspath(pdf_path)
+    finestra = max(1, min(processi or PROCESSI_PDF, PROCESSI_PDF))
+    # 📌 (indice, pool, futuro) delle pagine inviate: il pool serve a riconoscere quelle da rinviare
+    in_volo = []
+    da_inviare = iter(pagine)
+    ricreato = False
+    try:
+        while True:
+            # 📌 Al massimo `finestra` pagine del documento inviate al pool e non ancora restituite
+            for indice in da_inviare:
+                in_volo.append((indice, *_invia_pagina(pdf_path, indice, timeout_pagina)))
+                if len(in_volo) >= finestra:
+                    break
+            if not in_volo:
+                return
+            indice, pool, futuro = in_volo.pop(0)
+            inizio = time.perf_counter()
+            try:
+                testo = _testo_pagina(futuro, timeout_pagina)
+            except WorkerBloccato:
+                # 📌 Worker bloccato oltre il timeout: il pool viene ricreato e i suoi processi terminati,
+                # altrimenti il posto resterebbe occupato per sempre
+                chiudi_pool_pdf(pool, termina=True)
+                logger.error("❌ Worker PDF bloccato sulla pagina %d: pool ricreato", indice + 1)
+                testo = None
+            except (BrokenProcessPool, CancelledError):
+                if not chiudi_pool_pdf(pool, termina=True):
+                    # 📌 Pool chiuso da un altro documento: la pagina viene rinviata al nuovo pool
+                    in_volo.insert(0, (indice, *_invia_pagina(pdf_path, indice, timeout_pagina)))
+                    continue
+                # 📌 Un worker è morto (crash, memoria) su questo documento: il pool viene ricreato una volta
+                if ricreato:
+                    raise
+                ricreato = True
+                logger.error("❌ Pool PDF interrotto durante la pagina %d: ricreato", indice + 1)
+                testo = ""
+            # 📌 Le pagine in volo su un pool chiuso (da questo o da un altro documento) vengono rinviate
+            in_volo = [
+                (i, *_invia_pagina(pdf_path, i, timeout_pagina)) if _da_rinviare(p, f) else (i, p, f)
+                for i, p, f in in_volo
+            ]
+            if testo is None:
+                logger.warning(
+                    "⚠️ Pagina %d saltata: estrazione oltre %s secondi o nessun worker libero (attesa %.1f s)",
+                    indice + 1, timeout_pagina, time.perf_counter() - inizio
+                )
+                testo = ""
+            yield indice + 1, testo
+    finally:
+        # 📌 Pagine non ancora iniziate del documento abbandonato: non occupano il pool condiviso
+        for _, _, futuro in in_volo:
+            futuro.cancel()
+
+
+def extract_text_from_pdf(pdf_path, prima_pagina=1, ultima_pagina=None, processi=None, timeout_pagina=TIMEOUT_PAGINA):
+    """ Estrae il testo da un PDF (in parallelo per pagina sui documenti lunghi) """
+    testi = [
+        testo for _, testo in iter_pdf_pages(pdf_path, prima_pagina, ultima_pagina, processi, timeout_pagina)
+    ]
+    # 📌 Un solo join finale invece di concatenazioni ripetute
+    return "".join(testo + "\n" for testo in testi if testo)
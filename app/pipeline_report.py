@@ -0,0 +1,113 @@
+import io
+import os
+import time
+from app.agent_genai import genera_report
+from app.database import connessione
+from app.ml_similarity import calcola_similarita
+
+# 📌 PDF dei report generati dalla coda lavori, conservati fino al download in SQLite: il file è
+# condiviso dai worker uvicorn, quindi /reports/{id}/pdf risponde da qualunque processo
+# (sovrascrivibile con REPORT_DB_PATH)
+REPORT_PATH = os.path.abspath(
+    os.getenv("REPORT_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "report_pronti.sqlite"))
+)
+MAX_REPORT = 64
+TTL_REPORT = 3600
+
+
+class ArchivioReport:
+    """ PDF dei report per id, con scadenza (TTL) e numero massimo di voci (si eliminano i più vecchi) """
+
+    def __init__(self, percorso=REPORT_PATH, max_voci=MAX_REPORT, ttl=TTL_REPORT, orologio=time.time):
+        self.percorso = percorso
+        self.max_voci = max_voci
+        self.ttl = ttl
+        self._orologio = orologio
+        self._inizializzato = False
+
+    def _connetti(self):
+        conn = connessione(self.percorso)
+        if not self._inizializzato:
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS report (
+                        id TEXT PRIMARY KEY,
+                        pdf BLOB NOT NULL,
+                        scadenza REAL NOT NULL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_report_scadenza ON report(scadenza)")
+            self._inizializzato = True
+        return conn
+
+    def scrivi(self, id_report, pdf):
+        conn = self._connetti()
+        adesso = self._orologio()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO report (id, pdf, scadenza) VALUES (?, ?, ?)",
+                         (id_report, pdf, adesso + self.ttl))
+            conn.execute("DELETE FROM report WHERE scadenza <= ?", (adesso,))
+            # 📌 A parità di TTL la scadenza più vicina è quella del report più vecchio
+            conn.execute(
+                "DELETE FROM report WHERE id IN (SELECT id FROM report ORDER BY scadenza DESC LIMIT -1 OFFSET ?)",
+                (self.max_voci,)
+            )
+
+    def leggi(self, id_report):
+        """ PDF del report, o None se non esiste o è scaduto """
+        riga = self._connetti().execute(
+            "SELECT pdf FROM report WHERE id = ? AND scadenza > ?", (id_report, self._orologio())
+        ).fetchone()
+        return bytes(riga[0]) if riga is not None else None
+
+
+report_pronti = ArchivioReport()
+
+
+def _nessun_progresso(fase, percentuale=None):
+    pass
+
+
+def _nessun_evento(evento):
+    pass
+
+
+def report_da_progetti(progetti, progresso=_nessun_progresso, evento=_nessun_evento):
+    """ PDF (bytes) e testo del report sui progetti dati, composti interamente in memoria """
+    buffer = io.BytesIO()
+    esito = genera_report(progetti, buffer, progresso, evento)
+    return buffer.getvalue(), esito["testo"]
+
+
+def match_e_report(project_input, k=5, motore="tfidf", progresso=_nessun_progresso, evento=_nessun_evento):
+    """
+    Pipeline completa nello stesso processo: progetti simili all'area in ingresso e report su
+    di essi, passati in memoria (niente risultati.csv né file intermedi condivisi tra richieste).
+    Restituisce i progetti, il PDF in byte e il testo del report.
+    """
+    progresso("ricerca dei progetti simili", 5)
+    progetti = calcola_similarita(project_input, k=k, motore=motore)
+    if not progetti:
+        raise ValueError("Nessun progetto simile trovato.")
+    evento({"tipo": "progetti", "progetti": progetti})
+
+    pdf, testo = report_da_progetti(progetti, progresso, evento)
+    return {"progetti": progetti, "pdf": pdf, "testo": testo}
+
+
+def lavoro_report(id_report, progetti=None, project_input=None, k=5, motore="tfidf",
+                  progresso=_nessun_progresso, evento=_nessun_evento):
+    """
+    Versione per la coda lavori (sui progetti dati o, se assenti, su quelli simili a `project_input`).
+    Il PDF resta in `report_pronti` (condiviso tra i processi) con chiave `id_report`: il
+    risultato del lavoro contiene solo dati serializzabili.
+    """
+    if progetti is None:
+        esito = match_e_report(project_input, k, motore, progresso, evento)
+        progetti, pdf, testo = esito["progetti"], esito["pdf"], esito["testo"]
+    else:
+        pdf, testo = report_da_progetti(progetti, progresso, evento)
+
+    report_pronti.scrivi(id_report, pdf)
+    evento({"tipo": "pdf", "report_id": id_report, "byte": len(pdf)})
+    return {"report_id": id_report, "byte": len(pdf), "progetti": len(progetti), "testo": testo}
@@ -0,0 +1,151 @@
+import io
+from itertools import islice
+from xml.sax.saxutils import escape
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.pdfgen import canvas
+from reportlab.platypus import BaseDocTemplate, PageTemplate, Frame, Paragraph, Spacer, LongTable, TableStyle, Image
+
+# 📌 Margini delle pagine (punti)
+MARGINE = 50
+
+# 📌 Colonne della tabella di confronto (se presenti nei progetti), con il peso relativo della larghezza
+COLONNE_REPORT = {
+    "nome": 3,
+    "citta": 2,
+    "paese": 2,
+    "anno": 1,
+    "superficie_mq": 1.5,
+    "costo_milioni": 1.5,
+    "similarita": 1.5,
+}
+
+# 📌 Righe per ogni LongTable: tabelle piccole si impaginano in tempo lineare anche con centinaia di progetti
+RIGHE_PER_BLOCCO = 50
+
+# 📌 Flowable tenuti in memoria durante la costruzione in streaming
+FINESTRA_FLOWABLE = 16
+
+_stili = getSampleStyleSheet()
+STILE_TITOLO = ParagraphStyle('Titolo', parent=_stili['Heading1'], fontSize=22, textColor=colors.darkblue, spaceAfter=20)
+STILE_TESTO = ParagraphStyle('Testo', parent=_stili['BodyText'], fontSize=12, leading=14, spaceAfter=10)
+STILE_CELLA = ParagraphStyle('Cella', parent=_stili['BodyText'], fontSize=8, leading=10)
+STILE_INTESTAZIONE = ParagraphStyle('Intestazione', parent=STILE_CELLA, fontName='Helvetica-Bold', textColor=colors.whitesmoke)
+
+STILE_TABELLA = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 6),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+])
+
+
+class DocumentoReport(BaseDocTemplate):
+    """
+    Documento A4 a una colonna (come SimpleDocTemplate) che può impaginare anche un iteratore
+    di flowable: ne tiene in memoria al massimo `finestra` alla volta invece dell'intera lista.
+    """
+
+    def __init__(self, destinazione, **kwargs):
+        kwargs.setdefault("pagesize", A4)
+        for margine in ("rightMargin", "leftMargin", "topMargin", "bottomMargin"):
+            kwargs.setdefault(margine, MARGINE)
+        super().__init__(destinazione, **kwargs)
+        cornice = Frame(self.leftMargin, self.bottomMargin, self.width, self.height, id="normale")
+        self.addPageTemplates([PageTemplate(id="Pagina", frames=cornice, pagesize=self.pagesize)])
+
+    def build_in_streaming(self, flowables, finestra=FINESTRA_FLOWABLE, canvasmaker=canvas.Canvas):
+        """ Come `build`, ma consuma `flowables` (anche un generatore) a finestre di `finestra` elementi """
+        self._startBuild(canvasmaker=canvasmaker)
+        canv = self.canv
+        info = canv._doc.info
+        iteratore = iter(flowables)
+        coda = []
+        try:
+            canv._doctemplate = self
+            while True:
+                # 📌 I pezzi di un flowable spezzato tra due pagine tornano in testa alla coda
+                coda.extend(islice(iteratore, max(finestra - len(coda), 1)))
+                if not coda:
+                    break
+                self.clean_hanging()
+                self.handle_flowable(coda)
+        finally:
+            del canv._doctemplate
+        canv._doc.info = info
+        self._endBuild()
+
+
+def colonne_report(progetti, colonne=None):
+    """ Colonne da mostrare: quelle richieste (o di COLONNE_REPORT) presenti nel primo progetto """
+    if not progetti:
+        return []
+    disponibili = progetti[0].keys()
+    richieste = colonne or [c for c in COLONNE_REPORT if c in disponibili] or list(disponibili)
+    return [c for c in richieste if c in disponibili]
+
+
+def _testo_cella(valore):
+    if valore is None or (isinstance(valore, float) and valore != valore):
+        return ""
+    if isinstance(valore, float):
+        return f"{valore:,.4g}" if abs(valore) < 1 else f"{valore:,.2f}".rstrip("0").rstrip(".")
+    return escape(str(valore))
+
+
+def tabelle_progetti(progetti, colonne=None, larghezza=A4[0] - 2 * MARGINE, righe_per_blocco=RIGHE_PER_BLOCCO):
+    """
+    Genera la tabella di confronto a blocchi di `righe_per_blocco` righe: ogni blocco è una
+    LongTable con l'intestazione ripetuta a ogni pagina, larghezze fisse (niente misura del
+    contenuto) e celle a capo automatico, così la tabella resta dentro la pagina.
+    """
+    colonne = colonne_report(progetti, colonne)
+    if not colonne:
+        return
+
+    pesi = [COLONNE_REPORT.get(c, 1) for c in colonne]
+    larghezze = [larghezza * p / sum(pesi) for p in pesi]
+    intestazione = [Paragraph(escape(c.replace("_", " ")), STILE_INTESTAZIONE) for c in colonne]
+
+    for inizio in range(0, len(progetti), righe_per_blocco):
+        righe = [intestazione] + [
+            [Paragraph(_testo_cella(progetto.get(c)), STILE_CELLA) for c in colonne]
+            for progetto in progetti[inizio:inizio + righe_per_blocco]
+        ]
+        yield LongTable(righe, colWidths=larghezze, repeatRows=1, style=STILE_TABELLA)
+
+
+def paragrafi_testo(testo, stile=STILE_TESTO):
+    """ Un Paragraph per ogni sezione del testo (separate da righe vuote), con i caratteri XML protetti """
+    for sezione in testo.split("\n\n"):
+        sezione = sezione.strip()
+        if sezione:
+            yield Paragraph(escape(sezione).replace("\n", "<br/>"), stile)
+            yield Spacer(1, 12)
+
+
+def immagini_grafici(grafici, larghezza=400, altezza=250):
+    """ Immagini reportlab dai PNG in memoria (dizionario nome -> bytes) """
+    for png in grafici.values():
+        yield Image(io.BytesIO(png), width=larghezza, height=altezza)
+        yield Spacer(1, 20)
+
+
+def elementi_report(testo, progetti, grafici=None, colonne=None, tabella=None, titolo="REPORT DI RIQUALIFICAZIONE URBANA"):
+    """ Flowable del report nell'ordine di impaginazione, prodotti uno alla volta """
+    yield Paragraph(escape(titolo), STILE_TITOLO)
+    yield Spacer(1, 12)
+    yield from paragrafi_testo(testo)
+    yield from tabella if tabella is not None else tabelle_progetti(progetti, colonne)
+    yield Spacer(1, 20)
+    if grafici:
+        yield from immagini_grafici(grafici)
+
+
+def scrivi_report(destinazione, testo, progetti, grafici=None, colonne=None, tabella=None):
+    """ Scrive il report PDF (percorso o buffer) in streaming, con memoria limitata anche con molti progetti """
+    DocumentoReport(destinazione).build_in_streaming(
+        elementi_report(testo, progetti, grafici=grafici, colonne=colonne, tabella=tabella)
+    )
@@ -48,6 +48,7 @@
 #     st.set_page_config(page_title="Riqualificazione Urbana AI")
 #     documentazione_page()
 
+import time
 import streamlit as st
 import requests
 import pandas as pd
@@ -61,29 +62,64 @@ def documentazione_page():
     
     if uploaded_file is not None:
         st.write(f"📄 File caricato: {uploaded_file.name}")
-        files = {"file": uploaded_file.getvalue()}
+        files = {"file": (uploaded_file.name, uploaded_file.getvalue(), "application/pdf")}
         response = requests.post(f"{BACKEND_URL}/upload_pdf/", files=files)
         
-        if response.status_code == 200:
-            st.success("✅ Documento salvato e analizzato con successo!")
+        if response.status_code in (200, 202) and "job_id" in response.json():
+            # 📌 L'analisi gira in background sul backend: seguiamo l'avanzamento del lavoro
+            lavoro = attendi_lavoro(response.json()["job_id"])
+            if lavoro.get("stato") == "completato" and "error" not in (lavoro.get("risultato") or {}):
+                st.success("✅ Documento salvato e analizzato con successo!")
+            else:
+                errore = lavoro.get("errore") or (lavoro.get("risultato") or {}).get("error")
+                st.error(f"❌ Errore: {errore}")
         else:
-            st.error(f"❌ Errore: {response.json().get('error')}")
+            st.error(f"❌ Errore: {response.json().get('error') or response.json().get('detail')}")
     
     # 🔹 Dopo l'upload, mostra le ultime 5 righe del database
     show_latest_projects()
 
-# 🔹 Dopo l'upload, mostra le ultime 5 righe del database
-    show_latest_projects()
+def attendi_lavoro(job_id, intervallo=1.0, max_errori=5):
+    """
+    Interroga /jobs/{id} finché il lavoro non termina, mostrando fase e avanzamento.
+    Un lavoro sconosciuto (404) o `max_errori` risposte non valide di fila chiudono l'attesa con un errore.
+    """
+    barra = st.progress(0, text="📌 Analisi in coda...")
+    errori = 0
+    while True:
+        try:
+            response = requests.get(f"{BACKEND_URL}/jobs/{job_id}", timeout=10)
+            if response.status_code == 404:
+                return {"stato": "errore", "errore": "Lavoro non trovato sul backend."}
+            response.raise_for_status()
+            lavoro = response.json()
+        except (requests.RequestException, ValueError) as e:
+            errori += 1
+            if errori >= max_errori:
+                return {"stato": "errore", "errore": f"Stato del lavoro non disponibile: {e}"}
+            time.sleep(intervallo)
+            continue
+
+        errori = 0
+        barra.progress(int(lavoro.get("percentuale") or 0), text=f"📌 {lavoro.get('fase', '')}")
+        if lavoro.get("stato") in ("completato", "errore"):
+            return lavoro
+        time.sleep(intervallo)
+
+# 📌 Colonne mostrate negli elenchi: i testi lunghi (problema, interventi, ...) non vengono scaricati
+COLONNE_ELENCO = ["id", "nome", "citta", "paese", "anno", "tipologia", "superficie_mq", "costo_milioni"]
 
 def show_latest_projects():
     """Recupera e mostra gli ultimi 5 progetti salvati nel database"""
     st.subheader("📊 Ultimi 5 Progetti Aggiunti")
 
     try:
-        response = requests.get(f"{BACKEND_URL}/latest_projects/")
+        response = requests.get(
+            f"{BACKEND_URL}/projects", params={"columns": ",".join(COLONNE_ELENCO), "limit": 5}
+        )
         if response.status_code == 200:
             data = response.json()
-            projects = data.get("latest_projects", [])
+            projects = data.get("progetti", [])
 
             if projects:
                 st.success("✅ Dati caricati con successo!")
@@ -109,6 +145,50 @@ def show_latest_projects():
         st.error(f"❌ Errore di connessione: {e}")
 
 
+def catalogo_progetti_page():
+    """ Sfoglia tutti i progetti del database una pagina alla volta (paginazione a cursore) """
+    st.title("🗂️ Catalogo dei progetti")
+
+    col1, col2 = st.columns(2)
+    paese = col1.text_input("Filtra per paese", key="catalogo_paese")
+    per_pagina = col2.selectbox("Progetti per pagina", [25, 50, 100, 200], key="catalogo_per_pagina")
+
+    # 📌 Pila dei cursori delle pagine visitate: la prima pagina parte senza cursore
+    filtri = (paese, per_pagina)
+    if st.session_state.get("catalogo_filtri") != filtri:
+        st.session_state.catalogo_filtri = filtri
+        st.session_state.catalogo_cursori = [None]
+    cursori = st.session_state.catalogo_cursori
+
+    params = {"columns": ",".join(COLONNE_ELENCO), "limit": per_pagina}
+    if cursori[-1] is not None:
+        params["cursor"] = cursori[-1]
+    if paese:
+        params["paese"] = paese
+
+    try:
+        response = requests.get(f"{BACKEND_URL}/projects", params=params)
+    except requests.exceptions.RequestException as e:
+        st.error(f"❌ Errore di connessione: {e}")
+        return
+    if response.status_code != 200:
+        st.error(f"❌ Errore nel recupero dati: {response.status_code}")
+        return
+
+    data = response.json()
+    if data["progetti"]:
+        st.dataframe(pd.DataFrame(data["progetti"]), width=1200)
+    else:
+        st.warning("⚠️ Nessun progetto trovato.")
+
+    indietro, avanti = st.columns(2)
+    if indietro.button("⬅️ Pagina precedente", disabled=len(cursori) == 1):
+        cursori.pop()
+        st.rerun()
+    if avanti.button("Pagina successiva ➡️", disabled=data.get("next_cursor") is None):
+        cursori.append(data["next_cursor"])
+        st.rerun()
+
 def tool_regenai_page():
     st.title("Tool ReGenAI - Riqualificazione Spazi Pubblici")
 
@@ -128,8 +208,9 @@ def tool_regenai_page():
         costo = st.number_input("Costo in Milioni", min_value=0.0)
 
         submitted = st.form_submit_button("Trova Progetti Simili")
+        richiedi_report = st.form_submit_button("Genera Report PDF")
 
-        if submitted:
+        if submitted or richiedi_report:
             # 📌 Creiamo il JSON da inviare al backend
             dati_progetto = {
                 "problema": problema,
@@ -145,6 +226,17 @@ def tool_regenai_page():
                 "costo_milioni": costo
             }
 
+        if richiedi_report:
+            # 📌 Ricerca e report in un'unica chiamata: il PDF torna direttamente in memoria
+            with st.spinner("📝 Generazione del report in corso..."):
+                response = requests.post(f"{BACKEND_URL}/match_project/report", json=dati_progetto)
+            if response.status_code == 200:
+                st.session_state["report_pdf"] = response.content
+                st.success("✅ Report generato!")
+            else:
+                st.error(f"❌ Errore: {response.status_code}")
+
+        elif submitted:
             # 📌 Chiamiamo il backend FastAPI
             with st.spinner("🔍 Ricerca in corso..."):
                 response = requests.post(f"{BACKEND_URL}/match_project/", json=dati_progetto)
@@ -168,10 +260,59 @@ def tool_regenai_page():
             else:
                 st.error(f"❌ Errore: {response.status_code}")
 
+    # 📌 I download non sono ammessi dentro un form: il pulsante sta sotto
+    if st.session_state.get("report_pdf"):
+        st.download_button("📥 Scarica il Report PDF", st.session_state["report_pdf"],
+                           file_name="report_riqualificazione.pdf", mime="application/pdf")
+
+
+CAMPI_PROGETTO = [
+    "problema", "interventi", "tipologia", "benefici_sociali", "benefici_economici",
+    "nome", "sostenibilita", "citta", "paese", "superficie_mq", "costo_milioni"
+]
+
+def tool_regenai_batch_page():
+    st.subheader("Confronto di più Aree Candidate")
+
+    uploaded_csv = st.file_uploader(
+        "Carica un CSV con una riga per area (colonne: " + ", ".join(CAMPI_PROGETTO) + ")", type=["csv"]
+    )
+    if uploaded_csv is None:
+        return
+
+    df = pd.read_csv(uploaded_csv, sep=None, engine="python")
+    mancanti = [c for c in CAMPI_PROGETTO if c not in df.columns]
+    if mancanti:
+        st.error(f"❌ Colonne mancanti nel CSV: {', '.join(mancanti)}")
+        return
+
+    # 📌 Normalizziamo i tipi: testi vuoti al posto dei NaN, numeri come float
+    testuali = [c for c in CAMPI_PROGETTO if c not in ("superficie_mq", "costo_milioni")]
+    df[testuali] = df[testuali].fillna("").astype(str)
+    df[["superficie_mq", "costo_milioni"]] = df[["superficie_mq", "costo_milioni"]].astype(float)
+    aree = df[CAMPI_PROGETTO].to_dict(orient="records")
+
+    # 📌 Una sola chiamata al backend per tutte le aree
+    with st.spinner(f"🔍 Ricerca in corso per {len(aree)} aree..."):
+        response = requests.post(f"{BACKEND_URL}/match_projects/batch", json=aree)
+
+    if response.status_code != 200:
+        st.error(f"❌ Errore: {response.status_code}")
+        return
+
+    for area in response.json().get("risultati", []):
+        st.markdown(f"### {area['nome']}")
+        if area["progetti_simili"]:
+            st.dataframe(pd.DataFrame(area["progetti_simili"]), width=1200)
+        else:
+            st.warning("⚠ Nessun progetto simile trovato.")
+
 
 if __name__ == "__main__":
     st.set_page_config(page_title="Riqualificazione Urbana AI")
     documentazione_page()
+    catalogo_progetti_page()
     tool_regenai_page()
+    tool_regenai_batch_page()
 
 
@@ -0,0 +1,63 @@
+"""
+Confronta due file JSON di benchmarks.esegui (es. prima e dopo una modifica):
+
+    python -m benchmarks.confronta prima.json dopo.json --soglia 1.10
+
+Per ogni misura presente in entrambi stampa le mediane e il rapporto dopo/prima;
+esce con codice 1 se qualche misura peggiora oltre la soglia.
+"""
+import sys
+import json
+import argparse
+
+# 📌 Rapporto dopo/prima delle mediane oltre cui una misura è considerata una regressione
+SOGLIA_REGRESSIONE = 1.10
+
+
+def _chiave(misura):
+    return misura["benchmark"], json.dumps(misura["parametri"], sort_keys=True)
+
+
+def carica(percorso):
+    with open(percorso, encoding="utf-8") as f:
+        documento = json.load(f)
+    return documento, {_chiave(m): m for m in documento["risultati"]}
+
+
+def confronta(prima, dopo, soglia=SOGLIA_REGRESSIONE):
+    """ Righe (benchmark, parametri, mediana prima, mediana dopo, rapporto) delle misure comuni """
+    righe = []
+    for chiave, misura in dopo.items():
+        if chiave not in prima:
+            continue
+        t_prima = prima[chiave]["secondi"]["mediana"]
+        t_dopo = misura["secondi"]["mediana"]
+        rapporto = t_dopo / t_prima if t_prima else float("inf")
+        righe.append((chiave[0], misura["parametri"], t_prima, t_dopo, rapporto, rapporto > soglia))
+    return righe
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Confronta due risultati di benchmark.")
+    parser.add_argument("prima")
+    parser.add_argument("dopo")
+    parser.add_argument("--soglia", type=float, default=SOGLIA_REGRESSIONE)
+    args = parser.parse_args(argv)
+
+    doc_prima, prima = carica(args.prima)
+    doc_dopo, dopo = carica(args.dopo)
+    print(f"📌 {doc_prima.get('commit')} -> {doc_dopo.get('commit')}")
+
+    righe = confronta(prima, dopo, args.soglia)
+    for benchmark, parametri, t_prima, t_dopo, rapporto, regressione in righe:
+        segno = "⚠️" if regressione else "✅"
+        descrizione = ", ".join(f"{k}={v}" for k, v in parametri.items())
+        print(f"{segno} {benchmark:<30} {descrizione:<25} {t_prima:>10.4f}s {t_dopo:>10.4f}s  x{rapporto:.2f}")
+
+    regressioni = sum(1 for riga in righe if riga[-1])
+    print(f"📌 {len(righe)} misure confrontate, {regressioni} regressioni (soglia x{args.soglia:.2f})")
+    return 1 if regressioni else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+import os
+import numpy as np
+import pandas as pd
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 📌 Progetti reali da cui vengono campionati i testi del corpus sintetico
+CSV_BASE = os.path.join(BASE_DIR, "app", "Progetto_DB", "progetti_DB.csv")
+
+# 📌 Colonne testuali rimescolate tra progetti diversi (le altre sono copiate o perturbate)
+COLONNE_TESTO = ["tipologia", "problema", "interventi", "benefici_sociali", "benefici_economici", "sostenibilita"]
+
+
+def carica_base(percorso=CSV_BASE):
+    """ Progetti di partenza (stesso formato di progetti_DB.csv, separatore `;`) """
+    return pd.read_csv(percorso, sep=";")
+
+
+def genera_corpus(righe, seme=0, base=None):
+    """
+    Corpus sintetico di `righe` progetti con le colonne di progetti_DB.csv.
+    Ogni riga prende città/paese da un progetto reale e ogni campo testuale da un altro
+    (scelto a caso), così il vocabolario resta realistico ma le righe sono tutte diverse;
+    superficie, costo e anno vengono perturbati. I nomi sono unici. Deterministico dato `seme`.
+    """
+    base = carica_base() if base is None else base
+    rng = np.random.default_rng(seme)
+    n_base = len(base)
+
+    origine = rng.integers(0, n_base, righe)
+    corpus = base.iloc[origine].reset_index(drop=True)
+    corpus["nome"] = corpus["nome"].astype(str) + " " + pd.Series(np.arange(righe)).astype(str)
+
+    for colonna in COLONNE_TESTO:
+        corpus[colonna] = base[colonna].to_numpy()[rng.integers(0, n_base, righe)]
+
+    corpus["anno"] = rng.integers(1990, 2026, righe)
+    corpus["superficie_mq"] = (corpus["superficie_mq"].to_numpy() * rng.uniform(0.5, 1.5, righe)).astype(int)
+    corpus["costo_milioni"] = np.round(
+        pd.to_numeric(corpus["costo_milioni"], errors="coerce").fillna(10).to_numpy() * rng.uniform(0.5, 1.5, righe), 2
+    )
+    return corpus
+
+
+def scrivi_csv(corpus, percorso):
+    """ Scrive il corpus nel formato letto da crea_DB.inserisci_dati """
+    corpus.to_csv(percorso, sep=";", index=False)
+    return percorso
+
+
+def genera_pdf(percorso, pagine, righe_per_pagina=45, seme=0, base=None):
+    """ PDF di `pagine` pagine di testo (schede di progetti sintetici) per misurare l'estrazione """
+    corpus = genera_corpus(pagine * 2, seme=seme, base=base)
+    pdf = canvas.Canvas(percorso, pagesize=A4)
+    larghezza, altezza = A4
+    for pagina in range(pagine):
+        testo = pdf.beginText(50, altezza - 50)
+        testo.setFont("Helvetica", 9)
+        for progetto in corpus.iloc[pagina * 2:pagina * 2 + 2].to_dict(orient="records"):
+            for colonna, valore in progetto.items():
+                testo.textLine(f"{colonna}: {valore}"[:110])
+        for i in range(righe_per_pagina - 2 * len(corpus.columns)):
+            testo.textLine(f"Riga di testo {i} della pagina {pagina + 1}: descrizione dell'intervento di riqualificazione.")
+        pdf.drawText(testo)
+        pdf.showPage()
+    pdf.save()
+    return percorso
@@ -0,0 +1,258 @@
+"""
+Benchmark di matcher, ingestione e generazione dei report su un corpus sintetico.
+
+    python -m benchmarks.esegui --righe 10000,100000,1000000 --output risultati.json
+    python -m benchmarks.confronta prima.json dopo.json
+
+Il modello AI è sostituito da quello finto (LLM_FINTO=1): nessuna chiamata di rete.
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+import contextlib
+import subprocess
+from types import SimpleNamespace
+from datetime import datetime, timezone
+
+# 📌 Prima di importare gli agenti: niente Bedrock, si usa il modello finto
+os.environ["LLM_FINTO"] = "1"
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from benchmarks.corpus import genera_corpus, scrivi_csv, genera_pdf
+from app import agent_genai, ml_similarity
+from app.Progetto_DB import crea_DB
+from app.agent_extractor_automatic import save_to_db
+from app.database import chiudi_connessioni
+from app.grafici import cache_grafici
+from app.llm_gateway import GatewayLLM, ModelloFinto, TokenBucket
+from app.pdf_processor import extract_text_from_pdf
+
+RISULTATI_DIR = os.path.join(BASE_DIR, "benchmarks", "risultati")
+
+# 📌 Testo restituito dal modello finto per i report (lunghezza simile a una risposta reale)
+TESTO_REPORT = "\n\n".join(
+    f"{i} Sezione del report: analisi comparativa dei progetti, costi, sostenibilità ed efficacia. " * 8
+    for i in range(1, 9)
+)
+
+
+def log(messaggio):
+    print(messaggio, file=sys.stderr, flush=True)
+
+
+@contextlib.contextmanager
+def silenzioso():
+    """ Nasconde le stampe delle funzioni misurate (il JSON dei risultati resta pulito) """
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def statistiche(tempi):
+    """ Riepilogo (secondi) di una serie di misure """
+    ordinati = sorted(tempi)
+
+    def percentile(q):
+        return ordinati[min(len(ordinati) - 1, round(q * (len(ordinati) - 1)))]
+
+    return {
+        "n": len(ordinati),
+        "min": round(ordinati[0], 6),
+        "mediana": round(statistics.median(ordinati), 6),
+        "media": round(statistics.fmean(ordinati), 6),
+        "p95": round(percentile(0.95), 6),
+        "p99": round(percentile(0.99), 6),
+        "max": round(ordinati[-1], 6),
+    }
+
+
+def cronometra(funzione, *args, **kwargs):
+    inizio = time.perf_counter()
+    funzione(*args, **kwargs)
+    return time.perf_counter() - inizio
+
+
+def risultato(nome, tempi, **parametri):
+    riepilogo = {"benchmark": nome, "parametri": parametri, "secondi": statistiche(tempi)}
+    log(f"  {nome} {parametri}: mediana {riepilogo['secondi']['mediana']:.4f}s")
+    return riepilogo
+
+
+def bench_ingestione(corpus, cartella, ripetizioni):
+    """ crea_DB.inserisci_dati (CSV -> SQLite) e save_to_db (lista di dizionari -> SQLite), su DB vuoti """
+    righe = len(corpus)
+    csv = scrivi_csv(corpus, os.path.join(cartella, "corpus.csv"))
+    progetti = corpus.to_dict(orient="records")
+    tempi_csv, tempi_save, tempi_duplicati = [], [], []
+
+    for r in range(ripetizioni):
+        crea_DB.csv_file = csv
+        crea_DB.db_file = os.path.join(cartella, f"crea_db_{r}.sqlite")
+        with silenzioso():
+            crea_DB.crea_database()
+            tempi_csv.append(cronometra(crea_DB.inserisci_dati))
+
+        db = os.path.join(cartella, f"save_{r}.sqlite")
+        with silenzioso():
+            tempi_save.append(cronometra(save_to_db, progetti, db))
+            # 📌 Seconda ingestione degli stessi progetti: tutti duplicati, nessuna scrittura
+            tempi_duplicati.append(cronometra(save_to_db, progetti, db))
+
+    return db, [
+        risultato("crea_DB.inserisci_dati", tempi_csv, righe=righe),
+        risultato("save_to_db", tempi_save, righe=righe),
+        risultato("save_to_db (duplicati)", tempi_duplicati, righe=righe),
+    ]
+
+
+def bench_similarita(db, righe, query, ripetizioni):
+    """ Costruzione dell'indice TF-IDF e latenza di calcola_similarita (cache disattivata) """
+    indice = ml_similarity.IndiceSimilarita(db_path=db, salva_su_disco=False)
+    with silenzioso():
+        tempi_indice = [cronometra(indice.costruisci, usa_artefatti=False) for _ in range(ripetizioni)]
+    ml_similarity._indice = indice
+
+    richieste = [SimpleNamespace(**p) for p in genera_corpus(query, seme=1).to_dict(orient="records")]
+    with silenzioso():
+        tempi_query = [cronometra(ml_similarity.calcola_similarita, p, usa_cache=False) for p in richieste]
+        tempi_batch = [
+            cronometra(ml_similarity.calcola_similarita_batch, richieste, usa_cache=False) for _ in range(ripetizioni)
+        ]
+
+    return [
+        risultato("costruzione indice TF-IDF", tempi_indice, righe=righe),
+        risultato("calcola_similarita", tempi_query, righe=righe),
+        risultato("calcola_similarita_batch", tempi_batch, righe=righe, query=query),
+    ]
+
+
+def bench_pdf(cartella, pagine, ripetizioni):
+    """ extract_text_from_pdf su PDF generati di varie lunghezze """
+    risultati = []
+    for n in pagine:
+        percorso = genera_pdf(os.path.join(cartella, f"documento_{n}.pdf"), n)
+        with silenzioso():
+            tempi = [cronometra(extract_text_from_pdf, percorso) for _ in range(ripetizioni)]
+        risultati.append(risultato("extract_text_from_pdf", tempi, pagine=n))
+    return risultati
+
+
+def bench_report(progetti_report, ripetizioni):
+    """ salva_report_pdf e genera_report (modello finto) con numeri crescenti di progetti, in memoria """
+    # 📌 Modello finto senza limite di frequenza: si misura solo il lavoro locale
+    agent_genai.model = GatewayLLM(
+        modello=ModelloFinto(risposta=TESTO_REPORT), limitatore=TokenBucket(frequenza=1e9, capacita=1e9)
+    )
+    risultati = []
+    for n in progetti_report:
+        progetti = genera_corpus(n, seme=2)[
+            ["nome", "citta", "paese", "anno", "superficie_mq", "costo_milioni"]
+        ].assign(id=range(1, n + 1), similarita=0.5).to_dict(orient="records")
+        tempi_pdf, tempi_report = [], []
+        for _ in range(ripetizioni):
+            # 📌 Grafici rigenerati a ogni misura: la cache renderebbe gratis le ripetizioni
+            with silenzioso():
+                cache_grafici.svuota()
+                tempi_pdf.append(cronometra(agent_genai.salva_report_pdf, TESTO_REPORT, progetti, io.BytesIO()))
+                cache_grafici.svuota()
+                tempi_report.append(cronometra(agent_genai.genera_report, progetti, io.BytesIO()))
+        risultati.append(risultato("salva_report_pdf", tempi_pdf, progetti=n))
+        risultati.append(risultato("genera_report (LLM finto)", tempi_report, progetti=n))
+    return risultati
+
+
+def commit_corrente():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        modifiche = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=BASE_DIR, capture_output=True, text=True
+        ).stdout.strip()
+        return commit + ("-modificato" if modifiche else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _interi(testo):
+    return [int(x) for x in testo.split(",") if x.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark di matcher, ingestione e report (output JSON).")
+    parser.add_argument("--righe", type=_interi, default=[10_000, 100_000],
+                        help="Dimensioni del corpus sintetico, separate da virgola (es. 10000,100000,1000000)")
+    parser.add_argument("--query", type=int, default=200, help="Richieste misurate singolarmente su calcola_similarita")
+    parser.add_argument("--pagine", type=_interi, default=[10, 100], help="Pagine dei PDF generati")
+    parser.add_argument("--progetti-report", type=_interi, default=[5, 50, 500], help="Progetti nei report")
+    parser.add_argument("--ripetizioni", type=int, default=3)
+    parser.add_argument("--solo", nargs="*", choices=["ingestione", "similarita", "pdf", "report"],
+                        help="Esegue solo i gruppi indicati (default: tutti)")
+    parser.add_argument("--output", help="File JSON dei risultati (default: benchmarks/risultati/<data>_<commit>.json)")
+    args = parser.parse_args(argv)
+    gruppi = set(args.solo or ["ingestione", "similarita", "pdf", "report"])
+
+    avvio = datetime.now(timezone.utc)
+    commit = commit_corrente()
+    risultati = []
+
+    with tempfile.TemporaryDirectory(prefix="benchmark_") as cartella:
+        for righe in args.righe if gruppi & {"ingestione", "similarita"} else []:
+            log(f"📌 Corpus sintetico di {righe} progetti")
+            corpus = genera_corpus(righe)
+            cartella_righe = os.path.join(cartella, str(righe))
+            os.makedirs(cartella_righe)
+
+            if "ingestione" in gruppi:
+                db, misure = bench_ingestione(corpus, cartella_righe, args.ripetizioni)
+                risultati += misure
+            else:
+                db = os.path.join(cartella_righe, "corpus.sqlite")
+                with silenzioso():
+                    save_to_db(corpus.to_dict(orient="records"), db)
+            if "similarita" in gruppi:
+                risultati += bench_similarita(db, righe, args.query, args.ripetizioni)
+
+            ml_similarity._indice = None
+            chiudi_connessioni()
+
+        if "pdf" in gruppi:
+            log("📌 Estrazione del testo dai PDF")
+            risultati += bench_pdf(cartella, args.pagine, args.ripetizioni)
+        if "report" in gruppi:
+            log("📌 Generazione dei report")
+            risultati += bench_report(args.progetti_report, args.ripetizioni)
+        chiudi_connessioni()
+
+    documento = {
+        "commit": commit,
+        "data": avvio.isoformat(),
+        "durata_secondi": round((datetime.now(timezone.utc) - avvio).total_seconds(), 2),
+        "ambiente": {
+            "python": platform.python_version(),
+            "piattaforma": platform.platform(),
+            "cpu": os.cpu_count(),
+        },
+        "argomenti": {k: v for k, v in vars(args).items() if k != "output"},
+        "risultati": risultati,
+    }
+
+    output = args.output
+    if output is None:
+        os.makedirs(RISULTATI_DIR, exist_ok=True)
+        output = os.path.join(RISULTATI_DIR, f"{avvio:%Y%m%d_%H%M%S}_{commit or 'sconosciuto'}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(documento, f, indent=2, ensure_ascii=False)
+    log(f"✅ Risultati salvati in {output}")
+    return documento
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+from app.agent_extractor_automatic import unisci_progetti
+
+
+def test_chiavi_con_maiuscole_e_accenti():
+    progetti_per_nome = {}
+
+    inediti = unisci_progetti(progetti_per_nome, [{"Nome": "Parco Dora", "Città": "Torino", "Sostenibilità": None}])
+
+    assert inediti == [{"nome": "Parco Dora", "citta": "Torino", "sostenibilita": None}]
+    assert list(progetti_per_nome) == ["parco dora"]
+
+
+def test_duplicati_tra_blocchi_completano_i_campi_vuoti():
+    progetti_per_nome = {}
+    unisci_progetti(progetti_per_nome, [{"Nome": "Parco Dora", "Città": "Torino", "Sostenibilità": None}])
+
+    inediti = unisci_progetti(
+        progetti_per_nome,
+        [{"nome": "parco  DORA", "citta": "Milano", "sostenibilita": "alta"}, {"NOME": "High Line"}],
+    )
+
+    assert inediti == [{"nome": "High Line"}]
+    assert progetti_per_nome["parco dora"] == {"nome": "Parco Dora", "citta": "Torino", "sostenibilita": "alta"}
+
+
+def test_progetti_senza_nome_ignorati():
+    assert unisci_progetti({}, [{"citta": "Roma"}, "testo", {"Nome": ""}]) == []
@@ -0,0 +1,84 @@
+import json
+import mmap
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from app import ml_similarity
+from app.artefatti_tfidf import leggi_manifest
+from app.database import chiudi_connessioni, upsert_progetti
+
+PROGETTI = [
+    {"nome": "Parco Dora", "problema": "area industriale dismessa", "interventi": "parco urbano"},
+    {"nome": "Porto Antico", "problema": "waterfront degradato", "interventi": "passeggiata"},
+    {"nome": "High Line", "problema": "ferrovia sopraelevata dismessa", "interventi": "giardino pensile"},
+]
+
+
+@pytest.fixture
+def db(tmp_path):
+    percorso = str(tmp_path / "progetti.sqlite")
+    upsert_progetti(percorso, PROGETTI)
+    yield percorso
+    chiudi_connessioni()
+
+
+def _in_memory_map(array):
+    """ Vero se l'array (o quello di cui è una vista) è mappato da un file """
+    while array is not None:
+        if isinstance(array, (np.memmap, mmap.mmap)):
+            return True
+        array = getattr(array, "base", None)
+    return False
+
+
+def _indice(db, cartella):
+    return ml_similarity.IndiceSimilarita(db_path=db, cartella_artefatti=str(cartella))
+
+
+def _modifica_manifest(cartella, **campi):
+    percorso = os.path.join(leggi_manifest(str(cartella))["cartella"], "manifest.json")
+    with open(percorso, encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest.update(campi)
+    with open(percorso, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+
+
+def test_artefatti_ricaricati_in_memory_map(db, tmp_path):
+    originale = _indice(db, tmp_path / "artefatti")
+    originale.costruisci(usa_artefatti=False)
+    assert originale.versione_artefatti is not None
+
+    ricaricato = _indice(db, tmp_path / "artefatti")
+    ricaricato.costruisci()
+
+    assert ricaricato.versione_artefatti == originale.versione_artefatti
+    matrice, gram = ricaricato.matrice, ricaricato._stato[2]
+    for array in (matrice.data, matrice.indices, matrice.indptr, gram, ricaricato.vectorizer.idf_):
+        assert _in_memory_map(array)
+        assert not array.flags.writeable
+
+    testi = ml_similarity.testi_campi(SimpleNamespace(problema="area dismessa", interventi="parco"))
+    progetti, attese = originale.punteggi(testi)
+    progetti_ricaricati, similarita = ricaricato.punteggi(testi)
+    assert progetti_ricaricati["id"].tolist() == progetti["id"].tolist()
+    assert np.allclose(similarita, attese)
+
+
+@pytest.mark.parametrize("campi", [{"firma_db": [99, 99, 0]}, {"ids": [3, 2, 1]}])
+def test_manifest_non_corrispondente_scartato(db, tmp_path, campi):
+    originale = _indice(db, tmp_path / "artefatti")
+    originale.costruisci(usa_artefatti=False)
+    ricaricato = _indice(db, tmp_path / "artefatti")
+    assert ricaricato._carica_da_artefatti(ricaricato._firma_db())
+
+    _modifica_manifest(tmp_path / "artefatti", **campi)
+
+    assert not _indice(db, tmp_path / "artefatti")._carica_da_artefatti(ricaricato._firma_db())
+    # 📌 Con artefatti non validi l'indice rifà il fit invece di usarli
+    ricostruito = _indice(db, tmp_path / "artefatti")
+    ricostruito.costruisci()
+    assert not _in_memory_map(ricostruito.matrice.data)
@@ -0,0 +1,53 @@
+import threading
+
+import pytest
+
+from app.cache_estrazioni import CacheEstrazioni
+from app.database import chiudi_connessioni
+
+
+@pytest.fixture
+def percorso(tmp_path):
+    yield str(tmp_path / "cache.sqlite")
+    chiudi_connessioni()
+
+
+def test_voci_condivise_tra_istanze(percorso):
+    CacheEstrazioni(percorso).scrivi_pagine("abc", [(1, "testo")])
+
+    cache = CacheEstrazioni(percorso)
+    assert cache.leggi_pagine("abc") == [(1, "testo")]
+    assert cache.leggi_progetti("abc", "v1") is None
+    assert cache.statistiche()["hit"] == 1
+    assert cache.statistiche()["miss"] == 1
+
+
+def test_voci_meno_usate_eliminate_oltre_il_limite(percorso):
+    cache = CacheEstrazioni(percorso, max_byte=100)
+    cache.scrivi_progetti("a", "v1", "x" * 40)
+    cache.scrivi_progetti("b", "v1", "x" * 40)
+    cache.leggi_progetti("a", "v1")
+    cache.scrivi_progetti("c", "v1", "x" * 40)
+
+    assert cache.leggi_progetti("b", "v1") is None
+    assert cache.leggi_progetti("a", "v1") == "x" * 40
+    assert cache.statistiche()["eviction"] == 1
+
+
+def test_letture_e_scritture_da_piu_thread(percorso):
+    cache = CacheEstrazioni(percorso)
+
+    def lavoro(n):
+        for i in range(20):
+            cache.scrivi_pagine(f"{n}-{i}", [(i, "testo")])
+            assert cache.leggi_pagine(f"{n}-{i}") == [(i, "testo")]
+        chiudi_connessioni()
+
+    thread = [threading.Thread(target=lavoro, args=(n,)) for n in range(4)]
+    for t in thread:
+        t.start()
+    for t in thread:
+        t.join()
+
+    assert cache.statistiche()["voci"] == 80
+    assert cache.statistiche()["hit"] == 80
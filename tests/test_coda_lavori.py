@@ -0,0 +1,108 @@
+import sqlite3
+import threading
+
+import pytest
+
+from app.coda_lavori import COMPLETATO, ERRORE, CodaLavori
+from app.database import chiudi_connessioni
+
+
+@pytest.fixture
+def percorso(tmp_path):
+    yield str(tmp_path / "lavori.sqlite")
+    chiudi_connessioni()
+
+
+def _attendi_fine(coda, id_lavoro):
+    while True:
+        eventi, terminato = coda.attendi_eventi(id_lavoro, 0, timeout=1.0)
+        if terminato:
+            return eventi
+
+
+def test_lavoro_visibile_da_un_altro_processo(percorso):
+    # 📌 Due code sullo stesso file: come due worker uvicorn
+    worker_a, worker_b = CodaLavori(num_worker=1, percorso=percorso), CodaLavori(num_worker=1, percorso=percorso)
+    via = threading.Event()
+
+    def lavoro(progresso, evento):
+        progresso("prima fase", 10)
+        via.wait(5)
+        evento({"tipo": "testo", "testo": "ciao"})
+        return {"valore": 42}
+
+    id_lavoro = worker_a.invia(lavoro, descrizione="prova", con_eventi=True)
+    assert worker_b.stato(id_lavoro)["descrizione"] == "prova"
+
+    via.set()
+    _attendi_fine(worker_a, id_lavoro)
+
+    stato = worker_b.stato(id_lavoro)
+    assert stato["stato"] == COMPLETATO
+    assert stato["risultato"] == {"valore": 42}
+    eventi, terminato = worker_b.attendi_eventi(id_lavoro, 0, timeout=0.1)
+    assert terminato
+    assert [e["tipo"] for e in eventi] == ["progresso", "testo", COMPLETATO]
+    assert worker_b.attendi_eventi(id_lavoro, 1, timeout=0.1)[0] == eventi[1:]
+    assert worker_b.conteggi()[COMPLETATO] == 1
+    assert [lavoro["id"] for lavoro in worker_b.elenco()] == [id_lavoro]
+    worker_a.chiudi()
+    worker_b.chiudi()
+
+
+def test_lavoro_sconosciuto(percorso):
+    coda = CodaLavori(num_worker=1, percorso=percorso)
+    assert coda.stato("inesistente") is None
+    assert coda.attendi_eventi("inesistente", 0, timeout=0.1) is None
+    coda.chiudi()
+
+
+def test_errore_e_storico_limitato(percorso):
+    coda = CodaLavori(num_worker=1, max_storico=2, percorso=percorso)
+
+    def fallisce(progresso):
+        raise RuntimeError("rotto")
+
+    ids = [coda.invia(fallisce) for _ in range(4)]
+    for id_lavoro in ids:
+        _attendi_fine(coda, id_lavoro)
+    coda.invia(lambda progresso: None)
+
+    assert coda.stato(ids[-1])["errore"] == "rotto"
+    assert coda.conteggi()[ERRORE] <= 2
+    coda.chiudi()
+
+
+def test_solo_in_memoria():
+    coda = CodaLavori(num_worker=1, percorso=None)
+    id_lavoro = coda.invia(lambda progresso: "fatto")
+    _attendi_fine(coda, id_lavoro)
+    assert coda.stato(id_lavoro)["risultato"] == "fatto"
+    assert coda.conteggi()[COMPLETATO] == 1
+    coda.chiudi()
+
+
+def test_pezzi_in_streaming_scrivono_solo_l_evento(percorso):
+    coda = CodaLavori(num_worker=1, percorso=percorso)
+    conn = sqlite3.connect(percorso)
+    with conn:
+        # 📌 Conta le scritture della riga del lavoro (INSERT OR REPLACE passa sempre da un INSERT)
+        conn.execute("CREATE TABLE scritture (n INTEGER)")
+        conn.execute("CREATE TRIGGER conta AFTER INSERT ON lavori BEGIN INSERT INTO scritture VALUES (1); END")
+
+    def lavoro(progresso, evento):
+        progresso("generazione", 10)
+        for i in range(50):
+            evento({"tipo": "testo", "testo": f"pezzo {i} "})
+        return "fatto"
+
+    id_lavoro = coda.invia(lavoro, con_eventi=True)
+    eventi = _attendi_fine(coda, id_lavoro)
+
+    # 📌 Creazione, avvio, avanzamento e fine: nessuna scrittura per i 50 pezzi di testo
+    assert conn.execute("SELECT COUNT(*) FROM scritture").fetchone()[0] == 4
+    assert conn.execute("SELECT COUNT(*) FROM eventi_lavori WHERE id_lavoro = ?", (id_lavoro,)).fetchone()[0] == 52
+    assert len(eventi) == 52
+    assert coda.stato(id_lavoro)["percentuale"] == 100
+    conn.close()
+    coda.chiudi()
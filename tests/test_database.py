@@ -0,0 +1,82 @@
+import pytest
+
+from app.database import (
+    cerca_progetti, chiudi_connessioni, connessione, crea_tabella, elenca_progetti, upsert_progetti,
+)
+
+
+@pytest.fixture
+def db(tmp_path):
+    percorso = str(tmp_path / "progetti.sqlite")
+    conn = connessione(percorso)
+    with conn:
+        # 📌 Tabella con indice FTS5 e trigger già installati, come nel database reale
+        crea_tabella(conn)
+    yield percorso
+    chiudi_connessioni()
+
+
+def test_inserimento_non_conta_le_scritture_dei_trigger(db):
+    esito = upsert_progetti(db, [{"nome": "Parco A", "problema": "degrado"}, {"nome": "Parco B"}])
+
+    assert esito["inseriti"] == 2
+    assert esito["aggiornati"] == 0
+    assert esito["ignorati"] == 0
+    assert esito["ids_aggiornati"] == []
+
+
+def test_duplicati_ignorati(db):
+    progetti = [{"nome": "Parco A", "citta": "Roma"}, {"nome": "Parco B"}]
+    upsert_progetti(db, progetti)
+
+    esito = upsert_progetti(db, progetti)
+
+    assert esito == {"inseriti": 0, "aggiornati": 0, "ignorati": 2, "ids_inseriti": [], "ids_aggiornati": []}
+
+
+def test_aggiorna_restituisce_solo_le_righe_cambiate(db):
+    primo = upsert_progetti(db, [{"nome": "Parco A", "problema": "degrado"}, {"nome": "Parco B", "citta": "Milano"}])
+    id_a = primo["ids_inseriti"][0]
+
+    esito = upsert_progetti(
+        db,
+        [{"nome": "Parco A", "problema": "allagamenti"}, {"nome": "Parco B", "citta": "Milano"}, {"nome": "Parco C"}],
+        aggiorna=True,
+    )
+
+    assert esito["inseriti"] == 1
+    assert esito["aggiornati"] == 1
+    assert esito["ignorati"] == 1
+    assert esito["ids_aggiornati"] == [id_a]
+    # 📌 L'indice full-text segue l'aggiornamento
+    conn = connessione(db)
+    assert conn.execute("SELECT rowid FROM progetti_fts WHERE progetti_fts MATCH 'allagamenti'").fetchall() == [(id_a,)]
+    assert conn.execute("SELECT rowid FROM progetti_fts WHERE progetti_fts MATCH 'degrado'").fetchall() == []
+
+
+def _progetti_con_valori_mancanti(db):
+    upsert_progetti(db, [
+        {"nome": "Parco A", "problema": "degrado urbano", "anno": 2015, "costo_milioni": 12},
+        {"nome": "Parco B", "problema": "degrado urbano"},
+    ])
+    conn = connessione(db)
+    with conn:
+        # 📌 Valori testuali come quelli estratti dai PDF senza dato numerico
+        conn.execute("UPDATE progetti_successo SET anno = 'N/D', costo_milioni = 'N/D' WHERE nome = 'Parco B'")
+
+
+def test_ricerca_con_filtri_numerici_esclude_i_valori_testuali(db):
+    _progetti_con_valori_mancanti(db)
+
+    assert {p["nome"] for p in cerca_progetti("degrado", db_path=db)} == {"Parco A", "Parco B"}
+    assert [p["nome"] for p in cerca_progetti("degrado", anno_min=2000, db_path=db)] == ["Parco A"]
+    assert [p["nome"] for p in cerca_progetti("degrado", costo_min=5, db_path=db)] == ["Parco A"]
+
+
+def test_elenco_con_filtri_numerici_esclude_i_valori_testuali(db):
+    _progetti_con_valori_mancanti(db)
+
+    righe, _ = elenca_progetti(colonne=["nome"], costo_min=5, db_path=db)
+    assert [r["nome"] for r in righe] == ["Parco A"]
+    righe, _ = elenca_progetti(colonne=["nome"], anno_min=2000, db_path=db)
+    assert [r["nome"] for r in righe] == ["Parco A"]
@@ -0,0 +1,101 @@
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+from app.llm_gateway import GatewayLLM, ModelloFinto, TokenBucket, errore_temporaneo
+
+
+class Orologio:
+    """ Tempo finto: dormi() lo fa avanzare invece di attendere """
+
+    def __init__(self):
+        self.adesso = 0.0
+        self.attese = []
+
+    def __call__(self):
+        return self.adesso
+
+    def dormi(self, secondi):
+        self.attese.append(secondi)
+        self.adesso += secondi
+
+
+def _errore(codice):
+    return ClientError({"Error": {"Code": codice, "Message": "prova"}}, "InvokeModel")
+
+
+def _gateway(modello, **parametri):
+    orologio = Orologio()
+    limitatore = TokenBucket(frequenza=1e9, capacita=1e9, orologio=orologio, dormi=orologio.dormi)
+    return GatewayLLM(modello=modello, limitatore=limitatore, dormi=orologio.dormi, **parametri), orologio
+
+
+def test_throttling_poi_risposta():
+    modello = ModelloFinto(risposta="ok", errori_iniziali=2)
+    gateway, orologio = _gateway(modello, tentativi=3, attesa_base=1.0)
+
+    assert gateway.invoke("prompt") == "ok"
+    assert modello.chiamate == 3
+    # 📌 Backoff con jitter: al più 1s e 2s
+    assert len(orologio.attese) == 2
+    assert all(0 <= attesa <= limite for attesa, limite in zip(orologio.attese, (1.0, 2.0)))
+
+
+def test_throttling_oltre_i_tentativi():
+    modello = ModelloFinto(errori_iniziali=5)
+    gateway, _ = _gateway(modello, tentativi=3)
+
+    with pytest.raises(ClientError):
+        gateway.invoke("prompt")
+    assert modello.chiamate == 3
+
+
+def test_errore_permanente_senza_nuovi_tentativi():
+    class ModelloRotto:
+        chiamate = 0
+
+        def invoke(self, prompt):
+            self.chiamate += 1
+            raise _errore("ValidationException")
+
+    modello = ModelloRotto()
+    gateway, orologio = _gateway(modello, tentativi=5)
+
+    with pytest.raises(ClientError, match="ValidationException"):
+        gateway.invoke("prompt")
+    assert modello.chiamate == 1
+    assert orologio.attese == []
+
+
+def test_token_bucket_cadenza_le_chiamate():
+    orologio = Orologio()
+    bucket = TokenBucket(frequenza=2.0, capacita=2, orologio=orologio, dormi=orologio.dormi)
+
+    for _ in range(5):
+        bucket.acquisisci()
+
+    # 📌 Raffica di 2 gratis, poi una chiamata ogni mezzo secondo
+    assert orologio.attese == pytest.approx([0.5, 0.5, 0.5])
+    assert orologio.adesso == pytest.approx(1.5)
+
+
+def test_invia_e_batch_nell_ordine_dei_prompt():
+    gateway, _ = _gateway(ModelloFinto(risposta=lambda prompt: prompt.upper(), latenza=0.01))
+
+    assert gateway.invia("uno").result(timeout=5) == "UNO"
+    assert gateway.invoke_batch(["a", "b", "c"]) == ["A", "B", "C"]
+
+
+def test_errore_temporaneo():
+    assert errore_temporaneo(_errore("ThrottlingException"))
+    assert errore_temporaneo(EndpointConnectionError(endpoint_url="https://bedrock"))
+    assert not errore_temporaneo(_errore("ValidationException"))
+    assert not errore_temporaneo(ValueError("prompt non valido"))
+
+    # 📌 Errore di boto3 avvolto da un'altra libreria
+    try:
+        try:
+            raise _errore("ServiceUnavailableException")
+        except ClientError as e:
+            raise RuntimeError("chiamata fallita") from e
+    except RuntimeError as avvolto:
+        assert errore_temporaneo(avvolto)
@@ -0,0 +1,216 @@
+import sqlite3
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from sklearn.preprocessing import normalize
+
+from app import ml_similarity
+from app.database import chiudi_connessioni, upsert_progetti
+
+PROGETTI = [
+    {"nome": "Parco Dora", "problema": "area industriale dismessa", "interventi": "parco urbano",
+     "tipologia": "parco", "citta": "Torino", "paese": "Italia", "superficie_mq": 10000, "costo_milioni": 10},
+    {"nome": "Porto Antico", "problema": "waterfront degradato", "interventi": "passeggiata",
+     "tipologia": "waterfront", "citta": "Genova", "paese": "Italia", "superficie_mq": 20000, "costo_milioni": 30},
+]
+
+
+@pytest.fixture
+def indice(tmp_path, monkeypatch):
+    db = str(tmp_path / "progetti.sqlite")
+    upsert_progetti(db, PROGETTI)
+    indice = ml_similarity.IndiceSimilarita(db_path=db, salva_su_disco=False)
+    indice.costruisci(usa_artefatti=False)
+    monkeypatch.setattr(ml_similarity, "_indice", indice)
+    monkeypatch.setattr(ml_similarity, "cache_risultati", ml_similarity.CacheLRU())
+    yield indice
+    chiudi_connessioni()
+
+
+def _richiesta(**campi):
+    valori = {campo: "" for campo in ml_similarity.CAMPI_TESTUALI}
+    return SimpleNamespace(**dict(valori, superficie_mq=10000, costo_milioni=10, **campi))
+
+
+def test_cache_vede_le_scritture_di_un_altro_processo(indice):
+    richiesta = _richiesta(problema="ex scalo ferroviario", interventi="parco lineare")
+    prima = ml_similarity.calcola_similarita(richiesta, k=5)
+    assert ml_similarity.calcola_similarita(richiesta, k=5) == prima
+    assert ml_similarity.cache_risultati.hit == 1
+
+    # 📌 Scrittura da un'altra connessione, come farebbe un altro worker uvicorn
+    conn = sqlite3.connect(indice.db_path)
+    with conn:
+        conn.execute(
+            "INSERT INTO progetti_successo (nome, problema, interventi, superficie_mq, costo_milioni) "
+            "VALUES ('High Line', 'ex scalo ferroviario', 'parco lineare', 10000, 10)"
+        )
+    conn.close()
+
+    dopo = ml_similarity.calcola_similarita(richiesta, k=5)
+    assert dopo[0]["nome"] == "High Line"
+    assert len(dopo) == len(prima) + 1
+
+
+def test_stessa_soglia_di_ripiego_per_tutti_i_motori(indice):
+    # 📌 Solo Parco Dora rientra nei range (±50% di superficie e costo): con k=2 il filtro lascia
+    # meno di k candidati e tutti i motori tornano al top-k non filtrato
+    richiesta = _richiesta(problema="waterfront degradato", interventi="passeggiata")
+    indice.prepara_denso(attendi=True)
+    for motore in ml_similarity.MOTORI:
+        nomi = {p["nome"] for p in ml_similarity.calcola_similarita(richiesta, k=2, motore=motore, usa_cache=False)}
+        assert nomi == {"Parco Dora", "Porto Antico"}, motore
+
+        filtrati = ml_similarity.calcola_similarita(richiesta, k=1, motore=motore, usa_cache=False)
+        assert [p["nome"] for p in filtrati] == ["Parco Dora"], motore
+
+
+def test_cache_vede_le_modifiche_in_place_di_un_altro_processo(indice):
+    richiesta = _richiesta(problema="ex scalo ferroviario", interventi="parco lineare")
+    assert ml_similarity.calcola_similarita(richiesta, k=1)[0]["nome"] == "Parco Dora"
+    versione = indice.versione
+
+    # 📌 Stesso numero di righe e stesso id massimo: cambia solo il contenuto
+    conn = sqlite3.connect(indice.db_path)
+    with conn:
+        conn.execute(
+            "UPDATE progetti_successo SET problema = 'ex scalo ferroviario', interventi = 'parco lineare', "
+            "superficie_mq = 10000, costo_milioni = 10 WHERE nome = 'Porto Antico'"
+        )
+    conn.close()
+
+    assert ml_similarity.calcola_similarita(richiesta, k=1)[0]["nome"] == "Porto Antico"
+    assert indice.versione > versione
+    assert ml_similarity.calcola_similarita(richiesta, k=1, usa_cache=False)[0]["nome"] == "Porto Antico"
+
+
+def test_firma_ricalcolata_solo_dopo_una_scrittura(indice, monkeypatch):
+    chiamate = []
+    firma_db = indice._firma_db
+    monkeypatch.setattr(indice, "_firma_db", lambda: chiamate.append(1) or firma_db())
+    richiesta = _richiesta(problema="ex scalo ferroviario", interventi="parco lineare")
+
+    for _ in range(3):
+        ml_similarity.calcola_similarita(richiesta, k=1, usa_cache=False)
+    assert len(chiamate) <= 1
+
+    conn = sqlite3.connect(indice.db_path)
+    with conn:
+        conn.execute("UPDATE progetti_successo SET interventi = 'parco lineare' WHERE nome = 'Porto Antico'")
+    conn.close()
+    chiamate.clear()
+    ml_similarity.calcola_similarita(richiesta, k=1, usa_cache=False)
+    assert len(chiamate) == 1
+
+
+def test_motore_denso_preparato_fuori_dalle_richieste(indice):
+    # 📌 Qualche progetto in più, perché la SVD abbia più di una dimensione
+    upsert_progetti(indice.db_path, [
+        {"nome": "High Line", "problema": "ferrovia sopraelevata", "interventi": "giardino pensile"},
+        {"nome": "Madrid Rio", "problema": "autostrada urbana", "interventi": "tunnel e parco fluviale"},
+    ])
+    indice.costruisci(usa_artefatti=False)
+    richiesta = _richiesta(problema="ex scalo ferroviario", interventi="parco lineare")
+    with pytest.raises(ml_similarity.IndiceDensoNonPronto):
+        ml_similarity.calcola_similarita(richiesta, k=1, motore="dense", usa_cache=False)
+
+    indice.prepara_denso(attendi=True)
+    stato, denso = indice.indice_denso(indice.stato_corrente())
+    assert stato is indice.stato_corrente()
+
+    # 📌 Righe modificate: il motore denso segue lo stato senza rifare SVD e IVF
+    conn = sqlite3.connect(indice.db_path)
+    with conn:
+        conn.execute(
+            "UPDATE progetti_successo SET problema = 'ex scalo ferroviario', interventi = 'parco lineare', "
+            "superficie_mq = 10000, costo_milioni = 10 WHERE nome = 'Porto Antico'"
+        )
+    conn.close()
+    ml_similarity.calcola_similarita(richiesta, k=1, motore="dense", usa_cache=False)
+    stato_aggiornato, denso_aggiornato = indice.indice_denso(indice.stato_corrente())
+    assert stato_aggiornato is indice.stato_corrente()
+    assert denso_aggiornato.svd is denso.svd
+    assert np.allclose(denso_aggiornato.embedding, denso.riproietta(stato_aggiornato[1]).embedding)
+    assert not np.allclose(denso_aggiornato.embedding[1], denso.embedding[1])
+
+    # 📌 Dopo un nuovo fit si continua a usare il motore precedente finché il nuovo non è pronto
+    indice.prepara_denso = lambda attendi=False: None
+    indice.costruisci(usa_artefatti=False)
+    assert indice.indice_denso(indice.stato_corrente()) == (stato_aggiornato, denso_aggiornato)
+    assert len(ml_similarity.calcola_similarita(richiesta, k=2, motore="hybrid", usa_cache=False)) == 2
+    del indice.prepara_denso
+    indice.prepara_denso(attendi=True)
+    assert indice.indice_denso(indice.stato_corrente())[0] is indice.stato_corrente()
+
+
+def test_punteggi_a_blocchi_come_in_un_colpo_solo(indice, monkeypatch):
+    upsert_progetti(indice.db_path, [
+        {"nome": f"Parco {i}", "problema": "area dismessa" if i % 2 else "waterfront", "interventi": "parco",
+         "superficie_mq": 10000 + i, "costo_milioni": 10} for i in range(20)
+    ])
+    richieste = [_richiesta(problema="area dismessa", interventi="parco"), _richiesta(problema="waterfront degradato")]
+    # 📌 Nessun candidato nei range: il secondo input usa l'intero catalogo
+    richieste[1].superficie_mq = 1e9
+    interi = ml_similarity.calcola_similarita_batch(richieste, k=4, usa_cache=False)
+
+    # 📌 Blocchi di poche righe: ogni input tiene i k migliori di ogni blocco, poi dell'unione
+    monkeypatch.setattr(ml_similarity, "ELEMENTI_BLOCCO", 6)
+    a_blocchi = ml_similarity.calcola_similarita_batch(richieste, k=4, usa_cache=False)
+
+    assert a_blocchi == interi
+    assert [len(r) for r in interi] == [4, 4]
+
+
+def test_pesi_per_campo_come_testo_ripetuto(indice):
+    # 📌 Con pesi interi la combinazione pesata dei campi equivale al TF-IDF del testo in cui
+    # ogni campo è ripetuto tante volte quanto il suo peso
+    pesi = {campo: float(i % 3 + 1) for i, campo in enumerate(ml_similarity.CAMPI_TESTUALI)}
+    richiesta = _richiesta(problema="area industriale dismessa", interventi="parco passeggiata", tipologia="parco")
+
+    def ripetuto(testi):
+        return " ".join(" ".join([testo] * int(pesi[campo])) for campo, testo in zip(ml_similarity.CAMPI_TESTUALI, testi))
+
+    progetti, similarita = indice.punteggi(ml_similarity.testi_campi(richiesta), pesi)
+
+    df = ml_similarity.carica_progetti(indice.db_path)
+    testi_documenti = [
+        ripetuto(riga) for riga in df[ml_similarity.CAMPI_TESTUALI].fillna("").astype(str).itertuples(index=False)
+    ]
+    documenti = normalize(indice.vectorizer.transform(testi_documenti))
+    query = normalize(indice.vectorizer.transform([ripetuto(ml_similarity.testi_campi(richiesta))]))
+    attese = (documenti @ query.T).toarray().ravel()
+
+    assert similarita.max() > 0
+    assert np.allclose(similarita, attese[progetti.index.to_numpy()], atol=1e-6)
+
+
+@pytest.mark.parametrize("pesi", [{"sconosciuto": 1.0}, {"problema": -1.0}, {"problema": "molto"}])
+def test_pesi_non_validi(pesi):
+    with pytest.raises(ValueError):
+        ml_similarity.vettore_pesi(pesi)
+
+
+def test_pesi_tutti_nulli():
+    with pytest.raises(ValueError, match="non tutti nulli"):
+        ml_similarity.vettore_pesi(dict.fromkeys(ml_similarity.CAMPI_TESTUALI, 0))
+
+
+def test_seleziona_top_k():
+    similarita = np.array([0.2, 0.9, 0.5, 0.7, 0.1])
+    ids = np.array([10, 20, 30, 40, 50])
+
+    assert ml_similarity.seleziona_top_k(similarita, ids, 3).tolist() == [1, 3, 2]
+    assert ml_similarity.seleziona_top_k(similarita, ids, 10).tolist() == [1, 3, 2, 0, 4]
+    assert ml_similarity.seleziona_top_k(similarita, ids, 0).tolist() == []
+    assert ml_similarity.seleziona_top_k(np.array([]), np.array([]), 3).tolist() == []
+
+
+def test_seleziona_top_k_pari_merito_sulla_soglia_per_id():
+    # 📌 Quattro righe pari merito sulla soglia del secondo posto: passano quelle con id più basso,
+    # qualunque sia la loro posizione
+    similarita = np.array([0.5, 0.9, 0.5, 0.5, 0.5, 0.1])
+    ids = np.array([7, 1, 3, 9, 2, 4])
+
+    assert ml_similarity.seleziona_top_k(similarita, ids, 3).tolist() == [1, 4, 2]
+    assert ml_similarity.seleziona_top_k(similarita[::-1], ids[::-1], 3).tolist() == [4, 1, 3]
@@ -0,0 +1,61 @@
+import signal
+import time
+
+import pytest
+
+from app import pdf_processor
+from benchmarks.corpus import genera_pdf
+
+
+def _bloccato(secondi):
+    # 📌 Come un worker fermo nel codice nativo: l'allarme non lo interrompe
+    signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGALRM])
+    time.sleep(secondi)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pdf_processor.chiudi_pool_pdf(termina=True)
+    monkeypatch.setattr(pdf_processor, "PROCESSI_PDF", 1)
+    yield pdf_processor.pool_pdf()
+    pdf_processor.chiudi_pool_pdf(termina=True)
+
+
+def test_worker_bloccato_terminato_con_il_pool(pool, monkeypatch):
+    monkeypatch.setattr(pdf_processor, "MARGINE_TIMEOUT", 0.2)
+    futuro = pool.submit(_bloccato, 60)
+
+    with pytest.raises(pdf_processor.WorkerBloccato):
+        pdf_processor._testo_pagina(futuro, 0.1)
+
+    processi = list(pool._processes.values())
+    assert pdf_processor.chiudi_pool_pdf(pool, termina=True)
+    for processo in processi:
+        processo.join(5)
+        assert not processo.is_alive()
+    # 📌 Già chiuso: un secondo documento che se ne accorge non lo conta come suo crash
+    assert not pdf_processor.chiudi_pool_pdf(pool, termina=True)
+    assert pdf_processor.pool_pdf() is not pool
+
+
+def test_attesa_di_un_worker_limitata(pool, monkeypatch):
+    monkeypatch.setattr(pdf_processor, "ATTESA_WORKER", 0.3)
+    # 📌 Un worker occupato e una pagina già passata alla sua coda: la terza resta in attesa
+    occupati = [pool.submit(_bloccato, 60), pool.submit(_bloccato, 60)]
+    in_coda = pool.submit(time.sleep, 0)
+
+    inizio = time.monotonic()
+    assert pdf_processor._testo_pagina(in_coda, 60) is None
+    assert time.monotonic() - inizio < 5
+    assert in_coda.cancelled()
+    assert all(not futuro.done() for futuro in occupati)
+
+
+def test_estrazione_in_parallelo(tmp_path):
+    percorso = genera_pdf(str(tmp_path / "documento.pdf"), 20)
+
+    pagine = list(pdf_processor.iter_pdf_pages(percorso, processi=2))
+
+    assert [numero for numero, _ in pagine] == list(range(1, 21))
+    assert all(f"della pagina {numero}:" in testo for numero, testo in pagine)
+    pdf_processor.chiudi_pool_pdf()
@@ -0,0 +1,39 @@
+import pytest
+
+from app.database import chiudi_connessioni
+from app.pipeline_report import ArchivioReport
+
+
+class Orologio:
+    def __init__(self):
+        self.adesso = 1000.0
+
+    def __call__(self):
+        return self.adesso
+
+
+@pytest.fixture
+def percorso(tmp_path):
+    yield str(tmp_path / "report.sqlite")
+    chiudi_connessioni()
+
+
+def test_report_letto_da_un_altro_processo(percorso):
+    ArchivioReport(percorso).scrivi("abc", b"%PDF-1.4 ...")
+
+    assert ArchivioReport(percorso).leggi("abc") == b"%PDF-1.4 ..."
+    assert ArchivioReport(percorso).leggi("inesistente") is None
+
+
+def test_scadenza_e_limite_di_voci(percorso):
+    orologio = Orologio()
+    archivio = ArchivioReport(percorso, max_voci=2, ttl=60, orologio=orologio)
+    for i in range(3):
+        archivio.scrivi(f"r{i}", b"pdf")
+        orologio.adesso += 1
+
+    assert archivio.leggi("r0") is None
+    assert archivio.leggi("r2") == b"pdf"
+
+    orologio.adesso += 60
+    assert archivio.leggi("r2") is None